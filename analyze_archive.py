@@ -0,0 +1,291 @@
+# analyze_archive.py
+"""
+Offline tone and concern analysis of archived session recordings.
+
+Walks a directory of audio files and shards them across a process pool. Each
+file is decoded to mono 16 kHz (server/audio_ingest.py; compressed formats
+need ffmpeg), run through the framed tone feature engine and scored. If a
+transcript is available (a `.txt` next to the recording, or at the same
+relative path under --transcripts), keyword concerns and safety flags are
+added.
+
+Output directory layout:
+  part-00000.npz / .parquet   one shard per --shard-size files: summary
+                              columns plus the per-frame RMS/ZCR/pitch/voicing
+                              tracks (NPZ: concatenated arrays + offsets;
+                              Parquet: list columns, when pyarrow is installed)
+  index.jsonl                 one line per analysed file: path, size, mtime,
+                              shard, row, tone, concerns, error
+
+Results are written shard by shard as workers finish, with at most a few
+files in flight per worker, so memory stays flat however large the corpus is.
+A shard is written atomically before its index lines are appended; rerunning
+the same command skips files already in the index (same size and mtime), so
+an interrupted run resumes where its last complete shard ended. Files that
+failed are indexed with their error and only retried with --retry-failed.
+
+    python analyze_archive.py recordings/ --out analysis/ --workers 8
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from server.audio_features import FeatureExtractor, FrameFeatures
+from server.audio_ingest import decode_audio, TARGET_SAMPLE_RATE
+from server.tone_stream import classify_tone
+from voice_concerns import detect_concerns, check_safety_concerns
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+AUDIO_EXTENSIONS = {".wav", ".webm", ".ogg", ".opus", ".mp3", ".flac", ".m4a", ".mp4"}
+INDEX_FILE = "index.jsonl"
+SUMMARY_COLUMNS = ("volume_mean", "volume_std", "pitch_mean", "pitch_variance", "speech_rate",
+                   "clarity", "zcr_mean", "voiced_ratio")
+TRACKS = ("rms", "zcr", "pitch", "voicing")
+IN_FLIGHT_PER_WORKER = 4
+
+_extractor: Optional[FeatureExtractor] = None
+
+
+# --- Discovery ---
+def iter_audio_files(root: str) -> Iterator[str]:
+    """Audio files under `root` in a stable order, without listing the whole tree up front."""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+        except OSError as e:
+            print(f"⚠️ Skipping {directory}: {e}")
+            continue
+        subdirs = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif os.path.splitext(entry.name)[1].lower() in AUDIO_EXTENSIONS:
+                yield entry.path
+        stack.extend(reversed(subdirs))
+
+
+def _transcript_for(path: str, root: str, transcripts_dir: Optional[str]) -> Optional[str]:
+    candidates = [os.path.splitext(path)[0] + ".txt"]
+    if transcripts_dir:
+        relative = os.path.relpath(path, root)
+        candidates.insert(0, os.path.join(transcripts_dir, os.path.splitext(relative)[0] + ".txt"))
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            with open(candidate, "r", encoding="utf-8", errors="replace") as f:
+                return f.read().strip()
+    return None
+
+
+# --- Worker ---
+def analyze_file(path: str, root: str, transcripts_dir: Optional[str]) -> Tuple[Dict, Optional[np.ndarray]]:
+    """
+    Runs in a worker process. Returns the index record and the (4, n_frames)
+    float32 feature tracks (None if the file couldn't be decoded).
+    """
+    global _extractor
+    if _extractor is None:
+        _extractor = FeatureExtractor(TARGET_SAMPLE_RATE)
+    stat = os.stat(path)
+    record = {"path": os.path.relpath(path, root), "size": stat.st_size, "mtime": stat.st_mtime}
+    try:
+        with open(path, "rb") as f:
+            decoded = decode_audio(f.read())
+        if decoded is None:
+            record["error"] = "undecodable"
+            return record, None
+        frames: FrameFeatures = _extractor.extract(decoded.samples())
+        summary = frames.summary()
+        tone, confidence = classify_tone(summary)
+        record.update(duration=round(decoded.duration, 3), source_format=decoded.source_format,
+                      tone=tone, confidence=confidence, summary=summary)
+        transcript = _transcript_for(path, root, transcripts_dir)
+        if transcript is not None:
+            record.update(transcript=transcript, concerns=detect_concerns(transcript),
+                          safety_alert=check_safety_concerns(transcript))
+        return record, np.stack([frames.rms, frames.zcr, frames.pitch, frames.voicing])
+    except Exception as e:
+        record["error"] = str(e)[:200]
+        return record, None
+
+
+# --- Output ---
+class ShardWriter:
+    """Buffers up to `shard_size` results and writes each full shard atomically."""
+
+    def __init__(self, out_dir: str, shard_size: int, fmt: str):
+        self.out_dir = out_dir
+        self.shard_size = shard_size
+        self.fmt = fmt
+        self.records: List[Dict] = []
+        self.tracks: List[np.ndarray] = []
+        self.next_shard = self._first_free_shard()
+        self.index = open(os.path.join(out_dir, INDEX_FILE), "a", encoding="utf-8")
+
+    def _first_free_shard(self) -> int:
+        # Continue after every existing part, including orphans of an interrupted run
+        numbers = [int(name[5:10]) for name in os.listdir(self.out_dir)
+                   if name.startswith("part-") and name[5:10].isdigit()]
+        return max(numbers, default=-1) + 1
+
+    def add(self, record: Dict, tracks: Optional[np.ndarray]):
+        self.records.append(record)
+        self.tracks.append(tracks if tracks is not None else np.empty((len(TRACKS), 0), dtype=np.float32))
+        if len(self.records) >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        if not self.records:
+            return
+        name = f"part-{self.next_shard:05d}.{self.fmt}"
+        path = os.path.join(self.out_dir, name)
+        tmp = path + ".tmp"
+        if self.fmt == "parquet":
+            self._write_parquet(tmp)
+        else:
+            self._write_npz(tmp)
+        os.replace(tmp, path)
+        for row, record in enumerate(self.records):
+            self.index.write(json.dumps({**record, "shard": name, "row": row}) + "\n")
+        self.index.flush()
+        os.fsync(self.index.fileno())
+        self.next_shard += 1
+        self.records, self.tracks = [], []
+
+    def _summary_column(self, key: str) -> np.ndarray:
+        return np.array([record.get("summary", {}).get(key, np.nan) for record in self.records], dtype=np.float32)
+
+    def _write_npz(self, path: str):
+        lengths = np.array([t.shape[1] for t in self.tracks], dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        joined = np.concatenate(self.tracks, axis=1)
+        columns = {f"summary_{key}": self._summary_column(key) for key in SUMMARY_COLUMNS}
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                path=np.array([record["path"] for record in self.records]),
+                tone=np.array([record.get("tone", "") for record in self.records]),
+                confidence=np.array([record.get("confidence", np.nan) for record in self.records], dtype=np.float32),
+                frame_offsets=offsets,
+                **{track: joined[i] for i, track in enumerate(TRACKS)},
+                **columns,
+            )
+
+    def _write_parquet(self, path: str):
+        columns = {
+            "path": [record["path"] for record in self.records],
+            "tone": [record.get("tone") for record in self.records],
+            "confidence": [record.get("confidence") for record in self.records],
+            "concerns": [record.get("concerns") for record in self.records],
+            "safety_alert": [record.get("safety_alert") for record in self.records],
+        }
+        for key in SUMMARY_COLUMNS:
+            columns[key] = self._summary_column(key)
+        for i, track in enumerate(TRACKS):
+            columns[track] = [t[i] for t in self.tracks]
+        pq.write_table(pa.table(columns), path)
+
+    def close(self):
+        self.flush()
+        self.index.close()
+
+
+def load_done(out_dir: str, retry_failed: bool = False) -> Dict[str, Tuple[int, float]]:
+    """path -> (size, mtime) of files already in the index."""
+    done = {}
+    index_path = os.path.join(out_dir, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return done
+    with open(index_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # a torn last line from an interrupted run
+            if retry_failed and "error" in record:
+                continue
+            done[record["path"]] = (record["size"], record["mtime"])
+    return done
+
+
+# --- Driver ---
+def run(root: str, out_dir: str, workers: int, shard_size: int, fmt: str,
+        transcripts_dir: Optional[str] = None, retry_failed: bool = False) -> Dict[str, int]:
+    os.makedirs(out_dir, exist_ok=True)
+    done = load_done(out_dir, retry_failed)
+    writer = ShardWriter(out_dir, shard_size, fmt)
+    counts = {"analysed": 0, "skipped": 0, "failed": 0}
+    started = time.perf_counter()
+
+    def pending_files():
+        for path in iter_audio_files(root):
+            stat = os.stat(path)
+            if done.get(os.path.relpath(path, root)) == (stat.st_size, stat.st_mtime):
+                counts["skipped"] += 1
+                continue
+            yield path
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            files = pending_files()
+            in_flight = set()
+            while True:
+                # Keep a bounded number of files queued so memory doesn't grow with the corpus
+                while len(in_flight) < workers * IN_FLIGHT_PER_WORKER:
+                    path = next(files, None)
+                    if path is None:
+                        break
+                    in_flight.add(pool.submit(analyze_file, path, root, transcripts_dir))
+                if not in_flight:
+                    break
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    record, tracks = future.result()
+                    writer.add(record, tracks)
+                    counts["failed" if "error" in record else "analysed"] += 1
+                    total = counts["analysed"] + counts["failed"]
+                    if total % 100 == 0:
+                        rate = total / (time.perf_counter() - started)
+                        print(f"📼 {total} files analysed ({rate:.1f} files/s)")
+    finally:
+        writer.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recordings", help="directory of audio files (searched recursively)")
+    parser.add_argument("--out", required=True, help="output directory (reused to resume)")
+    parser.add_argument("--transcripts", help="directory mirroring the recordings with .txt transcripts")
+    parser.add_argument("--workers", type=int, default=max((os.cpu_count() or 2) - 1, 1))
+    parser.add_argument("--shard-size", type=int, default=256, help="files per output shard")
+    parser.add_argument("--format", choices=("auto", "parquet", "npz"), default="auto")
+    parser.add_argument("--retry-failed", action="store_true", help="re-analyse files that failed last time")
+    args = parser.parse_args()
+
+    fmt = args.format
+    if fmt == "auto":
+        fmt = "parquet" if pq is not None else "npz"
+    elif fmt == "parquet" and pq is None:
+        sys.exit("❌ --format parquet needs pyarrow (pip install pyarrow), or use --format npz")
+
+    started = time.perf_counter()
+    counts = run(args.recordings, args.out, args.workers, args.shard_size, fmt, args.transcripts, args.retry_failed)
+    print(f"✅ {counts['analysed']} analysed, {counts['failed']} failed, {counts['skipped']} already done "
+          f"in {time.perf_counter() - started:.1f}s -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# bench_envelope.py
+"""
+Voice message envelope benchmark: inline base64 vs blob references.
+
+For clips of increasing length, builds the JSON envelope a VoiceMessage would
+travel in, once with the audio inline as base64 and once with only a sha256
+digest and blob URL (server/blob_store.py), and reports envelope size plus
+the CPU spent encoding and decoding each way. The reference path includes
+hashing and storing the blob and reading it back as a memoryview, but not
+the HTTP round trip.
+
+    python bench_envelope.py --repeat 20
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from server.blob_store import BlobStore
+
+SAMPLE_RATE = 16000
+
+
+def best_of(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def envelope(**fields) -> str:
+    return json.dumps({"session_id": "bench-session", "age": 9, "timestamp": "2024-01-01T00:00:00", **fields})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    store = BlobStore(root=tempfile.mkdtemp(prefix="capy-blobs-"))
+    url_prefix = "http://localhost:8000/blobs/"
+    print(f"{'clip':>6} {'audio':>9} | {'inline env':>10} {'enc ms':>7} {'dec ms':>7} | "
+          f"{'ref env':>7} {'enc ms':>7} {'dec ms':>7}")
+    for seconds in (1, 5, 15, 30, 60):
+        # 16 kHz 16-bit mono; random bytes so nothing compresses away
+        audio = os.urandom(seconds * SAMPLE_RATE * 2)
+
+        def encode_inline():
+            return envelope(audio_data=base64.b64encode(audio).decode("ascii"))
+
+        inline = encode_inline()
+
+        def decode_inline():
+            return base64.b64decode(json.loads(inline)["audio_data"])
+
+        def encode_ref():
+            digest = store.put(audio)
+            return envelope(audio_data="", audio_hash=digest, audio_url=url_prefix + digest)
+
+        reference = encode_ref()
+
+        def decode_ref():
+            message = json.loads(reference)
+            view = store.get(message["audio_hash"])
+            # What the receiver does after fetching: check the digest
+            return hashlib.sha256(view).hexdigest() == message["audio_hash"]
+
+        timings = [best_of(fn, args.repeat) * 1000 for fn in (encode_inline, decode_inline, encode_ref, decode_ref)]
+        print(f"{seconds:5d}s {len(audio) / 1024:8.0f}K | {len(inline) / 1024:9.0f}K {timings[0]:7.2f} {timings[1]:7.2f} | "
+              f"{len(reference):6d}B {timings[2]:7.2f} {timings[3]:7.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# bench_features.py
+"""
+Throughput benchmark for the framed tone feature engine (server/audio_features.py).
+
+Times FeatureExtractor.extract on synthetic voiced clips from 1 to 60 seconds,
+then extract_batch on many short clips at once, and reports audio seconds
+processed per wall-clock second.
+
+    python bench_features.py --repeat 5
+"""
+import argparse
+import time
+
+import numpy as np
+
+from server.audio_features import FeatureExtractor
+
+SAMPLE_RATE = 16000
+
+
+def synthetic_speech(seconds: float, seed: int = 0) -> np.ndarray:
+    """int16 mono: a gliding voiced tone in syllable-length bursts over light noise."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    pitch = 220 + 60 * np.sin(2 * np.pi * 0.7 * t)
+    signal = 0.3 * np.sin(2 * np.pi * np.cumsum(pitch) / SAMPLE_RATE) * (np.sin(2 * np.pi * 4 * t) > 0)
+    signal += 0.005 * rng.standard_normal(len(t))
+    return np.clip(signal * 32767, -32768, 32767).astype(np.int16)
+
+
+def best_of(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--batch", type=int, default=64, help="clips in the batch run")
+    args = parser.parse_args()
+
+    extractor = FeatureExtractor(SAMPLE_RATE)
+    print("🎚️ Single clips")
+    for seconds in (1, 5, 15, 30, 60):
+        clip = synthetic_speech(seconds)
+        elapsed = best_of(lambda: extractor.extract(clip), args.repeat)
+        frames = extractor.n_frames(len(clip))
+        print(f"   {seconds:3d}s  {frames:5d} frames  {elapsed * 1000:8.2f} ms  {seconds / elapsed:8.0f}x realtime")
+
+    clips = [synthetic_speech(1 + i % 5, seed=i) for i in range(args.batch)]
+    total = sum(len(c) for c in clips) / SAMPLE_RATE
+    one_by_one = best_of(lambda: [extractor.extract(c) for c in clips], args.repeat)
+    batched = best_of(lambda: extractor.extract_batch(clips), args.repeat)
+    print(f"📦 {args.batch} clips ({total:.0f}s of audio)")
+    print(f"   one by one: {one_by_one * 1000:8.2f} ms  {total / one_by_one:8.0f}x realtime")
+    print(f"   batch:      {batched * 1000:8.2f} ms  {total / batched:8.0f}x realtime")
+
+
+if __name__ == "__main__":
+    main()
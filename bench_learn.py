@@ -0,0 +1,131 @@
+# bench_learn.py
+"""
+Restart-to-ready benchmark for the mental health agent's session store.
+
+Fills a SessionStore (session_store.py) with synthetic sessions shaped like
+ConversationManager's (history turns, topics set, concerns, escalation
+state), writes a snapshot, then updates a fraction of them so they sit in the
+delta log. It then reopens the store several times as a restarting agent
+would and reports the time until it can serve requests, the latency of first
+(cold) and repeat lookups, and the file sizes. For comparison it times loading
+the same sessions from a single pickle of the whole dict.
+
+    python bench_learn.py --sessions 100000 --turns 6
+"""
+import argparse
+import os
+import pickle
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+from escalation_rules import EscalationState
+from session_store import SessionStore, SNAPSHOT_FILE, LOG_FILE
+
+MESSAGES = [
+    "I'm stressed about homework.",
+    "I feel tired all the time.",
+    "my friends did not want to play with me at recess",
+    "I'm worried about the future.",
+    "today was ok, we went to the park after school",
+]
+
+
+def synthetic_session(rng: random.Random, turns: int) -> dict:
+    history = []
+    for _ in range(turns):
+        history.append({
+            'user': rng.choice(MESSAGES),
+            'agent': "Thanks for telling me that. Can you say more about how you're feeling?",
+            'timestamp': datetime.now().isoformat()
+        })
+    return {
+        'history': history,
+        'start_time': datetime.now(),
+        'topics_discussed': {"school", "friends"},
+        'concerns_detected': ["potential_anxiety"] * rng.randint(0, 3),
+        'risk_level': 'low',
+        'escalation': EscalationState()
+    }
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=100000)
+    parser.add_argument("--turns", type=int, default=6, help="history turns per session")
+    parser.add_argument("--logged", type=float, default=0.1, help="fraction of sessions updated after the snapshot")
+    parser.add_argument("--restarts", type=int, default=5)
+    parser.add_argument("--lookups", type=int, default=1000)
+    parser.add_argument("--dir", help="store directory (default: a temporary one, removed afterwards)")
+    args = parser.parse_args()
+
+    directory = args.dir or tempfile.mkdtemp(prefix="capy-sessions-")
+    rng = random.Random(0)
+    ids = [f"session-{i:07d}" for i in range(args.sessions)]
+    try:
+        # --- build ---
+        store = SessionStore(directory, max_resident=args.sessions + 1, log_max_bytes=1 << 62)
+        build = time.perf_counter()
+        sessions = {}
+        for session_id in ids:
+            sessions[session_id] = store[session_id] = synthetic_session(rng, args.turns)
+        snapshot_seconds, _ = timed(store.snapshot)
+        for session_id in rng.sample(ids, int(args.sessions * args.logged)):
+            store.get(session_id)['history'].append({'user': "still here", 'agent': "Glad you're back.",
+                                                     'timestamp': datetime.now().isoformat()})
+        store.close(snapshot=False)
+        print(f"🗄️ {args.sessions} sessions x {args.turns} turns built in {time.perf_counter() - build:.1f}s "
+              f"(snapshot write {snapshot_seconds:.2f}s)")
+        snap_bytes = os.path.getsize(os.path.join(directory, SNAPSHOT_FILE))
+        log_bytes = os.path.getsize(os.path.join(directory, LOG_FILE))
+        print(f"   snapshot {snap_bytes / 2**20:.1f} MiB ({snap_bytes / args.sessions:.0f} B/session), "
+              f"log {log_bytes / 2**20:.1f} MiB ({args.logged:.0%} of sessions)")
+
+        # --- restart ---
+        ready, first, repeat = [], [], []
+        for _ in range(args.restarts):
+            seconds, store = timed(lambda: SessionStore(directory))
+            ready.append(seconds)
+            sample = rng.sample(ids, min(args.lookups, len(ids)))
+            started = time.perf_counter()
+            for session_id in sample:
+                store.get(session_id)
+            first.append((time.perf_counter() - started) / len(sample))
+            started = time.perf_counter()
+            for session_id in sample:
+                store.get(session_id)
+            repeat.append((time.perf_counter() - started) / len(sample))
+            assert len(store[sample[0]]['history']) >= args.turns
+            store.close(snapshot=False)
+        print(f"🚀 restart-to-ready over {args.restarts} runs: median {statistics.median(ready) * 1000:.1f} ms, "
+              f"best {min(ready) * 1000:.1f} ms")
+        print(f"   cold lookup {statistics.median(first) * 1e6:.1f} µs, warm {statistics.median(repeat) * 1e6:.2f} µs")
+
+        # --- baseline: one pickle of the whole dict ---
+        baseline = os.path.join(directory, "baseline.pkl")
+        with open(baseline, "wb") as f:
+            pickle.dump(sessions, f, protocol=pickle.HIGHEST_PROTOCOL)
+        del sessions
+
+        def load_all():
+            with open(baseline, "rb") as f:
+                return pickle.load(f)
+
+        seconds, _ = timed(load_all)
+        print(f"   (whole-dict pickle: {os.path.getsize(baseline) / 2**20:.1f} MiB, load {seconds * 1000:.0f} ms)")
+    finally:
+        if not args.dir:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+# bench_voice.py
+"""
+Benchmarks for the voice agent.
+
+Throughput: synthetic speech-like clips are pushed through
+VoiceMentalHealthEngine, once one message at a time on the blocking path and
+once with many sessions in flight on the async path. Google STT and gTTS are
+replaced by sleeps of realistic length so the numbers don't depend on the
+network; tone analysis is the real NumPy code.
+
+    python bench_voice.py --messages 64 --concurrency 16 --stt-ms 600 --tts-ms 400
+
+Session memory: simulates many sessions through VoiceSessionStore and tracks
+traced memory with tracemalloc; exits non-zero if it keeps growing once the
+store is full.
+
+    python bench_voice.py --memory-sessions 10000
+
+Cold start: imports voice_agent in fresh interpreters (headless by default)
+and reports wall time plus the slowest imports from `-X importtime`.
+
+    python bench_voice.py --startup 5
+"""
+import argparse
+import asyncio
+import io
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import wave
+
+import numpy as np
+
+from voice_sessions import VoiceSessionStore
+
+SAMPLE_RATE = 16000
+
+
+def synthetic_clip(seconds: float, seed: int = 0) -> bytes:
+    """A WAV clip of voiced-sounding tones with pauses and a little noise."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    pitch = 180 + 40 * np.sin(2 * np.pi * 0.5 * t)
+    signal = 0.3 * np.sin(2 * np.pi * np.cumsum(pitch) / SAMPLE_RATE)
+    signal *= (np.sin(2 * np.pi * 3 * t) > -0.3)
+    signal += 0.01 * rng.standard_normal(len(t))
+    pcm = np.clip(signal * 32767, -32768, 32767).astype("<i2").tobytes()
+    out = io.BytesIO()
+    with wave.open(out, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(pcm)
+    return out.getvalue()
+
+
+def stub_network(stt_seconds: float, tts_seconds: float):
+    """Replaces the blocking Google STT / gTTS calls with sleeps of the same shape."""
+    from voice_agent import voice_engine
+    processor = voice_engine.voice_processor
+
+    def audio_to_text(audio_data):
+        time.sleep(stt_seconds)
+        return "i feel a bit worried about school today", 0.9
+
+    def text_to_speech(text):
+        time.sleep(tts_seconds)
+        return b"\x00" * 4096
+
+    processor.audio_to_text = audio_to_text
+    processor.text_to_speech = text_to_speech
+
+
+def run_blocking(clips) -> float:
+    from voice_agent import voice_engine
+    started = time.perf_counter()
+    for i, clip in enumerate(clips):
+        voice_engine.process_voice_message(clip, f"bench-{i}", 10)
+    return time.perf_counter() - started
+
+
+async def run_async(clips, concurrency: int) -> float:
+    import voice_agent
+    from voice_agent import voice_engine
+    from voice_tone import analyze_tone_features
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one(i, clip):
+        async with limit:
+            await voice_engine.process_voice_message_async(clip, f"bench-{i}", 10)
+
+    # Start the process pool outside the timed section
+    await asyncio.get_running_loop().run_in_executor(voice_agent.cpu_pool(), analyze_tone_features, b"")
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i, clip) for i, clip in enumerate(clips)))
+    return time.perf_counter() - started
+
+
+def run_memory(sessions: int, turns: int, max_sessions: int) -> bool:
+    """Drives `sessions` sessions through a store capped at `max_sessions`; True if memory stayed flat."""
+    store = VoiceSessionStore(max_sessions=max_sessions)
+    points = [{"t": i * 0.5, "emotion": "calm", "confidence": 0.3} for i in range(8)]
+    text = "i had a really long day at school and my friends did not want to play with me"
+    checkpoints = []
+    tracemalloc.start()
+    for i in range(sessions):
+        for _ in range(turns):
+            store.record_turn(f"session-{i}", text, "sad", 0.6, ["depression"], points)
+        if (i + 1) % max(sessions // 10, 1) == 0:
+            current, _ = tracemalloc.get_traced_memory()
+            checkpoints.append((i + 1, current))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"🧠 {sessions} sessions x {turns} turns, store capped at {max_sessions} (resident {len(store)})")
+    for count, current in checkpoints:
+        print(f"   after {count:6d} sessions: {current / 1024:9.1f} KiB")
+    print(f"   peak: {peak / 1024:.1f} KiB")
+    # Once the store is full, further sessions must not add memory (allow 10% noise)
+    full = [current for count, current in checkpoints if count >= max_sessions]
+    bounded = len(full) < 2 or full[-1] <= full[0] * 1.1
+    print("   ✅ bounded" if bounded else "   ❌ memory kept growing")
+    return bounded
+
+
+def run_startup(runs: int, headless: bool):
+    """Times `import voice_agent` in fresh interpreters."""
+    env = dict(os.environ, VOICE_HEADLESS="1" if headless else "0")
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", "import voice_agent"], env=env,
+                                capture_output=True, text=True)
+        timings.append(time.perf_counter() - started)
+        if result.returncode != 0:
+            print(f"❌ import voice_agent failed:\n{result.stderr.strip()[-800:]}")
+            return
+    profile = subprocess.run([sys.executable, "-X", "importtime", "-c", "import voice_agent"], env=env,
+                             capture_output=True, text=True)
+    # "import time: self [us] | cumulative | imported package", two spaces of indent per
+    # nesting level; a module's imports are listed before the module itself
+    children, pending, total = [], [], None
+    for line in profile.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2][1:]
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        if depth == 1:
+            pending.append((int(parts[1]), name.strip()))
+        elif depth == 0:
+            if name.strip() == "voice_agent":
+                children, total = pending, int(parts[1])
+            pending = []
+
+    print(f"🚀 import voice_agent ({'headless' if headless else 'with audio devices'}), {runs} runs")
+    print(f"   median {statistics.median(timings) * 1000:.0f} ms, best {min(timings) * 1000:.0f} ms")
+    if total is not None:
+        print(f"   {total / 1000:8.1f} ms  voice_agent (cumulative), slowest direct imports:")
+    for us, name in sorted(children, reverse=True)[:8]:
+        print(f"   {us / 1000:8.1f} ms  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=4.0, help="clip length")
+    parser.add_argument("--stt-ms", type=float, default=600.0)
+    parser.add_argument("--tts-ms", type=float, default=400.0)
+    parser.add_argument("--memory-sessions", type=int, default=0,
+                        help="run the session-store memory check with this many sessions instead")
+    parser.add_argument("--memory-turns", type=int, default=3)
+    parser.add_argument("--max-sessions", type=int, default=1000)
+    parser.add_argument("--startup", type=int, default=0, metavar="RUNS",
+                        help="measure cold-start import time over RUNS fresh interpreters instead")
+    parser.add_argument("--with-devices", action="store_true", help="cold start without VOICE_HEADLESS")
+    args = parser.parse_args()
+
+    if args.startup:
+        run_startup(args.startup, headless=not args.with_devices)
+        return
+
+    if args.memory_sessions:
+        sys.exit(0 if run_memory(args.memory_sessions, args.memory_turns, args.max_sessions) else 1)
+
+    stub_network(args.stt_ms / 1000, args.tts_ms / 1000)
+    clips = [synthetic_clip(args.seconds, seed=i) for i in range(args.messages)]
+
+    blocking = run_blocking(clips)
+    concurrent = asyncio.run(run_async(clips, args.concurrency))
+
+    print(f"🎙️ {args.messages} messages of {args.seconds:.1f}s "
+          f"(STT {args.stt_ms:.0f} ms, TTS {args.tts_ms:.0f} ms simulated)")
+    print(f"   blocking:   {blocking:7.2f}s  {args.messages / blocking:7.2f} msg/s")
+    print(f"   async x{args.concurrency:<3} {concurrent:7.2f}s  {args.messages / concurrent:7.2f} msg/s"
+          f"  ({blocking / concurrent:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,16 @@
 # Integrate chat LLM and build chat agent 
 # Allow agents to exchange text 
 
-import json
-import random
 from uagents import Agent, Context, Model
 
+from server.response_index import ResponseIndex
+
 #message schema
 class Message(Model):
     message: str
 
-#load JSON responses 
-with open("responses.json", "r", encoding="utf-8") as f:
-    RESPONSE_DB = json.load(f)
+#load responses: compiled index (compile_responses.py) + responses.json + data/responses/*.json, reloaded when they change
+RESPONSE_INDEX = ResponseIndex()
 
 #create chat agent
 chat_agent = Agent(
@@ -23,13 +22,10 @@ chat_agent = Agent(
 )
 
 def find_reply(user_text: str) -> str:
-    """Find a suitable reply from the RESPONSE_DB based on keywords in user_text."""
-    user_text_lower = user_text.lower()
-    
-    for entry in RESPONSE_DB:
-        for keyword in entry["keywords"]:
-            if keyword in user_text_lower:
-                return random.choice(entry["responses"])
+    """Find the reply whose patterns best match user_text (TF-IDF cosine over RESPONSE_INDEX)."""
+    reply = RESPONSE_INDEX.reply(user_text)
+    if reply is not None:
+        return reply
     return "Hmm, can you tell me a bit more about that? 😊"
 
 @chat_agent.on_message(model=Message)
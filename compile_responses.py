@@ -0,0 +1,210 @@
+# compile_responses.py
+"""
+Compiles the response sources into the binary index the chat agent and the
+LLM fallback load at startup (server/response_index.py).
+
+The learning log (data/learning_log.json, a list of {"user", "bot"} pairs) is
+cleaned first:
+  * text is repaired where UTF-8 was decoded as cp1252 ("Itâ€™s" -> "It’s")
+    and whitespace is collapsed
+  * error rows are dropped: placeholders like "[transcription error]" on the
+    user side, and replies matching ERROR_REPLY_PATTERNS
+  * stub replies are dropped: a bare greeting ("Hi there!") is only kept as the
+    answer to a greeting, and other replies need MIN_REPLY_TOKENS words
+  * repeats are merged: one entry per distinct user message (compared by
+    tokens, so case and punctuation don't matter) with its distinct replies
+
+A full build merges the log with responses.json and data/responses/*.json into
+one segment and records the source files' mtimes in the manifest. With
+--append, only log rows added since the last build are compiled, into a new
+segment, and pairs already in an earlier segment are skipped. After
+MAX_SEGMENTS appends, or when the log has been rewritten, the next run does a
+full build instead.
+
+    python compile_responses.py                 # full build
+    python compile_responses.py --append        # just the new log rows
+"""
+import argparse
+import json
+import os
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from server.response_index import (
+    COMPILED_INDEX_DIR, RESPONSES_DIR, RESPONSES_FILE, IndexSegment, load_sources, pair_key,
+    read_manifest, source_files, source_signature, tokenize, write_manifest,
+)
+
+LEARNING_LOG = os.path.join("data", "learning_log.json")
+FORMAT_VERSION = 1
+MAX_SEGMENTS = 8
+
+ERROR_REPLY_PATTERNS = [
+    re.compile(r"^sorry,? i couldn'?t'? process", re.IGNORECASE),
+    re.compile(r"^i had a (little )?(problem|trouble)", re.IGNORECASE),
+]
+MIN_REPLY_TOKENS = 3
+GREETING_WORDS = {"hi", "hello", "hey", "hiya", "howdy", "there", "good", "morning", "afternoon", "evening"}
+_PLACEHOLDER_RE = re.compile(r"^\[[^\]]*\]$")
+_MOJIBAKE_MARKERS = ("â€", "Ã", "Â", "ðŸ")
+
+
+# --- Cleaning ---
+def fix_mojibake(text: str) -> str:
+    """Undoes UTF-8 text that was decoded as cp1252, when that is what happened."""
+    if not any(marker in text for marker in _MOJIBAKE_MARKERS):
+        return text
+    try:
+        return text.encode("cp1252").decode("utf-8")
+    except UnicodeError:
+        return text
+
+
+def clean_text(text) -> str:
+    return " ".join(fix_mojibake(text).split()) if isinstance(text, str) else ""
+
+
+def is_greeting(text: str) -> bool:
+    tokens = tokenize(text)
+    return bool(tokens) and all(token in GREETING_WORDS for token in tokens)
+
+
+def is_error_row(user: str, bot: str) -> bool:
+    if not user or not bot or _PLACEHOLDER_RE.match(user) or not tokenize(user):
+        return True
+    if any(pattern.search(bot) for pattern in ERROR_REPLY_PATTERNS):
+        return True
+    # Stub replies: a greeting answering something else, or too short to be an answer
+    if is_greeting(user) and is_greeting(bot):
+        return False
+    return is_greeting(bot) or len(tokenize(bot)) < MIN_REPLY_TOKENS
+
+
+def read_log(path: str) -> List[Dict]:
+    """The learning log's rows; also accepts one JSON object per line."""
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        raw = f.read()
+    try:
+        rows = json.loads(raw)
+    except ValueError:
+        rows = [json.loads(line) for line in raw.splitlines() if line.strip()]
+    return [row for row in rows if isinstance(row, dict)]
+
+
+def log_entries(rows: List[Dict], seen: Optional[np.ndarray] = None) -> Tuple[List[Tuple[List[str], List[str]]], int]:
+    """(entries, dropped rows); pairs whose key is in `seen` count as duplicates."""
+    grouped: Dict[str, Tuple[str, Dict[str, str]]] = {}
+    dropped = 0
+    for row in rows:
+        user, bot = clean_text(row.get("user")), clean_text(row.get("bot"))
+        if is_error_row(user, bot):
+            dropped += 1
+            continue
+        if seen is not None and len(seen):
+            key = np.uint64(pair_key(user, bot))
+            position = np.searchsorted(seen, key)
+            if position < len(seen) and seen[position] == key:
+                dropped += 1
+                continue
+        pattern, replies = grouped.setdefault(" ".join(tokenize(user)), (user, {}))
+        if bot.lower() in replies:
+            dropped += 1
+        replies.setdefault(bot.lower(), bot)
+    return [([pattern], list(replies.values())) for pattern, replies in grouped.values()], dropped
+
+
+# --- Building ---
+def _segment_name(directory: str) -> str:
+    numbers = [int(name[4:9]) for name in os.listdir(directory) if name.startswith("seg-") and name[4:9].isdigit()]
+    return f"seg-{max(numbers, default=-1) + 1:05d}.idx"
+
+
+def _remove_unlisted(directory: str, manifest: Dict):
+    keep = {segment["file"] for segment in manifest["segments"]}
+    for name in os.listdir(directory):
+        if name.startswith("seg-") and name not in keep:
+            os.remove(os.path.join(directory, name))
+
+
+def full_build(directory: str, log_path: str, rows: List[Dict], responses_file: str, responses_dir: str) -> Dict:
+    sources = source_files(responses_file, responses_dir)
+    source_entries = load_sources(sources)
+    entries, dropped = log_entries(rows)
+    segment = IndexSegment.build(source_entries + entries)
+    name = _segment_name(directory)
+    segment.save(os.path.join(directory, name))
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "learning_log": log_path,
+        "log_rows": len(rows),
+        "sources": [list(entry) for entry in source_signature(sources)],
+        "segments": [{"file": name, "entries": segment.n_entries, "log_rows": [0, len(rows)]}],
+    }
+    write_manifest(directory, manifest)
+    _remove_unlisted(directory, manifest)
+    print(f"📦 Full build: {len(source_entries)} source entries + {len(entries)} from the log "
+          f"({dropped} of {len(rows)} rows dropped) -> {name}")
+    return manifest
+
+
+def append(directory: str, manifest: Dict, rows: List[Dict]) -> Dict:
+    start = manifest["log_rows"]
+    new_rows = rows[start:]
+    if not new_rows:
+        print("✅ No new learning log rows")
+        return manifest
+    segments = [IndexSegment.open(os.path.join(directory, segment["file"])) for segment in manifest["segments"]]
+    seen = np.unique(np.concatenate([segment.pair_hash for segment in segments]))
+    entries, dropped = log_entries(new_rows, seen)
+    manifest["log_rows"] = len(rows)
+    if entries:
+        segment = IndexSegment.build(entries)
+        name = _segment_name(directory)
+        segment.save(os.path.join(directory, name))
+        manifest["segments"].append({"file": name, "entries": segment.n_entries, "log_rows": [start, len(rows)]})
+        print(f"➕ Appended {len(entries)} entries from {len(new_rows)} new rows ({dropped} dropped) -> {name}")
+    else:
+        print(f"➕ {len(new_rows)} new rows, nothing new to index ({dropped} dropped)")
+    write_manifest(directory, manifest)
+    return manifest
+
+
+def compile_index(directory: str = COMPILED_INDEX_DIR, log_path: str = LEARNING_LOG, incremental: bool = False,
+                  responses_file: str = RESPONSES_FILE, responses_dir: str = RESPONSES_DIR) -> Dict:
+    os.makedirs(directory, exist_ok=True)
+    rows = read_log(log_path)
+    manifest = read_manifest(directory) if incremental else None
+    if manifest is not None:
+        if manifest.get("format_version") != FORMAT_VERSION:
+            print("⚠️ Compiled index has another format version; rebuilding")
+        elif manifest.get("log_rows", 0) > len(rows) or manifest.get("learning_log") != log_path:
+            print("⚠️ Learning log was rewritten since the last build; rebuilding")
+        elif len(manifest["segments"]) >= MAX_SEGMENTS:
+            print(f"ℹ️ {len(manifest['segments'])} segments; merging them with a full build")
+        else:
+            return append(directory, manifest, rows)
+    return full_build(directory, log_path, rows, responses_file, responses_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log", default=LEARNING_LOG, help="learning log JSON")
+    parser.add_argument("--out", default=COMPILED_INDEX_DIR, help="compiled index directory")
+    parser.add_argument("--append", action="store_true", help="only compile log rows added since the last build")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    manifest = compile_index(args.out, args.log, incremental=args.append)
+    entries = sum(segment["entries"] for segment in manifest["segments"])
+    print(f"✅ {entries} entries in {len(manifest['segments'])} segment(s) "
+          f"in {time.perf_counter() - started:.2f}s -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
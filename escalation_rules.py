@@ -0,0 +1,406 @@
+# escalation_rules.py
+"""
+Compiled escalation rules for the mental health agent (test_learn.py).
+
+`MentalHealthKnowledgeBase.escalation_triggers` states its criteria in a small
+language:
+
+    withdrawn OR irritable AND duration > 2 weeks
+    suicide OR self-harm
+    school difficulties persist
+
+Terms name signals (a knowledge-base symptom keyword, a detected concern such
+as `critical_safety_alert`, or one of SIGNAL_KEYWORDS), with TERM_ALIASES for
+other spellings. OR binds tighter than AND, as the criteria read in English,
+and parentheses group. `duration > N days|weeks|months` applies to the signals
+ANDed with it: one of them has been mentioned in an episode (mentions no more
+than EPISODE_GAP_DAYS apart) spanning that long. `<term> persist(s)` means the
+term came up on at least PERSIST_MIN_DAYS distinct days of the last
+PERSIST_WINDOW_DAYS.
+
+Criteria are parsed once into rule objects. Each session keeps an
+`EscalationState`: per-signal counters with the current episode and a ring of
+day buckets, so observing a message and checking any rule are O(1) in the
+length of the session. The risk level and recommendations are recomputed when
+a message arrives (or the day rolls over) and served from the state.
+"""
+import re
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+EPISODE_GAP_DAYS = 7
+PERSIST_WINDOW_DAYS = 14
+PERSIST_MIN_DAYS = 3
+SECONDS_PER_DAY = 86400
+
+RISK_LEVELS = ("low", "moderate", "high", "critical")
+
+# Extra phrases per signal, on top of the knowledge base's symptom keywords
+SIGNAL_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "irritability": ("irritable", "cranky", "so angry"),
+    "withdrawn": ("stay in my room", "don't want to see anyone", "dont want to see anyone"),
+    "suicide": ("kill myself", "want to die", "end it all"),
+    "hurt myself": ("hurt myself", "cut myself", "self-harm", "self harm"),
+    "school difficulties": ("homework", "bad grades", "failing", "detention", "school is hard",
+                            "can't keep up", "cant keep up"),
+}
+
+TERM_ALIASES: Dict[str, Tuple[str, ...]] = {
+    "irritable": ("irritability",),
+    "self-harm": ("hurt myself",),
+    "self harm": ("hurt myself",),
+    "suicidal": ("suicide",),
+    "crisis": ("critical_safety_alert",),
+}
+
+BASE_RECOMMENDATIONS = {
+    "critical": ["IMMEDIATE: Contact emergency services or crisis helpline"],
+    "high": [
+        "Consult with school counselor or pediatrician",
+        "Monitor changes in behavior and mood",
+        "Maintain open communication with child",
+    ],
+    "moderate": [
+        "Consult with school counselor or pediatrician",
+        "Monitor changes in behavior and mood",
+        "Maintain open communication with child",
+    ],
+    "low": ["Continue supportive conversations", "Monitor overall well-being"],
+}
+
+_UNIT_DAYS = {"day": 1, "days": 1, "week": 7, "weeks": 7, "month": 30, "months": 30}
+_TOKEN_RE = re.compile(r"\(|\)|>=|>|\d+|[\w'-]+")
+
+
+class RuleSyntaxError(ValueError):
+    pass
+
+
+def today(now: Optional[float] = None) -> int:
+    return int((time.time() if now is None else now) // SECONDS_PER_DAY)
+
+
+# --- Per-session counters ---
+class SignalTrack:
+    """Mentions of one signal: total, current episode and a ring of day buckets."""
+
+    __slots__ = ("total", "episode_start", "last_day", "ring_day", "active_days", "buckets")
+
+    def __init__(self, day: int):
+        self.total = 0
+        self.episode_start = day
+        self.last_day = day
+        self.ring_day = day
+        self.active_days = 0
+        self.buckets = array("H", bytes(2 * PERSIST_WINDOW_DAYS))
+
+    def _advance(self, day: int):
+        # Zero the buckets of the days that left the window since ring_day
+        if day <= self.ring_day:
+            return
+        steps = min(day - self.ring_day, PERSIST_WINDOW_DAYS)
+        for d in range(day - steps + 1, day + 1):
+            slot = d % PERSIST_WINDOW_DAYS
+            if self.buckets[slot]:
+                self.buckets[slot] = 0
+                self.active_days -= 1
+        self.ring_day = day
+
+    def observe(self, day: int, count: int = 1):
+        if self.total == 0 or day - self.last_day > EPISODE_GAP_DAYS:
+            self.episode_start = day
+        self.total += count
+        self.last_day = max(self.last_day, day)
+        self._advance(day)
+        slot = day % PERSIST_WINDOW_DAYS
+        if self.buckets[slot] == 0:
+            self.active_days += 1
+        self.buckets[slot] = min(self.buckets[slot] + count, 0xFFFF)
+
+    def episode_days(self, day: int) -> int:
+        """Length of the ongoing episode in days, or -1 if it has lapsed."""
+        if self.total == 0 or day - self.last_day > EPISODE_GAP_DAYS:
+            return -1
+        return self.last_day - self.episode_start
+
+    def days_in_window(self, day: int) -> int:
+        self._advance(day)
+        return self.active_days
+
+    def __getstate__(self):
+        return (self.total, self.episode_start, self.last_day, self.ring_day, self.active_days,
+                self.buckets.tobytes())
+
+    def __setstate__(self, state):
+        self.total, self.episode_start, self.last_day, self.ring_day, self.active_days, buckets = state
+        self.buckets = array("H")
+        self.buckets.frombytes(buckets)
+
+
+class EscalationState:
+    """What the rules need to know about one session, plus the cached assessment."""
+
+    __slots__ = ("signals", "concern_count", "critical", "risk_level", "recommendations", "fired",
+                 "evaluated_day")
+
+    def __init__(self):
+        self.signals: Dict[str, SignalTrack] = {}
+        self.concern_count = 0
+        self.critical = False
+        self.risk_level = "low"
+        self.recommendations: List[str] = BASE_RECOMMENDATIONS["low"]
+        self.fired: Tuple[str, ...] = ()
+        self.evaluated_day = -1
+
+    def __getstate__(self):
+        return (self.signals, self.concern_count, self.critical, self.risk_level, self.recommendations,
+                self.fired, self.evaluated_day)
+
+    def __setstate__(self, state):
+        (self.signals, self.concern_count, self.critical, self.risk_level, self.recommendations,
+         self.fired, self.evaluated_day) = state
+
+
+# --- Compiled rule nodes ---
+class Mentioned:
+    """Any of `signals` has come up in the session."""
+
+    def __init__(self, signals: Sequence[str]):
+        self.signals = tuple(signals)
+
+    def __call__(self, state: EscalationState, day: int) -> bool:
+        return any(name in state.signals for name in self.signals)
+
+
+class Lasting:
+    """An ongoing episode of any of `signals` spans more than `days` (or at least, with `inclusive`)."""
+
+    def __init__(self, signals: Sequence[str], days: int, inclusive: bool = False):
+        self.signals = tuple(signals)
+        self.days = days
+        self.inclusive = inclusive
+
+    def __call__(self, state: EscalationState, day: int) -> bool:
+        for name in self.signals:
+            track = state.signals.get(name)
+            if track is None:
+                continue
+            span = track.episode_days(day)
+            if span > self.days or (self.inclusive and span == self.days):
+                return True
+        return False
+
+
+class Persists:
+    """Any of `signals` came up on PERSIST_MIN_DAYS distinct days in the window."""
+
+    def __init__(self, signals: Sequence[str]):
+        self.signals = tuple(signals)
+
+    def __call__(self, state: EscalationState, day: int) -> bool:
+        return any(name in state.signals and state.signals[name].days_in_window(day) >= PERSIST_MIN_DAYS
+                   for name in self.signals)
+
+
+class AnyOf:
+    def __init__(self, children):
+        self.children = tuple(children)
+
+    def __call__(self, state: EscalationState, day: int) -> bool:
+        return any(child(state, day) for child in self.children)
+
+
+class AllOf:
+    def __init__(self, children):
+        self.children = tuple(children)
+
+    def __call__(self, state: EscalationState, day: int) -> bool:
+        return all(child(state, day) for child in self.children)
+
+
+class _Duration:
+    """Parsed `duration > N unit`; resolved into Lasting by the enclosing AND."""
+
+    def __init__(self, days: int, inclusive: bool):
+        self.days = days
+        self.inclusive = inclusive
+
+
+class Rule:
+    __slots__ = ("name", "criteria", "action", "level", "condition")
+
+    def __init__(self, name: str, criteria: str, action: str, level: str, condition):
+        self.name = name
+        self.criteria = criteria
+        self.action = action
+        self.level = level
+        self.condition = condition
+
+
+# --- Parser ---
+class _Parser:
+    def __init__(self, criteria: str, known: Dict[str, Tuple[str, ...]]):
+        self.criteria = criteria
+        self.tokens = _TOKEN_RE.findall(criteria.lower())
+        self.pos = 0
+        self.known = known
+
+    def error(self, message: str) -> RuleSyntaxError:
+        return RuleSyntaxError(f"{message} in escalation criteria {self.criteria!r}")
+
+    def peek(self) -> Optional[str]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self) -> str:
+        token = self.peek()
+        if token is None:
+            raise self.error("unexpected end")
+        self.pos += 1
+        return token
+
+    def parse(self):
+        node = self.conjunction()
+        if self.peek() is not None:
+            raise self.error(f"unexpected {self.peek()!r}")
+        if isinstance(node, _Duration):
+            raise self.error("duration needs a term to apply to")
+        return node
+
+    def conjunction(self):
+        parts = [self.disjunction()]
+        while self.peek() == "and":
+            self.take()
+            parts.append(self.disjunction())
+        durations = [part for part in parts if isinstance(part, _Duration)]
+        others = [part for part in parts if not isinstance(part, _Duration)]
+        if durations:
+            signals = [name for part in others for name in self.signals_of(part)]
+            if not signals:
+                raise self.error("duration needs a term to apply to")
+            others = [Lasting(signals, duration.days, duration.inclusive) for duration in durations]
+        return others[0] if len(others) == 1 else AllOf(others)
+
+    def disjunction(self):
+        parts = [self.atom()]
+        while self.peek() == "or":
+            self.take()
+            parts.append(self.atom())
+        if len(parts) == 1:
+            return parts[0]
+        if any(isinstance(part, _Duration) for part in parts):
+            raise self.error("duration cannot be ORed")
+        if all(isinstance(part, Mentioned) for part in parts):
+            return Mentioned([name for part in parts for name in part.signals])
+        return AnyOf(parts)
+
+    def atom(self):
+        token = self.peek()
+        if token == "(":
+            self.take()
+            node = self.conjunction()
+            if self.take() != ")":
+                raise self.error("missing ')'")
+            return node
+        if token == "duration":
+            self.take()
+            op = self.take()
+            if op not in (">", ">="):
+                raise self.error(f"unsupported comparison {op!r}")
+            amount = self.take()
+            unit = self.take()
+            if not amount.isdigit() or unit not in _UNIT_DAYS:
+                raise self.error(f"bad duration {amount} {unit}")
+            return _Duration(int(amount) * _UNIT_DAYS[unit], inclusive=op == ">=")
+        words = []
+        while self.peek() not in (None, "and", "or", "(", ")", "persist", "persists"):
+            words.append(self.take())
+        if not words:
+            raise self.error(f"expected a term, got {token!r}")
+        term = " ".join(words)
+        signals = self.known.get(term)
+        if signals is None:
+            raise self.error(f"unknown term {term!r}")
+        if self.peek() in ("persist", "persists"):
+            self.take()
+            return Persists(signals)
+        return Mentioned(signals)
+
+    def signals_of(self, node) -> List[str]:
+        if isinstance(node, (Mentioned, Persists, Lasting)):
+            return list(node.signals)
+        raise self.error("duration can only qualify plain terms")
+
+
+# --- Engine ---
+class EscalationEngine:
+    """Escalation triggers compiled against the knowledge base's vocabulary."""
+
+    def __init__(self, symptom_keywords: Dict[str, Dict], triggers: Iterable[Dict]):
+        keywords: Dict[str, Tuple[str, ...]] = {keyword: (keyword,) for keyword in symptom_keywords}
+        for signal, phrases in SIGNAL_KEYWORDS.items():
+            keywords[signal] = keywords.get(signal, (signal,)) + phrases
+        # One alternation over every keyword; longest first so phrases win over their prefixes
+        self._keyword_signal = {phrase: signal for signal, phrases in keywords.items() for phrase in phrases}
+        self._matcher = re.compile("|".join(re.escape(phrase) for phrase in
+                                            sorted(self._keyword_signal, key=len, reverse=True)))
+
+        known = {signal: (signal,) for signal in keywords}
+        known.update(TERM_ALIASES)
+        self.rules = [self.compile(trigger, known) for trigger in triggers]
+
+    @staticmethod
+    def compile(trigger: Dict, known: Dict[str, Tuple[str, ...]]) -> Rule:
+        action = trigger.get("action", "")
+        level = trigger.get("level") or ("critical" if action.upper().startswith("IMMEDIATE") else "moderate")
+        if level not in RISK_LEVELS:
+            raise RuleSyntaxError(f"unknown risk level {level!r} for trigger {trigger.get('name')!r}")
+        condition = _Parser(trigger["criteria"], known).parse()
+        return Rule(trigger["name"], trigger["criteria"], action, level, condition)
+
+    def new_state(self) -> EscalationState:
+        return EscalationState()
+
+    def signals_in(self, message_lower: str) -> Dict[str, int]:
+        found: Dict[str, int] = {}
+        for phrase in self._matcher.findall(message_lower):
+            signal = self._keyword_signal[phrase]
+            found[signal] = found.get(signal, 0) + 1
+        return found
+
+    def observe(self, state: EscalationState, message_lower: str, concerns: Iterable[str],
+                now: Optional[float] = None) -> EscalationState:
+        """Counts the signals and concerns of one message and refreshes the assessment."""
+        day = today(now)
+        found = self.signals_in(message_lower)
+        for concern in concerns:
+            state.concern_count += 1
+            if "critical" in concern:
+                state.critical = True
+            found[concern] = found.get(concern, 0) + 1
+        for signal, count in found.items():
+            track = state.signals.get(signal)
+            if track is None:
+                track = state.signals[signal] = SignalTrack(day)
+            track.observe(day, count)
+        self._evaluate(state, day)
+        return state
+
+    def assess(self, state: EscalationState, now: Optional[float] = None) -> Tuple[str, List[str]]:
+        """(risk_level, recommendations); re-evaluated only when the day has changed."""
+        day = today(now)
+        if day != state.evaluated_day:
+            self._evaluate(state, day)
+        return state.risk_level, state.recommendations
+
+    def _evaluate(self, state: EscalationState, day: int):
+        level = "critical" if state.critical else "moderate" if state.concern_count else "low"
+        fired = [rule for rule in self.rules if rule.condition(state, day)]
+        for rule in fired:
+            if RISK_LEVELS.index(rule.level) > RISK_LEVELS.index(level):
+                level = rule.level
+        actions = [f"{rule.action} ({rule.name.replace('_', ' ')})" for rule in fired if rule.action]
+        state.risk_level = level
+        state.recommendations = actions + BASE_RECOMMENDATIONS[level]
+        state.fired = tuple(rule.name for rule in fired)
+        state.evaluated_day = day
@@ -3,8 +3,17 @@ import json
 from openai import AsyncOpenAI  # <--- FIX 1: Import AsyncOpenAI
 from server.json_memory import memory
 from dotenv import load_dotenv
-from server.prompt_builder import SYSTEM_PROMPT, KNOWLEDGE_BASE
+from server.prompt_builder import KNOWLEDGE_BASE, estimate_tokens, prompt_assembler
+from server.metrics import STAGE_LATENCY, UPSTREAM_ERRORS, FALLBACKS, LLM_IN_FLIGHT, PROMPT_TOKENS, CACHE_HITS
+from server.usage import usage_tracker, track_turn, current_session_id
+from server.alerts import alert_bus
+from server.events import event_bus
+from server.response_index import ResponseIndex
 import re
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
 from typing import Dict, Any, List
 # Import Pydantic for structured output schema
 from pydantic import BaseModel, Field, ValidationError
@@ -117,6 +126,41 @@ client = AsyncOpenAI(
 #     model="asi1-mini"
 )
 
+
+# Canned replies (compile_responses.py), used when the LLM call fails. Only a
+# close match is served, and never for a message that raises an escalation alert.
+local_responses = ResponseIndex()
+LOCAL_REPLY_MIN_SCORE = float(os.getenv("LOCAL_REPLY_MIN_SCORE", "0.6"))
+
+
+# --- Instrumented LLM call ---
+async def _chat_completion(call_type: str, messages: List[Dict[str, str]], **kwargs):
+    """
+    Calls the ASI:One chat completion API while recording the prompt size
+    estimate, in-flight count, latency and upstream errors for `/metrics`,
+    and the reported token usage for `/usage`.
+    `call_type` is one of "extraction", "reply" or "summary".
+    """
+    estimated_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+    PROMPT_TOKENS.labels(call_type).observe(estimated_tokens)
+    LLM_IN_FLIGHT.inc()
+    started = time.perf_counter()
+    try:
+        res = await client.chat.completions.create(
+            model="asi1-mini",
+            messages=messages,
+            **kwargs
+        )
+        usage_tracker.record(call_type, estimated_tokens, getattr(res, "usage", None))
+        return res
+    except Exception:
+        UPSTREAM_ERRORS.labels("asi_one").inc()
+        raise
+    finally:
+        LLM_IN_FLIGHT.dec()
+        STAGE_LATENCY.labels("llm").observe(time.perf_counter() - started)
+
+
 # --- Load Diagnostic Prompts ---
 try:
     # Assuming this file exists and is correctly structured
@@ -136,6 +180,10 @@ class ParentSummary(BaseModel):
     potential_concerns: List[str] = Field(..., description="A list of potential mental health concerns (e.g., Anxiety, Depression, Behavioral Issues). Use 'None' if no serious concerns are noted.")
 
 
+# The JSON schema string the LLM must follow; generated once per process
+PARENT_SUMMARY_SCHEMA = ParentSummary.schema_json(indent=2)
+
+
 # --- Helper function for JSON cleaning ---
 def clean_json_text(text: str) -> str:
     """Strips common markdown fences from JSON output."""
@@ -154,27 +202,16 @@ def clean_json_text(text: str) -> str:
 # --- 1. Fact Extraction and Storage Logic (FIXED with JSON Cleaning) ---
 
 # <--- FIX 4: Make the function async
-async def extract_and_store_facts(user_input: str):
-    """Uses the LLM to extract key personality facts and stores them."""
-    
-    current_facts = memory.get_facts()
-    facts_str = json.dumps(current_facts) if current_facts else "None"
+async def extract_facts(user_input: str) -> Dict[str, Any]:
+    """Uses the LLM to extract key personality facts, without storing them."""
     
-    fact_extraction_prompt = f"""
-    You are a Fact Extractor. Your job is to analyze the user's input and extract key, enduring personal facts about the child (e.g., 'pet_name: Sparky', 'favorite_subject: Science', 'favorite_animal: Capybara').
-    DO NOT extract temporary feelings. ONLY extract concrete, enduring facts.
-
-    Current known facts: {facts_str}
-    User Input: "{user_input}"
-    
-    Task: Return a SINGLE, complete JSON object containing ONLY the facts extracted or updated. If no new facts is found, return an empty JSON object: {{}}.
-    """
+    fact_extraction_prompt = prompt_assembler.build_extraction_prompt(memory, user_input)
     
     try:
         # Use user role and compatible response_format
         # <--- FIX 5: Use 'await' for the API call
-        res = await client.chat.completions.create(
-            model="asi1-mini",
+        res = await _chat_completion(
+            "extraction",
             messages=[
                 {"role": "user", "content": fact_extraction_prompt},
             ],
@@ -187,16 +224,25 @@ async def extract_and_store_facts(user_input: str):
         
         # Parse the cleaned JSON
         new_facts = json.loads(cleaned_json)
-        
-        for key, value in new_facts.items():
-            memory.add_fact(key, value)
-        
-        if new_facts:
-            print(f"🧠 Learned new facts: {new_facts}")
+        return new_facts if isinstance(new_facts, dict) else {}
 
     except Exception as e:
         # This will now catch JSONDecodeError if the cleaning fails
         print(f"⚠️ Fact extraction failed. Raw LLM output: {json_text if 'json_text' in locals() else 'N/A'}. Error: {e}")
+        return {}
+
+
+def store_facts(new_facts: Dict[str, Any]):
+    for key, value in new_facts.items():
+        memory.add_fact(key, value)
+    
+    if new_facts:
+        print(f"🧠 Learned new facts: {new_facts}")
+
+
+async def extract_and_store_facts(user_input: str):
+    """Uses the LLM to extract key personality facts and stores them."""
+    store_facts(await extract_facts(user_input))
 
 
 # --- 2. State-Triggered Dialogue Logic (Diagnostic) ---
@@ -219,46 +265,92 @@ def get_diagnostic_prompt(user_input: str) -> str:
 
 # --- 3. Holistic Summary and Parent Prompt Logic ---
 
+# Histories this long are summarized map-reduce style: fixed windows of turns
+# are summarized concurrently, then merged into one ParentSummary.
+CHUNKED_SUMMARY_MIN_TURNS = 40
+SUMMARY_CHUNK_TURNS = 20
+SUMMARY_CONCURRENCY = 4
+SUMMARY_CHUNK_CACHE_SIZE = 512
+
+# Window summaries keyed by a hash of the window's serialized turns. Turns are
+# append-only, so completed windows hit this cache on every later run and only
+# new turns are sent to the LLM.
+_chunk_summary_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+
+async def _summarize_chunk(start: int, end: int, semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+    """Map step: summarizes turns [start, end) or returns the cached result."""
+    window_json = prompt_assembler.turns_window_json(memory, start, end)
+    key = hashlib.sha1(window_json.encode("utf-8")).hexdigest()
+    cached = _chunk_summary_cache.get(key)
+    if cached is not None:
+        CACHE_HITS.labels("summary_chunk").inc()
+        _chunk_summary_cache.move_to_end(key)
+        return cached
+
+    async with semaphore:
+        res = await _chat_completion(
+            "summary_chunk",
+            messages=prompt_assembler.build_chunk_summary_messages(window_json, start, end),
+            response_format={"type": "json_object"}
+        )
+    partial = json.loads(clean_json_text(res.choices[0].message.content))
+    partial["turns"] = f"{start + 1}-{end}"
+
+    _chunk_summary_cache[key] = partial
+    if len(_chunk_summary_cache) > SUMMARY_CHUNK_CACHE_SIZE:
+        _chunk_summary_cache.popitem(last=False)
+    return partial
+
+
+async def _build_chunked_summary_messages() -> List[Dict[str, str]]:
+    """Runs the map step under a concurrency cap and returns the reduce prompt."""
+    total = len(memory.context)
+    semaphore = asyncio.Semaphore(SUMMARY_CONCURRENCY)
+    windows = [(start, min(start + SUMMARY_CHUNK_TURNS, total)) for start in range(0, total, SUMMARY_CHUNK_TURNS)]
+    results = await asyncio.gather(
+        *[_summarize_chunk(start, end, semaphore) for start, end in windows],
+        return_exceptions=True
+    )
+    # One failed window shouldn't sink the whole summary: reduce over the rest
+    # and mark the gap so the reducer doesn't read it as a quiet stretch
+    partials = []
+    failures = []
+    for (start, end), result in zip(windows, results):
+        if isinstance(result, BaseException):
+            failures.append(result)
+            partials.append({"turns": f"{start + 1}-{end}", "summary_unavailable": True})
+        else:
+            partials.append(result)
+    if len(failures) == len(windows):
+        raise failures[0]
+    if failures:
+        FALLBACKS.labels("summary_chunk_gap").inc(len(failures))
+        print(f"⚠️ {len(failures)} of {len(windows)} summary windows failed ({failures[0]}); summarizing the rest")
+    return prompt_assembler.build_reduce_summary_messages(memory, partials, PARENT_SUMMARY_SCHEMA)
+
+
 # <--- FIX 6: Make the function async
 async def generate_parent_summary() -> Dict[str, Any]:
     """
     Analyzes the entire conversation history and facts to generate a
     holistic summary and parent prompt using a compatible JSON method.
     """
-    context_str = json.dumps(memory.context)
-    facts_str = json.dumps(memory.get_facts())
-    
-    # 1. Generate the JSON schema string from Pydantic model for the LLM to follow
-    schema_json = ParentSummary.schema_json(indent=2)
-
-    # Define the role/rules (SYSTEM message content)
-    system_instruction = f"""
-    You are a professional Mental Health Analyst. Your task is to identify patterns, not make a formal diagnosis.
-    You MUST respond with a single JSON object that strictly adheres to the following JSON schema. Do not include any text outside the JSON block:
-    {schema_json}
-    """
-    
-    # Define the data/task (USER message content)
-    user_task = f"""
-    Review the following child's conversation history and personality facts.
-
-    Personality Facts: {facts_str}
-    Conversation History: {context_str}
-
-    Based on the evidence, determine if there is a **POSSIBLE** mental health concern (e.g., Anxiety, Depression, Behavioral Issue). Generate the required JSON output.
-    """
-    
     json_text = "N/A (API call failed)" # Initialize for error reporting
     
     try:
+        if len(memory.context) >= CHUNKED_SUMMARY_MIN_TURNS:
+            summary_messages = await _build_chunked_summary_messages()
+        else:
+            # The schema, rules and serialized history are cached by the prompt assembler,
+            # which also caps the prompt at SUMMARY_PROMPT_TOKEN_BUDGET (oldest turns dropped first)
+            summary_messages = prompt_assembler.build_summary_messages(memory, PARENT_SUMMARY_SCHEMA)
+
         # Step 1: Call API using compatible response_format and both SYSTEM/USER messages
         # <--- FIX 7: Use 'await' for the API call
-        res = await client.chat.completions.create(
-            model="asi1-mini",
-            messages=[
-                {"role": "system", "content": system_instruction},
-                {"role": "user", "content": user_task},
-            ],
+        res = await _chat_completion(
+            "summary",
+            messages=summary_messages,
             # Use the compatible response_format
             response_format={"type": "json_object"}
         )
@@ -280,6 +372,7 @@ async def generate_parent_summary() -> Dict[str, Any]:
     except ValidationError as e:
         error_message = f"Pydantic Validation Error: {e.errors()}"
         print(f"⚠️ Parent summary generation failed: {error_message}")
+        FALLBACKS.labels("parent_summary_error").inc()
         return {
             "recommendation_needed": False,
             "summary_for_analyst": f"Failed to generate summary. Error: {error_message}",
@@ -290,6 +383,7 @@ async def generate_parent_summary() -> Dict[str, Any]:
         # Catching generic API or parsing errors (including the original JSONDecodeError)
         error_message = str(e)
         print(f"⚠️ Parent summary generation failed: {error_message}")
+        FALLBACKS.labels("parent_summary_error").inc()
         return {
             "recommendation_needed": False,
             "summary_for_analyst": f"Failed to generate summary. Error: {error_message}. Raw LLM output (if available): {json_text}",
@@ -348,45 +442,107 @@ def analyze_for_escalation(user_input: str) -> Dict[str, Any]:
 # (This function is already async, which is correct)
 async def get_agent_response(user_input: str) -> Dict[str, Any]:
     """Use ASI:One model for a reply, run silent analysis, and manage memory."""
-    
+    with track_turn() as turn_usage:
+        response = await _run_agent_turn(user_input)
+    response["usage"] = turn_usage.to_dict()
+    return response
+
+
+async def _run_agent_turn(user_input: str) -> Dict[str, Any]:
+    return commit_agent_turn(await generate_agent_turn(user_input))
+
+
+async def generate_agent_turn(user_input: str) -> Dict[str, Any]:
+    """
+    Produces a draft turn (reply, safety analysis, newly extracted facts)
+    without changing memory or publishing alerts, so it can be generated
+    speculatively and thrown away. `commit_agent_turn` applies it.
+    """
+    memory_version = memory.version
+
     # <--- FIX 8: 'await' the async function
-    await extract_and_store_facts(user_input)
+    new_facts = await extract_facts(user_input)
 
     # This function is sync, so no await is needed
     diagnostic_instruction = get_diagnostic_prompt(user_input)
     
-    current_facts_str = json.dumps(memory.get_facts())
-    current_context_str = json.dumps(memory.context[-5:]) # Only pass last 5 turns for context
-    
-    full_system_prompt = f"""
-    {SYSTEM_PROMPT}
+    # Facts and recent turns are added under the reply token budget
+    full_system_prompt = prompt_assembler.build_reply_prompt(
+        memory, user_input, diagnostic_instruction, pending_facts=new_facts
+    )
 
-    --- PERSISTENT FACTS ABOUT CHILD (Use to personalize reply) ---
-    {current_facts_str}
-    
-    --- CONVERSATION HISTORY (Most Recent Last) ---
-    {current_context_str}
-    
-    --- URGENT INSTRUCTION ---
-    {diagnostic_instruction}
-    """
+    # Run silent safety analysis (this function is sync); the reply fallback needs it too
+    safety_analysis = analyze_for_escalation(user_input)
 
     # 4. Generate Reply
     # <--- FIX 9: 'await' the main API call
-    res = await client.chat.completions.create(
-        model="asi1-mini",
-        messages=[
-            {"role": "system", "content": full_system_prompt},
-            {"role": "user", "content": user_input},
-        ],
-    )
-    reply = res.choices[0].message.content.strip()
-    
-    # 5. Run silent safety analysis (this function is sync)
-    safety_analysis = analyze_for_escalation(user_input)
+    try:
+        res = await _chat_completion(
+            "reply",
+            messages=[
+                {"role": "system", "content": full_system_prompt},
+                {"role": "user", "content": user_input},
+            ],
+        )
+        reply = res.choices[0].message.content.strip()
+    except Exception as e:
+        # LLM unavailable: answer from the compiled canned-response index if a pattern
+        # closely matches, unless the message needs escalating (then the error stands)
+        if safety_analysis["alerts"]:
+            raise
+        reply = local_responses.reply(user_input, min_score=LOCAL_REPLY_MIN_SCORE)
+        if reply is None:
+            raise
+        FALLBACKS.labels("llm_reply_local_index").inc()
+        print(f"⚠️ LLM reply failed ({e}); answered from the local response index")
+
+    return {
+        "user_input": user_input,
+        "reply": reply,
+        "analysis": safety_analysis,
+        "new_facts": new_facts,
+        # The draft is only valid while memory is unchanged
+        "memory_version": memory_version,
+    }
+
+
+def draft_fits(draft: Dict[str, Any], user_input: str) -> bool:
+    """
+    True if a draft generated from other text (a speculative draft from an
+    interim transcript) can stand for `user_input`: the final text raises no
+    alert the draft's text didn't, and asks for the same diagnostic prompt.
+    """
+    if user_input == draft["user_input"]:
+        return True
+    drafted = {alert["trigger_name"] for alert in draft["analysis"]["alerts"]}
+    final = {alert["trigger_name"] for alert in analyze_for_escalation(user_input)["alerts"]}
+    if final - drafted:
+        return False
+    return get_diagnostic_prompt(user_input) == get_diagnostic_prompt(draft["user_input"])
+
+
+def commit_agent_turn(draft: Dict[str, Any], user_input: str = None) -> Dict[str, Any]:
+    """
+    Stores a draft's facts and turn and publishes its alerts. `user_input`
+    replaces the text the draft was generated from (e.g. the final transcript
+    after a speculative draft from an interim one); the analysis is redone
+    for it.
+    """
+    safety_analysis = draft["analysis"]
+    if user_input is None:
+        user_input = draft["user_input"]
+    elif user_input != draft["user_input"]:
+        safety_analysis = analyze_for_escalation(user_input)
+
+    store_facts(draft["new_facts"])
+
+    # Both are non-blocking: delivery happens off the child-facing path
+    for alert in safety_analysis["alerts"]:
+        event_bus.publish(memory.child_id, "alert", {"user_input": user_input, **alert})
+        alert_bus.publish({"child_id": memory.child_id, "user_input": user_input, **alert}, current_session_id())
 
     # 6. Store conversation turn (after analysis) (this is sync)
-    memory.remember(user_input, reply)
+    memory.remember(user_input, draft["reply"])
 
     # 7. Print entire context for debugging (added for the user's previous request)
     # print("\n--- FULL CONVERSATION LOG (memory.context) ---")
@@ -395,7 +551,7 @@ async def get_agent_response(user_input: str) -> Dict[str, Any]:
     
     # Return a structured dictionary
     return {
-        "reply": reply,
+        "reply": draft["reply"],
         "analysis": safety_analysis,
         "facts_updated": memory.get_facts()
     }
@@ -406,6 +562,11 @@ async def generate_parent_summary_response() -> Dict[str, Any]:
     # <--- FIX 10: 'await' the async function
     return await generate_parent_summary()
 
+@agent.on_event("startup")
+async def start_alert_bus(ctx: Context):
+    alert_bus.start()
+
+
 # <--- FIX 11: Moved this block to the end of the file
 if __name__ == "__main__":
     print(f"Starting agent '{agent.name}' on address: {agent.address}")
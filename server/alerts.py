@@ -0,0 +1,350 @@
+# child_agent/server/alerts.py
+"""
+In-process escalation alert bus.
+
+`publish()` is called on the child-facing path. It does an in-memory dedupe
+check, appends the alert to a JSONL outbox (one unsynced write, so it survives
+the process dying) and does a `put_nowait` on a bounded queue. A background
+worker, started with the app via `start()`, then:
+
+1. syncs the outbox to disk,
+2. batches alerts and delivers each batch to every configured sink
+   (webhook, file, email stand-in), retrying with exponential backoff,
+3. marks delivered alerts done in the outbox, or re-queues a batch that is
+   still undelivered after `max_attempts` once the backoff has elapsed.
+
+On startup, alerts left pending in the outbox are re-queued, so delivery is
+at-least-once across restarts. The lag from publish to delivery is exported as
+a histogram.
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Set
+from uuid import uuid4
+
+import aiohttp
+
+from server.metrics import Counter, Gauge, Histogram
+
+ALERTS_PUBLISHED = Counter("capy_alerts_published_total", "Escalation alerts accepted by the alert bus.", ["level"])
+ALERTS_DEDUPED = Counter("capy_alerts_deduped_total", "Alerts suppressed as repeats within the dedupe window.")
+ALERTS_DROPPED = Counter("capy_alerts_dropped_total", "Alerts dropped because the alert queue was full.")
+ALERT_DELIVERY_FAILURES = Counter("capy_alert_delivery_failures_total", "Failed alert delivery attempts per sink.", ["sink"])
+ALERT_QUEUE_DEPTH = Gauge("capy_alert_queue_depth", "Alerts waiting in the alert bus queue.")
+ALERT_DELIVERY_LAG = Histogram("capy_alert_delivery_lag_seconds", "Time from publishing an alert to delivering it to every sink.")
+
+DEDUPE_WINDOW_SECONDS = 600
+QUEUE_SIZE = 1000
+BATCH_SIZE = 20
+BATCH_WAIT_SECONDS = 1.0
+MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+
+
+# --- Sinks ---
+class AlertSink:
+    """A delivery target. `deliver` raises on failure so the bus can retry."""
+
+    name = "sink"
+
+    async def deliver(self, batch: List[Dict[str, Any]]):
+        raise NotImplementedError
+
+
+class WebhookSink(AlertSink):
+    """POSTs each batch as a JSON list to a webhook URL."""
+
+    name = "webhook"
+
+    def __init__(self, url: str, timeout: float = 10):
+        self.url = url
+        self.timeout = timeout
+
+    async def deliver(self, batch: List[Dict[str, Any]]):
+        timeout_config = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(timeout=timeout_config) as session:
+            async with session.post(self.url, json={"alerts": batch}) as resp:
+                if resp.status >= 400:
+                    raise RuntimeError(f"webhook returned {resp.status}")
+
+
+class FileSink(AlertSink):
+    """Appends alerts as JSON lines to a local file."""
+
+    name = "file"
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for alert in batch:
+                f.write(json.dumps(alert) + "\n")
+
+    async def deliver(self, batch: List[Dict[str, Any]]):
+        await asyncio.to_thread(self._write, batch)
+
+
+class EmailSink(AlertSink):
+    """Stand-in for an email notifier: writes one plain-text message per batch to a mailbox file."""
+
+    name = "email"
+
+    def __init__(self, recipient: str, mailbox_path: str):
+        self.recipient = recipient
+        self.mailbox_path = mailbox_path
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        lines = [
+            f"To: {self.recipient}",
+            f"Subject: Capy alert digest ({len(batch)} alert{'s' if len(batch) != 1 else ''})",
+            "",
+        ]
+        for alert in batch:
+            lines.append(f"- [{alert.get('level')}] {alert.get('trigger_name')}: {alert.get('action')}")
+        with open(self.mailbox_path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n\n")
+
+    async def deliver(self, batch: List[Dict[str, Any]]):
+        await asyncio.to_thread(self._write, batch)
+
+
+def sinks_from_env() -> List[AlertSink]:
+    """Builds the sink list from ALERT_WEBHOOK_URL, ALERT_FILE and ALERT_EMAIL_TO."""
+    sinks: List[AlertSink] = []
+    if os.getenv("ALERT_WEBHOOK_URL"):
+        sinks.append(WebhookSink(os.getenv("ALERT_WEBHOOK_URL")))
+    sinks.append(FileSink(os.getenv("ALERT_FILE", "data/alerts.jsonl")))
+    if os.getenv("ALERT_EMAIL_TO"):
+        sinks.append(EmailSink(os.getenv("ALERT_EMAIL_TO"), os.getenv("ALERT_MAILBOX", "data/alert_emails.txt")))
+    return sinks
+
+
+# --- Durable outbox ---
+class AlertOutbox:
+    """Append-only JSONL log of `add` / `done` records; pending = added - done."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._done_since_compact = 0
+
+    def load_pending(self) -> List[Dict[str, Any]]:
+        pending: Dict[str, Dict[str, Any]] = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn write from a crash
+                    if record.get("op") == "add":
+                        pending[record["alert"]["alert_id"]] = record["alert"]
+                    elif record.get("op") == "done":
+                        pending.pop(record["alert_id"], None)
+        except FileNotFoundError:
+            return []
+        alerts = list(pending.values())
+        self._rewrite(alerts)
+        return alerts
+
+    def _rewrite(self, pending: List[Dict[str, Any]]):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for alert in pending:
+                f.write(json.dumps({"op": "add", "alert": alert}) + "\n")
+        os.replace(tmp_path, self.path)
+        self._done_since_compact = 0
+
+    def _append(self, records: List[Dict[str, Any]], sync: bool = True):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def add(self, alerts: List[Dict[str, Any]], sync: bool = True):
+        self._append([{"op": "add", "alert": alert} for alert in alerts], sync)
+
+    def sync(self):
+        """Flushes earlier unsynced appends to disk."""
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except FileNotFoundError:
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def mark_done(self, alerts: List[Dict[str, Any]], still_pending: List[Dict[str, Any]]):
+        self._append([{"op": "done", "alert_id": alert["alert_id"]} for alert in alerts])
+        self._done_since_compact += len(alerts)
+        if self._done_since_compact >= 1000:
+            self._rewrite(still_pending)
+
+
+# --- Bus ---
+class AlertBus:
+    """Deduplicates, persists, batches and delivers escalation alerts off the hot path."""
+
+    def __init__(self, sinks: Optional[List[AlertSink]] = None, outbox_path: str = "data/alert_outbox.jsonl",
+                 dedupe_window: float = DEDUPE_WINDOW_SECONDS, queue_size: int = QUEUE_SIZE,
+                 batch_size: int = BATCH_SIZE, batch_wait: float = BATCH_WAIT_SECONDS,
+                 max_attempts: int = MAX_ATTEMPTS):
+        self.sinks = sinks if sinks is not None else sinks_from_env()
+        self.outbox = AlertOutbox(outbox_path)
+        self.dedupe_window = dedupe_window
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.max_attempts = max_attempts
+        self.queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._recent: Dict[tuple, float] = {}
+        # Alerts written to the outbox but not yet delivered, by alert_id
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._worker: Optional[asyncio.Task] = None
+        self._retries: Set[asyncio.Task] = set()
+        ALERT_QUEUE_DEPTH.set_function(lambda: self._queue.qsize() if self._queue else 0)
+
+    def start(self):
+        """Re-queues alerts left in the outbox and starts the delivery worker."""
+        if self._worker is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        for alert in self.outbox.load_pending():
+            self._pending[alert["alert_id"]] = alert
+            self._enqueue(alert)
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 5.0):
+        """Gives queued alerts a moment to flush, then stops the worker."""
+        if self._worker is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for task in [self._worker, *self._retries]:
+            task.cancel()
+        await asyncio.gather(self._worker, *self._retries, return_exceptions=True)
+        self._worker = None
+        self._retries.clear()
+
+    def publish(self, alert: Dict[str, Any], session_id: str = "default") -> bool:
+        """
+        Accepts an alert from analyze_for_escalation without waiting on the
+        worker. Returns False if it was a duplicate (same trigger, same session,
+        within the dedupe window) or the queue was full. If the worker isn't
+        running in this process the alert stays in the outbox for the next
+        `start()`.
+        """
+        now = time.time()
+        key = (session_id, alert.get("trigger_name"))
+        last = self._recent.get(key)
+        if last is not None and now - last < self.dedupe_window:
+            ALERTS_DEDUPED.inc()
+            return False
+        if self._queue is not None and self._queue.full():
+            ALERTS_DROPPED.inc()
+            print(f"⚠️ Alert queue full, dropping alert {alert.get('trigger_name')}")
+            return False
+
+        record = {**alert, "alert_id": uuid4().hex, "session_id": session_id, "published_at": now}
+        try:
+            self.outbox.add([record], sync=False)
+        except OSError as e:
+            print(f"⚠️ Could not write alert to the outbox ({e}); delivering from memory only")
+        if self._worker is not None:
+            self._pending[record["alert_id"]] = record
+            if not self._enqueue(record):
+                return False
+        # Only now, so a dropped alert doesn't suppress the next attempt
+        self._recent[key] = now
+        if len(self._recent) > 10000:
+            self._recent = {k: t for k, t in self._recent.items() if now - t < self.dedupe_window}
+        ALERTS_PUBLISHED.labels(str(alert.get("level"))).inc()
+        return True
+
+    def _enqueue(self, alert: Dict[str, Any]) -> bool:
+        try:
+            self._queue.put_nowait(alert)
+            return True
+        except asyncio.QueueFull:
+            ALERTS_DROPPED.inc()
+            print(f"⚠️ Alert queue full, dropping alert {alert.get('trigger_name')}")
+            return False
+
+    async def _next_batch(self) -> List[Dict[str, Any]]:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _deliver_with_retry(self, sink: AlertSink, batch: List[Dict[str, Any]]) -> bool:
+        for attempt in range(self.max_attempts):
+            try:
+                await sink.deliver(batch)
+                return True
+            except Exception as e:
+                ALERT_DELIVERY_FAILURES.labels(sink.name).inc()
+                delay = min(BACKOFF_BASE_SECONDS * 2 ** attempt, BACKOFF_MAX_SECONDS)
+                print(f"⚠️ Alert delivery to {sink.name} failed ({e}); retry {attempt + 1}/{self.max_attempts} in {delay:.0f}s")
+                await asyncio.sleep(delay)
+        return False
+
+    async def _requeue_later(self, batch: List[Dict[str, Any]], delay: float):
+        await asyncio.sleep(delay)
+        left = [alert for alert in batch if alert["alert_id"] in self._pending and not self._enqueue(alert)]
+        if left:
+            self._schedule_requeue(left)
+
+    def _schedule_requeue(self, batch: List[Dict[str, Any]]):
+        task = asyncio.create_task(self._requeue_later(batch, BACKOFF_MAX_SECONDS))
+        self._retries.add(task)
+        task.add_done_callback(self._retries.discard)
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await asyncio.to_thread(self.outbox.sync)
+                results = await asyncio.gather(*[self._deliver_with_retry(sink, batch) for sink in self.sinks])
+                if all(results):
+                    delivered_at = time.time()
+                    for alert in batch:
+                        ALERT_DELIVERY_LAG.observe(delivered_at - alert["published_at"])
+                        self._pending.pop(alert["alert_id"], None)
+                    await asyncio.to_thread(self.outbox.mark_done, batch, list(self._pending.values()))
+                else:
+                    # Still pending in the outbox too, in case the process restarts first
+                    print(f"⚠️ {len(batch)} alert(s) undelivered after {self.max_attempts} attempts; "
+                          f"retrying in {BACKOFF_MAX_SECONDS:.0f}s")
+                    self._schedule_requeue(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Alert worker error: {e}")
+                self._schedule_requeue(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+# Initialize the shared bus
+alert_bus = AlertBus()
@@ -0,0 +1,226 @@
+# child_agent/server/audio_features.py
+"""
+Vectorized frame-level audio features on 16-bit PCM.
+
+`frame_signal` returns a strided view of the signal (one row per frame) instead
+of copying samples into a frame matrix, and the per-frame reductions work on
+that view directly, so analysing a clip costs one float32 conversion of the
+signal plus O(frames) outputs.
+
+`FeatureExtractor` builds on these for tone analysis: overlapping 32 ms frames
+every 10 ms with RMS, zero-crossing rate and autocorrelation pitch per frame,
+plus clip-level summary statistics and a batch API.
+"""
+import numpy as np
+
+PCM16_SCALE = 32768.0
+
+
+def pcm16_to_float32(pcm: bytes) -> np.ndarray:
+    """Little-endian int16 PCM bytes -> float32 samples in [-1, 1)."""
+    samples = np.frombuffer(pcm, dtype="<i2", count=len(pcm) // 2)
+    return samples.astype(np.float32) / np.float32(PCM16_SCALE)
+
+
+def frame_signal(samples: np.ndarray, frame_length: int, hop_length: int) -> np.ndarray:
+    """
+    Read-only (n_frames, frame_length) view of `samples` with frames starting
+    every `hop_length` samples. Trailing samples that don't fill a frame are
+    dropped. No data is copied, even when frames overlap.
+    """
+    if samples.ndim != 1:
+        raise ValueError("frame_signal expects a 1-D signal")
+    if len(samples) < frame_length:
+        return np.empty((0, frame_length), dtype=samples.dtype)
+    n_frames = 1 + (len(samples) - frame_length) // hop_length
+    stride = samples.strides[0]
+    return np.lib.stride_tricks.as_strided(
+        samples, shape=(n_frames, frame_length), strides=(hop_length * stride, stride), writeable=False
+    )
+
+
+def frame_energy(frames: np.ndarray) -> np.ndarray:
+    """Mean-square energy per frame (float32 frames in, float32 out)."""
+    if not len(frames):
+        return np.empty(0, dtype=np.float32)
+    return np.einsum("ij,ij->i", frames, frames) / np.float32(frames.shape[1])
+
+
+def frame_rms(frames: np.ndarray) -> np.ndarray:
+    return np.sqrt(frame_energy(frames))
+
+
+def frame_zcr(samples: np.ndarray, frame_length: int, hop_length: int) -> np.ndarray:
+    """
+    Zero-crossing rate per frame (crossings / sample), aligned with
+    `frame_signal(samples, frame_length, hop_length)`.
+    """
+    if len(samples) < frame_length:
+        return np.empty(0, dtype=np.float32)
+    signs = np.signbit(samples)
+    # Prefix sum of sign changes: crossings in [a, b) = cs[b - 1] - cs[a]
+    crossings = np.concatenate(([0], np.cumsum(signs[1:] != signs[:-1], dtype=np.int32)))
+    n_frames = 1 + (len(samples) - frame_length) // hop_length
+    starts = np.arange(n_frames) * hop_length
+    counts = crossings[starts + frame_length - 1] - crossings[starts]
+    return counts.astype(np.float32) / np.float32(frame_length)
+
+
+# --- Framed feature engine ---
+FEATURE_FRAME_MS = 32
+FEATURE_HOP_MS = 10
+PITCH_MIN_HZ = 70.0
+PITCH_MAX_HZ = 500.0
+# Autocorrelation peak (relative to lag 0) a frame needs to count as voiced
+VOICING_THRESHOLD = 0.3
+# Frames quieter than this RMS (full scale = 1.0) are never voiced (about -46 dBFS)
+SILENCE_RMS = 0.005
+# Voiced onsets per second that map to speech_rate 1.0
+MAX_ONSET_RATE = 6.0
+BLOCK_FRAMES = 512
+
+
+class FrameFeatures:
+    """
+    Per-frame features of one clip. Arrays are float32, one value per frame
+    starting every `hop_length` samples; `pitch` is 0 for unvoiced frames.
+    """
+
+    __slots__ = ("rms", "zcr", "pitch", "voicing", "sample_rate", "hop_length", "n_samples")
+
+    def __init__(self, rms: np.ndarray, zcr: np.ndarray, pitch: np.ndarray, voicing: np.ndarray,
+                 sample_rate: int, hop_length: int, n_samples: int):
+        self.rms = rms
+        self.zcr = zcr
+        self.pitch = pitch
+        self.voicing = voicing
+        self.sample_rate = sample_rate
+        self.hop_length = hop_length
+        self.n_samples = n_samples
+
+    def __len__(self):
+        return len(self.rms)
+
+    @property
+    def duration(self) -> float:
+        return self.n_samples / self.sample_rate
+
+    def times(self) -> np.ndarray:
+        """Start time (seconds) of each frame."""
+        return np.arange(len(self.rms), dtype=np.float32) * np.float32(self.hop_length / self.sample_rate)
+
+    def summary(self) -> dict:
+        """Clip-level statistics as plain floats (JSON-serializable)."""
+        return summarize_frames(self.rms, self.zcr, self.pitch, self.voicing, self.duration)
+
+
+def summarize_frames(rms: np.ndarray, zcr: np.ndarray, pitch: np.ndarray, voicing: np.ndarray,
+                     duration: float) -> dict:
+    """
+    Clip statistics from per-frame arrays. Volumes are in int16 units, as the
+    tone thresholds expect; `pitch_variance` is the f0 standard deviation (Hz)
+    over voiced frames; `speech_rate` is voiced onsets per second scaled to 0..1;
+    `clarity` is the mean voicing strength of voiced frames.
+    """
+    if not len(rms):
+        return {"volume_mean": 0.0, "volume_std": 0.0, "pitch_mean": 0.0, "pitch_variance": 0.0,
+                "speech_rate": 0.0, "clarity": 0.5, "zcr_mean": 0.0, "voiced_ratio": 0.0}
+    voiced = pitch > 0
+    n_voiced = int(np.count_nonzero(voiced))
+    onsets = int(np.count_nonzero(voiced[1:] & ~voiced[:-1])) + int(voiced[0])
+    voiced_pitch = pitch[voiced]
+    return {
+        "volume_mean": float(rms.mean()) * PCM16_SCALE,
+        "volume_std": float(rms.std()) * PCM16_SCALE,
+        "pitch_mean": float(voiced_pitch.mean()) if n_voiced else 0.0,
+        "pitch_variance": float(voiced_pitch.std()) if n_voiced > 1 else 0.0,
+        "speech_rate": min(onsets / duration / MAX_ONSET_RATE, 1.0) if duration > 0 else 0.0,
+        "clarity": float(voicing[voiced].mean()) if n_voiced else 0.5,
+        "zcr_mean": float(zcr.mean()),
+        "voiced_ratio": n_voiced / len(rms),
+    }
+
+
+class FeatureExtractor:
+    """
+    Framed RMS / ZCR / autocorrelation pitch over mono audio.
+
+    Frames are `frame_signal` views of the float32 signal. Pitch is found per
+    block of BLOCK_FRAMES frames (FFT autocorrelation of mean-removed frames),
+    so working memory stays bounded however long the clip is; the block
+    buffer is allocated once per extractor. Not thread-safe: use one
+    extractor per thread or process.
+    """
+
+    def __init__(self, sample_rate: int = 16000, frame_ms: float = FEATURE_FRAME_MS,
+                 hop_ms: float = FEATURE_HOP_MS, fmin: float = PITCH_MIN_HZ, fmax: float = PITCH_MAX_HZ):
+        self.sample_rate = sample_rate
+        self.frame_length = max(int(sample_rate * frame_ms / 1000), 2)
+        self.hop_length = max(int(sample_rate * hop_ms / 1000), 1)
+        self.min_lag = max(int(sample_rate / fmax), 1)
+        self.max_lag = min(int(sample_rate / fmin), self.frame_length - 1)
+        self.nfft = 1 << (2 * self.frame_length - 1).bit_length()
+        self._block = np.empty((BLOCK_FRAMES, self.frame_length), dtype=np.float32)
+
+    def n_frames(self, n_samples: int) -> int:
+        if n_samples < self.frame_length:
+            return 0
+        return 1 + (n_samples - self.frame_length) // self.hop_length
+
+    def _as_float32(self, samples: np.ndarray) -> np.ndarray:
+        if samples.dtype.kind == "i":
+            return samples.astype(np.float32) / np.float32(PCM16_SCALE)
+        return np.ascontiguousarray(samples, dtype=np.float32)
+
+    def _pitch(self, frames: np.ndarray, rms: np.ndarray, pitch_out: np.ndarray, voicing_out: np.ndarray):
+        for start in range(0, len(frames), BLOCK_FRAMES):
+            stop = min(start + BLOCK_FRAMES, len(frames))
+            block = self._block[: stop - start]
+            np.subtract(frames[start:stop], frames[start:stop].mean(axis=1, keepdims=True), out=block)
+            spectrum = np.fft.rfft(block, n=self.nfft, axis=1)
+            spectrum *= spectrum.conj()
+            ac = np.fft.irfft(spectrum, n=self.nfft, axis=1)[:, : self.max_lag + 1]
+            lags = np.argmax(ac[:, self.min_lag:], axis=1) + self.min_lag
+            rows = np.arange(len(lags))
+            strength = ac[rows, lags] / np.maximum(ac[:, 0], np.float32(1e-12))
+            voiced = (strength > VOICING_THRESHOLD) & (rms[start:stop] > SILENCE_RMS)
+            voicing_out[start:stop] = np.where(voiced, strength, 0.0)
+            pitch_out[start:stop] = np.where(voiced, self.sample_rate / lags, 0.0)
+
+    def extract_into(self, samples: np.ndarray, rms: np.ndarray, zcr: np.ndarray,
+                     pitch: np.ndarray, voicing: np.ndarray) -> int:
+        """
+        Writes per-frame features of `samples` (int16 or float32) into the given
+        float32 arrays, which need room for `n_frames(len(samples))` values.
+        Returns the number of frames.
+        """
+        signal = self._as_float32(samples)
+        frames = frame_signal(signal, self.frame_length, self.hop_length)
+        n = len(frames)
+        if not n:
+            return 0
+        np.sqrt(frame_energy(frames), out=rms[:n])
+        zcr[:n] = frame_zcr(signal, self.frame_length, self.hop_length)
+        self._pitch(frames, rms[:n], pitch[:n], voicing[:n])
+        return n
+
+    def extract(self, samples: np.ndarray) -> FrameFeatures:
+        n = self.n_frames(len(samples))
+        out = np.empty((4, n), dtype=np.float32)
+        self.extract_into(samples, out[0], out[1], out[2], out[3])
+        return FrameFeatures(out[0], out[1], out[2], out[3], self.sample_rate, self.hop_length, len(samples))
+
+    def extract_batch(self, clips) -> list:
+        """
+        Features for many clips. All per-frame outputs share one preallocated
+        (4, total_frames) buffer; each result holds views into it.
+        """
+        counts = [self.n_frames(len(clip)) for clip in clips]
+        out = np.empty((4, sum(counts)), dtype=np.float32)
+        results, offset = [], 0
+        for clip, n in zip(clips, counts):
+            rms, zcr, pitch, voicing = (row[offset: offset + n] for row in out)
+            self.extract_into(clip, rms, zcr, pitch, voicing)
+            results.append(FrameFeatures(rms, zcr, pitch, voicing, self.sample_rate, self.hop_length, len(clip)))
+            offset += n
+        return results
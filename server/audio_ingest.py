@@ -0,0 +1,272 @@
+# child_agent/server/audio_ingest.py
+"""
+Shared audio ingest: decode once, normalize to mono 16 kHz 16-bit PCM.
+
+Incoming clips are sniffed by their magic bytes. WAV is read with the stdlib
+`wave` module; anything else (browser webm/opus, ogg, mp3, ...) is decoded by
+an `ffmpeg` subprocess when one is installed. Decoding and resampling run in a
+small thread pool so the event loop never waits on them.
+
+The single decoded buffer then feeds everything downstream:
+  * `DecodedAudio.samples()` is a zero-copy int16 NumPy view for VAD and tone
+    analysis;
+  * `prepare_for_stt()` trims silence and uploads the most compact encoding
+    STT accepts (the original compressed clip, Opus re-encoded by ffmpeg, or
+    16 kHz linear16 WAV) with the matching Content-Type.
+
+Without ffmpeg, non-WAV clips pass through untouched, as before.
+"""
+import asyncio
+import io
+import os
+import shutil
+import subprocess
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+import numpy as np
+
+from server.metrics import Counter, STAGE_LATENCY
+from server.vad import detect_speech, record_vad_result, vad_enabled
+
+TARGET_SAMPLE_RATE = 16000
+OPUS_BITRATE = "24k"
+FFMPEG_TIMEOUT_SECONDS = 30
+AUDIO_DECODE_WORKERS = int(os.getenv("AUDIO_DECODE_WORKERS", "4"))
+FFMPEG = shutil.which("ffmpeg")
+
+AUDIO_DECODES = Counter("capy_audio_decodes_total", "Incoming audio clips by source format and result.", ["format", "result"])
+STT_UPLOAD_BYTES = Counter("capy_stt_upload_bytes_total", "Audio bytes received from clients and sent to STT.", ["stage"])
+
+CONTENT_TYPES = {
+    "wav": "audio/wav",
+    "webm": "audio/webm",
+    "ogg": "audio/ogg",
+    "mp3": "audio/mpeg",
+    "flac": "audio/flac",
+    "mp4": "audio/mp4",
+}
+# Already-compressed formats that are worth forwarding as-is when nothing was trimmed
+_COMPRESSED_FORMATS = {"webm", "ogg", "mp3", "mp4", "flac"}
+
+_decode_pool = ThreadPoolExecutor(max_workers=AUDIO_DECODE_WORKERS, thread_name_prefix="audio-decode")
+
+
+class DecodedAudio:
+    """Mono 16-bit little-endian PCM at `sample_rate`, decoded from one client clip."""
+
+    __slots__ = ("pcm", "sample_rate", "source_format", "source_bytes")
+
+    def __init__(self, pcm: bytes, sample_rate: int, source_format: str, source_bytes: int):
+        self.pcm = pcm
+        self.sample_rate = sample_rate
+        self.source_format = source_format
+        self.source_bytes = source_bytes
+
+    def samples(self) -> np.ndarray:
+        """Read-only int16 view over the PCM buffer (no copy)."""
+        return np.frombuffer(self.pcm, dtype="<i2")
+
+    @property
+    def duration(self) -> float:
+        return len(self.pcm) / 2 / self.sample_rate
+
+    def wav_bytes(self, start: int = 0, end: Optional[int] = None) -> bytes:
+        """Samples [start, end) wrapped in a WAV header."""
+        out = io.BytesIO()
+        with wave.open(out, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(self.sample_rate)
+            wav.writeframes(memoryview(self.pcm)[start * 2: None if end is None else end * 2])
+        return out.getvalue()
+
+
+class PreparedAudio:
+    """What to send to STT for one clip (nothing, if it had no speech)."""
+
+    __slots__ = ("has_speech", "payload", "content_type", "decoded")
+
+    def __init__(self, has_speech: bool, payload: bytes, content_type: Optional[str],
+                 decoded: Optional[DecodedAudio] = None):
+        self.has_speech = has_speech
+        self.payload = payload
+        self.content_type = content_type
+        self.decoded = decoded
+
+
+# --- Decoding ---
+def sniff_format(data: bytes, content_type: Optional[str] = None) -> str:
+    """Container format from magic bytes, falling back to the declared content type."""
+    head = data[:12]
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "wav"
+    if head[:4] == b"\x1aE\xdf\xa3":
+        return "webm"
+    if head[:4] == b"OggS":
+        return "ogg"
+    if head[:4] == b"fLaC":
+        return "flac"
+    if head[:3] == b"ID3" or head[:2] in (b"\xff\xfb", b"\xff\xf3", b"\xff\xf2"):
+        return "mp3"
+    if head[4:8] == b"ftyp":
+        return "mp4"
+    if content_type and content_type.split(";")[0].strip().lower() in ("audio/l16", "audio/pcm"):
+        return "pcm"
+    return "unknown"
+
+
+def _content_type_rate(content_type: Optional[str], default: int = TARGET_SAMPLE_RATE) -> int:
+    for param in (content_type or "").split(";")[1:]:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "rate" and value.strip().isdigit():
+            return int(value)
+    return default
+
+
+def _resample(samples: np.ndarray, source_rate: int, target_rate: int = TARGET_SAMPLE_RATE) -> np.ndarray:
+    """float32 mono resampling; integer ratios decimate by block averaging."""
+    if source_rate == target_rate or not len(samples):
+        return samples
+    if source_rate % target_rate == 0:
+        factor = source_rate // target_rate
+        usable = len(samples) - len(samples) % factor
+        return samples[:usable].reshape(-1, factor).mean(axis=1)
+    n_out = int(len(samples) * target_rate / source_rate)
+    positions = np.arange(n_out, dtype=np.float64) * (source_rate / target_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def _normalize(samples: np.ndarray, channels: int, sample_rate: int) -> bytes:
+    """int16 interleaved PCM -> mono TARGET_SAMPLE_RATE int16 bytes."""
+    if channels == 1 and sample_rate == TARGET_SAMPLE_RATE:
+        return samples.astype("<i2", copy=False).tobytes()
+    mono = samples.astype(np.float32)
+    if channels > 1:
+        mono = mono[: len(mono) - len(mono) % channels].reshape(-1, channels).mean(axis=1)
+    mono = _resample(mono, sample_rate)
+    return np.clip(np.rint(mono), -32768, 32767).astype("<i2").tobytes()
+
+
+def _decode_wav(data: bytes) -> bytes:
+    with wave.open(io.BytesIO(data), "rb") as wav:
+        channels, width, rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+        frames = wav.readframes(wav.getnframes())
+    if width == 2:
+        if channels == 1 and rate == TARGET_SAMPLE_RATE:
+            return frames
+        samples = np.frombuffer(frames, dtype="<i2")
+    elif width == 1:
+        samples = ((np.frombuffer(frames, dtype=np.uint8).astype(np.int16) - 128) << 8)
+    elif width == 4:
+        samples = (np.frombuffer(frames, dtype="<i4") >> 16).astype(np.int16)
+    else:
+        raise ValueError(f"unsupported WAV sample width {width}")
+    return _normalize(samples, channels, rate)
+
+
+def _run_ffmpeg(args, data: bytes) -> bytes:
+    result = subprocess.run(
+        [FFMPEG, "-hide_banner", "-loglevel", "error", *args],
+        input=data, capture_output=True, timeout=FFMPEG_TIMEOUT_SECONDS,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode("utf-8", errors="replace").strip()[:200])
+    return result.stdout
+
+
+def _decode_ffmpeg(data: bytes) -> bytes:
+    return _run_ffmpeg(
+        ["-i", "pipe:0", "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(TARGET_SAMPLE_RATE), "pipe:1"],
+        data,
+    )
+
+
+def decode_audio(data: bytes, content_type: Optional[str] = None) -> Optional[DecodedAudio]:
+    """
+    Decodes a clip to mono 16 kHz PCM, or returns None if its format can't be
+    decoded here (no ffmpeg for a compressed clip, or corrupt data).
+    """
+    fmt = sniff_format(data, content_type)
+    with STAGE_LATENCY.labels("audio_decode").time():
+        try:
+            if fmt == "wav":
+                pcm = _decode_wav(data)
+            elif fmt == "pcm":
+                usable = len(data) - len(data) % 2
+                pcm = _normalize(np.frombuffer(data, dtype="<i2", count=usable // 2), 1, _content_type_rate(content_type))
+            elif FFMPEG:
+                pcm = _decode_ffmpeg(data)
+            else:
+                AUDIO_DECODES.labels(fmt, "no_decoder").inc()
+                return None
+        except Exception as e:
+            print(f"⚠️ Could not decode {fmt} audio ({len(data)} bytes): {e}")
+            AUDIO_DECODES.labels(fmt, "error").inc()
+            return None
+    AUDIO_DECODES.labels(fmt, "ok").inc()
+    return DecodedAudio(pcm, TARGET_SAMPLE_RATE, fmt, len(data))
+
+
+async def ingest_audio(data: bytes, content_type: Optional[str] = None) -> Optional[DecodedAudio]:
+    """`decode_audio` on the decode worker pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_decode_pool, decode_audio, data, content_type)
+
+
+# --- Encoding for STT ---
+def encode_opus(decoded: DecodedAudio, start: int = 0, end: Optional[int] = None) -> bytes:
+    """Samples [start, end) as Ogg/Opus at OPUS_BITRATE (requires ffmpeg)."""
+    pcm = memoryview(decoded.pcm)[start * 2: None if end is None else end * 2]
+    return _run_ffmpeg(
+        ["-f", "s16le", "-ar", str(decoded.sample_rate), "-ac", "1", "-i", "pipe:0",
+         "-c:a", "libopus", "-b:a", OPUS_BITRATE, "-application", "voip", "-f", "ogg", "pipe:1"],
+        bytes(pcm),
+    )
+
+
+def _smallest_encoding(original: bytes, decoded: DecodedAudio, start: int, end: int,
+                       trimmed: bool) -> Tuple[bytes, str]:
+    candidates = []
+    if not trimmed and decoded.source_format in _COMPRESSED_FORMATS:
+        # Re-encoding an already compressed, untrimmed clip would only cost time
+        return original, CONTENT_TYPES[decoded.source_format]
+    if FFMPEG:
+        try:
+            candidates.append((encode_opus(decoded, start, end), "audio/ogg"))
+        except Exception as e:
+            print(f"⚠️ Opus encoding failed, falling back to linear16: {e}")
+    candidates.append((decoded.wav_bytes(start, end), "audio/wav"))
+    return min(candidates, key=lambda candidate: len(candidate[0]))
+
+
+def _prepare(data: bytes, content_type: Optional[str]) -> PreparedAudio:
+    decoded = decode_audio(data, content_type)
+    if decoded is None:
+        fmt = sniff_format(data, content_type)
+        return PreparedAudio(True, data, content_type or CONTENT_TYPES.get(fmt))
+
+    samples = decoded.samples()
+    start, end = 0, len(samples)
+    if vad_enabled():
+        bounds, _ = detect_speech(samples, decoded.sample_rate)
+        record_vad_result(bounds is not None, len(samples) * 2, 0 if bounds is None else (bounds[1] - bounds[0]) * 2)
+        if bounds is None:
+            return PreparedAudio(False, b"", None, decoded)
+        start, end = bounds
+
+    payload, payload_type = _smallest_encoding(data, decoded, start, end, trimmed=(end - start) < len(samples))
+    return PreparedAudio(True, payload, payload_type, decoded)
+
+
+async def prepare_for_stt(data: bytes, content_type: Optional[str] = None) -> PreparedAudio:
+    """
+    Decodes `data` once, drops it if it has no speech, and picks the smallest
+    upload for STT. Runs on the decode worker pool.
+    """
+    loop = asyncio.get_running_loop()
+    prepared = await loop.run_in_executor(_decode_pool, _prepare, data, content_type)
+    STT_UPLOAD_BYTES.labels("received").inc(len(data))
+    STT_UPLOAD_BYTES.labels("sent").inc(len(prepared.payload))
+    return prepared
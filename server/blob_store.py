@@ -0,0 +1,287 @@
+# child_agent/server/blob_store.py
+"""
+Content-addressed audio blobs for out-of-band transport.
+
+Voice messages between agents used to carry whole clips as base64 inside the
+message envelope. Instead, the sender uploads the bytes once (`PUT /blobs`)
+and the message carries only the SHA-256 digest and a URL; the receiver
+fetches them (`GET /blobs/{digest}`) and checks the digest. Clips under
+INLINE_MAX_BYTES still travel inline, where a round trip would cost more than
+the base64 overhead.
+
+`BlobStore` keeps blobs on disk under BLOB_DIR (`<digest[:2]>/<digest>`) plus
+a byte-bounded in-memory LRU of recent ones, which is what is normally served:
+responses stream `memoryview` slices of the cached bytes, so serving a blob
+copies nothing. Blobs older than BLOB_TTL_SECONDS are pruned (at startup and
+then periodically), and new blobs are refused once BLOB_DISK_MAX_BYTES are
+stored. Uploads need the shared BLOB_UPLOAD_TOKEN.
+
+`BlobClient` is the aiohttp side used by agents to upload and fetch. It only
+fetches blobs from its own server's origin, and stops reading at
+BLOB_MAX_BYTES.
+"""
+import base64
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from server.metrics import Counter
+from server.urls import url_origin
+
+BLOB_DIR = os.getenv("BLOB_DIR", os.path.join("data", "blobs"))
+BLOB_CACHE_BYTES = int(os.getenv("BLOB_CACHE_BYTES", str(64 * 1024 * 1024)))
+BLOB_MAX_BYTES = int(os.getenv("BLOB_MAX_BYTES", str(25 * 1024 * 1024)))
+BLOB_TTL_SECONDS = float(os.getenv("BLOB_TTL_SECONDS", str(24 * 3600)))
+BLOB_DISK_MAX_BYTES = int(os.getenv("BLOB_DISK_MAX_BYTES", str(1024 * 1024 * 1024)))
+BLOB_PRUNE_INTERVAL_SECONDS = float(os.getenv("BLOB_PRUNE_INTERVAL_SECONDS", "600"))
+# Shared secret for PUT /blobs; uploads are refused while it is unset
+BLOB_UPLOAD_TOKEN = os.getenv("BLOB_UPLOAD_TOKEN")
+BLOB_CHUNK_BYTES = 64 * 1024
+# Clips up to this size are sent inline as base64
+INLINE_MAX_BYTES = int(os.getenv("BLOB_INLINE_MAX_BYTES", str(16 * 1024)))
+
+BLOB_BYTES = Counter("capy_blob_bytes_total", "Blob bytes uploaded and served.", ["direction"])
+BLOB_CACHE = Counter("capy_blob_cache_total", "Blob reads by where they were found.", ["result"])
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class BlobTooLarge(ValueError):
+    pass
+
+
+class BlobStoreFull(RuntimeError):
+    pass
+
+
+def is_digest(value: str) -> bool:
+    return bool(value) and _DIGEST_RE.match(value) is not None
+
+
+class BlobStore:
+    """sha256-addressed blobs on disk with a bounded LRU of recent ones in memory."""
+
+    def __init__(self, root: str = BLOB_DIR, cache_bytes: int = BLOB_CACHE_BYTES,
+                 ttl_seconds: float = BLOB_TTL_SECONDS, max_disk_bytes: int = BLOB_DISK_MAX_BYTES):
+        self.root = root
+        self.cache_bytes = cache_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_bytes = max_disk_bytes
+        # Bytes on disk as of the last prune, plus what was written since
+        self.disk_bytes = 0
+        # prune() runs in a worker thread while the event loop reads and writes
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, bytes]" = OrderedDict()
+        self._cached_bytes = 0
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    # --- cache ---
+    def _remember(self, digest: str, data: bytes):
+        if len(data) > self.cache_bytes:
+            return
+        with self._lock:
+            if digest in self._cache:
+                self._cache.move_to_end(digest)
+                return
+            self._cache[digest] = data
+            self._cached_bytes += len(data)
+            while self._cached_bytes > self.cache_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self._cached_bytes -= len(evicted)
+
+    # --- write ---
+    def put(self, data, digest: Optional[str] = None) -> str:
+        """
+        Stores `data` (bytes-like) and returns its hex digest. Idempotent.
+        Nothing is copied: only immutable `bytes` are kept in the cache, other
+        buffers are just written out. Blocking; run it in a thread.
+        """
+        if len(data) > BLOB_MAX_BYTES:
+            raise BlobTooLarge(f"blob of {len(data)} bytes exceeds {BLOB_MAX_BYTES}")
+        digest = digest or hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            if self.disk_bytes + len(data) > self.max_disk_bytes:
+                raise BlobStoreFull(f"blob store holds {self.disk_bytes} of {self.max_disk_bytes} bytes")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            with self._lock:
+                self.disk_bytes += len(data)
+        if isinstance(data, bytes):
+            self._remember(digest, data)
+        BLOB_BYTES.labels("in").inc(len(data))
+        return digest
+
+    # --- read ---
+    def cached(self, digest: str) -> Optional[memoryview]:
+        """Read-only view of the blob if it is in the memory cache; never touches the disk."""
+        with self._lock:
+            data = self._cache.get(digest)
+            if data is not None:
+                self._cache.move_to_end(digest)
+        if data is None:
+            return None
+        BLOB_CACHE.labels("hit").inc()
+        return memoryview(data)
+
+    def get(self, digest: str) -> Optional[memoryview]:
+        """
+        Read-only view of the blob, or None if it is unknown or expired. May
+        read the disk; on the event loop, try `cached` first and run this in a thread.
+        """
+        if not is_digest(digest):
+            return None
+        view = self.cached(digest)
+        if view is not None:
+            return view
+        try:
+            with open(self._path(digest), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            BLOB_CACHE.labels("missing").inc()
+            return None
+        BLOB_CACHE.labels("disk").inc()
+        self._remember(digest, data)
+        return memoryview(data)
+
+    async def iter_chunks(self, view: memoryview, chunk_size: int = BLOB_CHUNK_BYTES) -> AsyncIterator[memoryview]:
+        """Slices of `view` for a streaming response (no copies)."""
+        for start in range(0, len(view), chunk_size):
+            yield view[start: start + chunk_size]
+        BLOB_BYTES.labels("out").inc(len(view))
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """
+        Deletes blobs older than the TTL from disk and cache; returns how many.
+        Also recounts the bytes on disk.
+        """
+        cutoff = (time.time() if now is None else now) - self.ttl_seconds
+        removed = 0
+        on_disk = 0
+        if not os.path.isdir(self.root):
+            with self._lock:
+                self.disk_bytes = 0
+            return 0
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    stat = entry.stat()
+                    if stat.st_mtime < cutoff:
+                        os.remove(entry.path)
+                        removed += 1
+                        with self._lock:
+                            cached = self._cache.pop(entry.name, None)
+                            if cached is not None:
+                                self._cached_bytes -= len(cached)
+                    else:
+                        on_disk += stat.st_size
+                except OSError:
+                    continue
+        with self._lock:
+            self.disk_bytes = on_disk
+        return removed
+
+
+blob_store = BlobStore()
+
+
+# --- Message envelopes ---
+def inline_audio(audio: Optional[bytes]) -> str:
+    return base64.b64encode(audio).decode("ascii") if audio else ""
+
+
+class BlobClient:
+    """
+    Uploads blobs to a voice server (`base_url`, e.g. http://localhost:8000) and
+    fetches them by URL. Without a `base_url` everything is sent inline, and
+    references to blobs elsewhere are refused.
+    """
+
+    def __init__(self, base_url: Optional[str] = None, timeout: float = 10.0,
+                 token: Optional[str] = BLOB_UPLOAD_TOKEN, max_bytes: int = BLOB_MAX_BYTES):
+        self.base_url = base_url.rstrip("/") if base_url else None
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.token = token
+        self.max_bytes = max_bytes
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def accepts(self, url: str) -> bool:
+        """True for URLs of blobs on this client's own server."""
+        if self.base_url is None or not url:
+            return False
+        origin = url_origin(url)
+        return origin is not None and origin == url_origin(self.base_url) and urlsplit(url).path.startswith("/blobs/")
+
+    def _client(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=self.timeout)
+        return self._session
+
+    async def upload(self, data: bytes) -> Tuple[str, str]:
+        """Returns (digest, url) for `data`."""
+        headers = {"Content-Type": "application/octet-stream"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        async with self._client().put(f"{self.base_url}/blobs", data=data, headers=headers) as response:
+            response.raise_for_status()
+            body = await response.json()
+        return body["digest"], body["url"]
+
+    async def fetch(self, url: str, digest: str) -> bytes:
+        """Downloads a blob (at most `max_bytes`) and checks it against `digest`."""
+        if not self.accepts(url):
+            raise ValueError(f"refusing to fetch blob from {url}: not under {self.base_url}")
+        async with self._client().get(url, allow_redirects=False) as response:
+            response.raise_for_status()
+            if response.status != 200:
+                raise ValueError(f"blob fetch from {url} returned {response.status}")
+            if response.content_length is not None and response.content_length > self.max_bytes:
+                raise BlobTooLarge(f"blob of {response.content_length} bytes exceeds {self.max_bytes}")
+            hasher = hashlib.sha256()
+            data = bytearray()
+            async for chunk in response.content.iter_chunked(BLOB_CHUNK_BYTES):
+                if len(data) + len(chunk) > self.max_bytes:
+                    raise BlobTooLarge(f"blob from {url} exceeds {self.max_bytes} bytes")
+                hasher.update(chunk)
+                data.extend(chunk)
+        if hasher.hexdigest() != digest:
+            raise ValueError(f"blob from {url} does not match digest {digest[:12]}…")
+        return bytes(data)
+
+    async def pack(self, audio: Optional[bytes]) -> Dict[str, Optional[str]]:
+        """
+        Envelope fields for `audio`: {"data", "hash", "url"}. Small clips (or a
+        failed upload) go inline as base64; larger ones by reference.
+        """
+        if not audio or len(audio) <= INLINE_MAX_BYTES or self.base_url is None:
+            return {"data": inline_audio(audio), "hash": None, "url": None}
+        try:
+            digest, url = await self.upload(audio)
+        except Exception as e:
+            print(f"⚠️ Blob upload failed, sending audio inline: {e}")
+            return {"data": inline_audio(audio), "hash": None, "url": None}
+        return {"data": "", "hash": digest, "url": url}
+
+    async def unpack(self, data: str, digest: Optional[str], url: Optional[str]) -> bytes:
+        """Audio bytes from envelope fields: fetched by reference, else inline base64."""
+        if url and digest:
+            return await self.fetch(url, digest)
+        return base64.b64decode(data) if data else b""
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
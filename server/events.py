@@ -0,0 +1,133 @@
+# child_agent/server/events.py
+"""
+In-process event feed for parent dashboards.
+
+Memory changes (new turns, new facts) and escalation alerts are published as
+small incremental events. Each event gets a monotonically increasing ID and is
+kept in a bounded per-child replay buffer, so a client that reconnects with
+`Last-Event-ID` receives exactly what it missed. Live subscribers each get a
+bounded queue; a subscriber that falls too far behind is disconnected and
+resumes from the buffer on reconnect instead of slowing publishers down.
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Set
+
+from server.metrics import Gauge, Counter
+
+SSE_SUBSCRIBERS = Gauge("capy_sse_subscribers", "Open Server-Sent Events subscriptions.")
+EVENTS_PUBLISHED = Counter("capy_events_published_total", "Dashboard events published per type.", ["type"])
+
+REPLAY_BUFFER_SIZE = 1000
+SUBSCRIBER_QUEUE_SIZE = 256
+HEARTBEAT_SECONDS = 15
+
+
+class Event:
+    __slots__ = ("id", "child_id", "type", "data", "timestamp")
+
+    def __init__(self, event_id: int, child_id: str, event_type: str, data: Dict[str, Any]):
+        self.id = event_id
+        self.child_id = child_id
+        self.type = event_type
+        self.data = data
+        self.timestamp = time.time()
+
+    def to_sse(self) -> str:
+        payload = json.dumps({"child_id": self.child_id, "timestamp": self.timestamp, **self.data})
+        return f"id: {self.id}\nevent: {self.type}\ndata: {payload}\n\n"
+
+
+class _Subscriber:
+    __slots__ = ("queue", "overflowed")
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+
+class EventBus:
+    """Publishes per-child events to live subscribers and a replay buffer."""
+
+    def __init__(self, buffer_size: int = REPLAY_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        # IDs start at the current time in ms so they keep increasing across
+        # restarts; anything older than _first_id was lost with the old process.
+        self._first_id = int(time.time() * 1000)
+        self._ids = itertools.count(self._first_id)
+        self._buffers: Dict[str, Deque[Event]] = {}
+        self._evicted_up_to: Dict[str, int] = {}
+        self._subscribers: Dict[str, Set[_Subscriber]] = {}
+
+    def publish(self, child_id: str, event_type: str, data: Dict[str, Any]) -> Event:
+        event = Event(next(self._ids), child_id, event_type, data)
+        buffer = self._buffers.get(child_id)
+        if buffer is None:
+            buffer = self._buffers[child_id] = deque(maxlen=self.buffer_size)
+        if len(buffer) == self.buffer_size:
+            self._evicted_up_to[child_id] = buffer[0].id
+        buffer.append(event)
+        EVENTS_PUBLISHED.labels(event_type).inc()
+
+        for subscriber in list(self._subscribers.get(child_id, ())):
+            if subscriber.overflowed:
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Drop the slow consumer; it resumes from the replay buffer
+                subscriber.overflowed = True
+        return event
+
+    def replay(self, child_id: str, last_event_id: int) -> Optional[List[Event]]:
+        """
+        Events after `last_event_id`, or None if some of them are no longer
+        available (evicted, or published before a restart); the client must
+        then refetch a full snapshot.
+        """
+        if last_event_id and (last_event_id < self._first_id - 1
+                              or last_event_id < self._evicted_up_to.get(child_id, 0)):
+            return None
+        return [event for event in self._buffers.get(child_id, ()) if event.id > last_event_id]
+
+    async def stream(self, child_id: str, last_event_id: int = 0,
+                     heartbeat: float = HEARTBEAT_SECONDS) -> AsyncIterator[str]:
+        """Yields SSE-formatted events: the missed ones first, then live ones."""
+        subscriber = _Subscriber()
+        self._subscribers.setdefault(child_id, set()).add(subscriber)
+        SSE_SUBSCRIBERS.inc()
+        try:
+            yield "retry: 3000\n\n"
+            missed = self.replay(child_id, last_event_id)
+            sent_up_to = last_event_id
+            if missed is None:
+                yield f"event: reset\ndata: {json.dumps({'child_id': child_id, 'reason': 'missed events are no longer available'})}\n\n"
+                missed = list(self._buffers.get(child_id, ()))
+            for event in missed:
+                yield event.to_sse()
+                sent_up_to = event.id
+
+            while not subscriber.overflowed:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event.id <= sent_up_to:
+                    continue  # already delivered during replay
+                yield event.to_sse()
+                sent_up_to = event.id
+        finally:
+            self._subscribers[child_id].discard(subscriber)
+            SSE_SUBSCRIBERS.dec()
+
+    def memory_listener(self, memory_store, event_type: str, data: Dict[str, Any]):
+        """Adapter for JSONMemory.add_listener: republishes memory changes."""
+        self.publish(memory_store.child_id, event_type, data)
+
+
+# Initialize the shared bus
+event_bus = EventBus()
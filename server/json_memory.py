@@ -1,9 +1,17 @@
 # child_agent/server/json_memory.py
 import json, os, random
+from server.metrics import STAGE_LATENCY, MEMORY_TURNS, MEMORY_FACTS
+from server.prompt_builder import estimate_tokens
+from server.retrieval import TurnIndex
 
 class JSONMemory:
-    def __init__(self, filename="memory.json"):
+    def __init__(self, filename="memory.json", child_id="default"):
         self.filename = filename
+        self.child_id = child_id
+        # Callbacks fn(memory, event_type, data) run after every change
+        self._listeners = []
+        # Bumped on every change so cached prompt fragments can be invalidated
+        self.version = 0
         self._load()
 
     def _load(self):
@@ -17,24 +25,54 @@ class JSONMemory:
         except (FileNotFoundError, json.JSONDecodeError):
             self.context = []
             self.facts = {}
+        self._rebuild_index()
+
+    def _rebuild_index(self):
+        # Relevance index over past turns, kept in step with self.context
+        self.index = TurnIndex()
+        for turn in self.context:
+            self._index_turn(turn)
+
+    def _index_turn(self, turn: dict):
+        # Token cost matches the JSON fragment the prompt assembler will emit
+        self.index.add(turn.get("user", ""), turn.get("agent", ""),
+                       tokens=estimate_tokens(json.dumps(turn)) + 1)
+
+    def add_listener(self, listener):
+        """Registers fn(memory, event_type, data), called on "turn" and "fact" changes."""
+        self._listeners.append(listener)
+
+    def _notify(self, event_type: str, data: dict):
+        for listener in self._listeners:
+            try:
+                listener(self, event_type, data)
+            except Exception as e:
+                print(f"⚠️ Memory listener failed: {e}")
 
     def _save(self):
         data = {
             "context": self.context,
             "facts": self.facts
         }
-        with open(self.filename, 'w') as f:
-            json.dump(data, f, indent=4)
+        with STAGE_LATENCY.labels("memory_save").time():
+            with open(self.filename, 'w') as f:
+                json.dump(data, f, indent=4)
 
     def remember(self, user_input: str, agent_reply: str):
         """Adds a turn to the conversation context."""
-        self.context.append({"user": user_input, "agent": agent_reply})
+        turn = {"user": user_input, "agent": agent_reply}
+        self.context.append(turn)
+        self._index_turn(turn)
+        self.version += 1
         self._save()
+        self._notify("turn", {"index": len(self.context) - 1, **turn})
         
     def add_fact(self, key: str, value: str):
         """Adds a fact to the child's personality profile."""
         self.facts[key] = value
+        self.version += 1
         self._save()
+        self._notify("fact", {"key": key, "value": value})
 
     def get_facts(self) -> dict:
         """Returns the current stored facts about the child."""
@@ -44,9 +82,16 @@ class JSONMemory:
         """Clears all context and facts."""
         self.context = []
         self.facts = {}
+        self.index = TurnIndex()
+        self.version += 1
         self._save()
+        self._notify("cleared", {})
 
 # Initialize memory instance
 memory = JSONMemory()
 
+# Store size is read at scrape time, so remember()/add_fact() pay nothing for it
+MEMORY_TURNS.set_function(lambda: len(memory.context))
+MEMORY_FACTS.set_function(lambda: len(memory.facts))
+
 
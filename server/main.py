@@ -1,13 +1,30 @@
 import os
+import time
+import hashlib
+import hmac
+import asyncio
 from fastapi import FastAPI, UploadFile, File, WebSocket, Request # Combined imports
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, JSONResponse, StreamingResponse
 from pydantic import BaseModel # New Pydantic model for text chat
+from typing import Optional
 from dotenv import load_dotenv
 from server.stt import transcribe_audio
-from server.tts import synthesize_speech
+from server.audio_ingest import prepare_for_stt
 # Combined and updated agent imports
 from server.agent import get_agent_response, client, generate_parent_summary_response
 from server.json_memory import memory
+from server.metrics import TURN_LATENCY, OPEN_WEBSOCKETS, render_latest, CONTENT_TYPE_LATEST
+from server.usage import usage_tracker, usage_context
+from server.summary_jobs import SummaryJobManager, callback_allowed, clamp_wait
+from server.responses import conditional_json_response, fast_dumps
+from server.prompt_builder import prompt_assembler
+from server.events import event_bus
+from server.alerts import alert_bus
+from server.voice_session import VoiceSession
+from server.blob_store import (
+    blob_store, BlobTooLarge, BlobStoreFull, BLOB_MAX_BYTES, BLOB_PRUNE_INTERVAL_SECONDS, BLOB_UPLOAD_TOKEN,
+)
 from starlette.websockets import WebSocketDisconnect
 
 # --- New Imports for Agentverse Chat Protocol (from File 1) ---
@@ -22,6 +39,12 @@ from uuid import uuid4
 # Pydantic model for incoming JSON text messages (from File 2)
 class MessageRequest(BaseModel):
     message: str
+    session_id: str = "default"
+
+# Optional body for POST /parent_summary
+class ParentSummaryRequest(BaseModel):
+    callback_url: str = None  # pushed the finished job as JSON (SUMMARY_CALLBACK_ALLOWLIST origins only)
+    force: bool = False       # recompute even if a job for this memory version exists
 
 # Load environment variables from the .env file
 load_dotenv()
@@ -57,63 +80,18 @@ app.add_middleware(
 from starlette.websockets import WebSocketDisconnect #add if not present
 @app.websocket("/voice")
 async def voice_chat(ws: WebSocket):
+    connected = False
+    # Each socket is its own usage-accounting session
+    session_id = ws.query_params.get("session_id") or str(uuid4())
     try:
         await ws.accept()
+        connected = True
+        OPEN_WEBSOCKETS.inc()
         print("🎙️ WebSocket connected")
 
-        while True:
-            #ws.receive() to handle text, bytes, or json
-            data = await ws.receive()
-            user_text = ""
-
-            # Handle text or audio bytes from WebSocket
-            if "text" in data:
-                user_text = data["text"]
-            elif "bytes" in data:
-                audio_bytes = data["bytes"]
-                print(f"🎙️ Received {len(audio_bytes)} bytes of audio.")
-                
-                #skip empty messages
-                if not audio_bytes:
-                    continue 
-
-                #call STT module with raw bytes 
-                user_text = await transcribe_audio(audio_bytes)
-                print(f"👂 Transcription Result: {user_text}")
-            
-            # Client sent a text message inside a JSON object (for flexibility)
-            elif "json" in data and "text" in data["json"]:
-                user_text = data["json"]["text"]
-            if not user_text or user_text in ["[Deepgram API key missing]", "[transcription error]"]:
-                if "[transcription error]" in user_text:
-                    await ws.send_text("I'm sorry, I had trouble hearing you. Can you try again?")
-                continue
-            # else:
-                # continue
-
-            print(f"👦 User: {user_text}")
-
-            # Use the updated get_agent_response that returns reply, analysis, and facts (from File 2)
-            response_dict = await get_agent_response(user_text)
-            reply_text = response_dict['reply']
-            
-            # Save conversation to memory (from File 1, but applied after extracting reply_text)
-            memory.remember(user_text, reply_text)
-            
-            print(f"🤖 Agent: {reply_text}")
-            print(f"🚨 Analysis: {response_dict.get('analysis', 'N/A')}") # Include analysis if present
-
-            # Synthesize speech and send bytes (standard logic)
-            audio_reply = await synthesize_speech(reply_text)
-            
-            if audio_reply:
-                await ws.send_bytes(audio_reply)
-            else:
-                #agent TTS (ElevenLabs) not working 
-                await ws.send_text("I can't talk right now, but here is my text reply: " + reply_text)
-
-            pass 
-        
+        # Reader and worker run concurrently; new speech cancels the turn in flight
+        await VoiceSession(ws, session_id).run()
+
     except WebSocketDisconnect:
         print("🎙️ WebSocket disconnected cleanly.")
     except Exception as e:
@@ -122,6 +100,9 @@ async def voice_chat(ws: WebSocket):
             await ws.close()
         except Exception:
             pass
+    finally:
+        if connected:
+            OPEN_WEBSOCKETS.dec()
 
 
 # ------------------------------------------------
@@ -139,39 +120,207 @@ async def handle_text_message(request: MessageRequest):
     print(f"📥 Received text message: {user_text}")
 
     # Use the updated get_agent_response that returns reply, analysis, and facts
-    response_data = await get_agent_response(user_text)
+    with TURN_LATENCY.labels("message").time(), usage_context("message", request.session_id):
+        response_data = await get_agent_response(user_text)
 
     return response_data
 
 # UPDATED ENDPOINT: Now returns both conversation context and learned facts (from File 2)
+# Distinguishes ETags across restarts, since memory.version starts again at 0
+_ETAG_EPOCH = uuid4().hex[:8]
+SUMMARY_PAGE_DEFAULT = 50
+SUMMARY_PAGE_MAX = 500
+
 @app.get("/summary")
-async def get_summary():
-    """Returns the full conversation context and the learned child facts."""
-    return {"conversations": memory.context, "facts": memory.get_facts()}
+async def get_summary(request: Request, cursor: Optional[int] = None, limit: Optional[int] = None):
+    """
+    Returns the conversation context and the learned child facts. Without
+    paging parameters this is the full context, as before; with `cursor`
+    and/or `limit` it is the page of turns [cursor, cursor + limit). Poll with
+    `cursor=next_cursor` to fetch only new turns; unchanged polls with
+    If-None-Match get a 304.
+    """
+    total = len(memory.context)
+    if cursor is None and limit is None:
+        start, end = 0, total
+    else:
+        start = min(max(cursor or 0, 0), total)
+        page = SUMMARY_PAGE_DEFAULT if limit is None else limit
+        end = min(start + min(max(page, 1), SUMMARY_PAGE_MAX), total)
+    etag = f'W/"{_ETAG_EPOCH}-{memory.version}-{start}-{end}"'
+
+    def build_body() -> bytes:
+        # Turns come pre-serialized from the prompt assembler's per-turn cache
+        conversations = prompt_assembler.turns_window_json(memory, start, end).encode("utf-8")
+        meta = fast_dumps({
+            "facts": memory.get_facts(),
+            "cursor": start,
+            "next_cursor": end if end < total else None,
+            "total_turns": total,
+            "memory_version": memory.version,
+        })
+        return b'{"conversations":' + conversations + b"," + meta[1:]
+
+    return conditional_json_response(request, etag, build_body)
+
+# --- LIVE EVENTS FOR PARENT DASHBOARDS ---
+# New turns, facts and escalation alerts are pushed as Server-Sent Events
+memory.add_listener(event_bus.memory_listener)
+
+@app.get("/events")
+async def stream_events(request: Request, child_id: str = None, last_event_id: int = 0):
+    """
+    SSE feed of `turn`, `fact` and `alert` events for one child. Reconnecting
+    clients resume via the Last-Event-ID header (or `last_event_id`); a `reset`
+    event means the gap can't be replayed and /summary should be refetched.
+    """
+    header_id = request.headers.get("last-event-id")
+    if header_id and header_id.isdigit():
+        last_event_id = int(header_id)
+
+    async def event_stream():
+        async for chunk in event_bus.stream(child_id or memory.child_id, last_event_id):
+            if await request.is_disconnected():
+                break
+            yield chunk
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# --- OUT-OF-BAND AUDIO BLOBS ---
+# Agents exchange large clips by digest + URL instead of base64 in the message
+@app.put("/blobs")
+async def put_blob(request: Request):
+    """Stores the raw request body; returns its sha256 digest and fetch URL. Needs BLOB_UPLOAD_TOKEN."""
+    if not BLOB_UPLOAD_TOKEN:
+        return JSONResponse({"detail": "Blob uploads are disabled (BLOB_UPLOAD_TOKEN is not set)."}, status_code=403)
+    if not hmac.compare_digest(request.headers.get("authorization", ""), f"Bearer {BLOB_UPLOAD_TOKEN}"):
+        return JSONResponse({"detail": "Missing or wrong blob upload token."}, status_code=401)
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > BLOB_MAX_BYTES:
+        return JSONResponse({"detail": f"Blob exceeds {BLOB_MAX_BYTES} bytes."}, status_code=413)
+    hasher = hashlib.sha256()
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > BLOB_MAX_BYTES:
+            return JSONResponse({"detail": f"Blob exceeds {BLOB_MAX_BYTES} bytes."}, status_code=413)
+        hasher.update(chunk)
+        chunks.append(chunk)
+    if not size:
+        return JSONResponse({"detail": "Empty blob."}, status_code=400)
+    # One join into the immutable bytes the store caches as-is; the disk write runs off the loop
+    body = b"".join(chunks)
+    del chunks
+    try:
+        digest = await asyncio.to_thread(blob_store.put, body, hasher.hexdigest())
+    except BlobTooLarge as e:
+        return JSONResponse({"detail": str(e)}, status_code=413)
+    except BlobStoreFull as e:
+        return JSONResponse({"detail": str(e)}, status_code=507)
+    return {"digest": digest, "url": str(request.url_for("get_blob", digest=digest)), "size": len(body)}
+
+@app.get("/blobs/{digest}")
+async def get_blob(digest: str, request: Request):
+    view = blob_store.cached(digest)
+    if view is None:
+        view = await asyncio.to_thread(blob_store.get, digest)
+    if view is None:
+        return JSONResponse({"detail": "Unknown blob."}, status_code=404)
+    # Content-addressed, so a blob never changes
+    headers = {"ETag": f'"{digest}"', "Cache-Control": "private, max-age=86400, immutable"}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    headers["Content-Length"] = str(len(view))
+    return StreamingResponse(blob_store.iter_chunks(view), media_type="application/octet-stream", headers=headers)
+
+# --- PARENT SUMMARY JOBS ---
+# Summaries run as background jobs; the scheduler precomputes them after new
+# turns or idle periods so the dashboard rarely waits on the LLM.
+summary_jobs = SummaryJobManager(memory, generate_parent_summary_response)
+
+@app.on_event("startup")
+async def start_summary_scheduler():
+    summary_jobs.start_scheduler()
+    # Re-queues alerts left undelivered in the outbox by a previous run
+    alert_bus.start()
+    # Audio blobs are only needed while a message is in flight
+    await asyncio.to_thread(prune_blobs)
+    summary_jobs.add_maintenance(prune_blobs, BLOB_PRUNE_INTERVAL_SECONDS)
+
+def prune_blobs():
+    pruned = blob_store.prune()
+    if pruned:
+        print(f"🧹 Pruned {pruned} expired audio blobs")
+
+@app.on_event("shutdown")
+async def stop_summary_jobs():
+    await summary_jobs.stop()
+    await alert_bus.stop()
 
-# --- NEW ENDPOINT FOR PARENT SUMMARY (from File 2) ---
 @app.post("/parent_summary")
-async def generate_parent_report():
+async def generate_parent_report(request: ParentSummaryRequest = None, wait: float = 0):
     """
-    Generates a holistic summary and professional recommendation for the parent
-    based on the full history and stored facts.
+    Starts (or reuses) a background job that generates a holistic summary and
+    professional recommendation for the parent, and returns its job ID right
+    away. Pass `wait` (seconds, at most 60) to block until the report is ready.
     """
-    report = await generate_parent_summary_response()
-    
-    return report
+    request = request or ParentSummaryRequest()
+    if request.callback_url and not callback_allowed(request.callback_url):
+        return JSONResponse({"detail": "callback_url is not on SUMMARY_CALLBACK_ALLOWLIST."}, status_code=400)
+    with TURN_LATENCY.labels("parent_summary").time():
+        job = summary_jobs.submit(callback_url=request.callback_url, force=request.force)
+        await summary_jobs.wait(job, clamp_wait(wait))
+    status_code = 200 if job.done.is_set() else 202
+    return JSONResponse(job.to_dict(memory.version), status_code=status_code)
+
+@app.get("/parent_summary/latest")
+async def get_latest_parent_report():
+    """Returns the newest finished summary (flagged `stale` if memory has changed since)."""
+    job = summary_jobs.latest()
+    if job is None:
+        return JSONResponse({"detail": "No parent summary has been generated yet."}, status_code=404)
+    return job.to_dict(memory.version)
+
+@app.get("/parent_summary/{job_id}")
+async def get_parent_report(job_id: str, wait: float = 0):
+    """Polls a summary job; `wait` long-polls for up to that many seconds."""
+    job = summary_jobs.get(job_id)
+    if job is None:
+        return JSONResponse({"detail": "Unknown job_id."}, status_code=404)
+    await summary_jobs.wait(job, clamp_wait(wait))
+    return job.to_dict(memory.version)
 
 # API endpoint for agent response (combined, using the logic from File 2)
 @app.get("/agent")
-async def agent_response(message: str = "Hello, what should I say?"):
-    response_data = await get_agent_response(message)
+async def agent_response(message: str = "Hello, what should I say?", session_id: str = "default"):
+    with TURN_LATENCY.labels("agent").time(), usage_context("agent", session_id):
+        response_data = await get_agent_response(message)
     return response_data
 
 # API endpoint for Speech-to-Text (STT) interaction (Redundant, but kept)
 @app.post("/stt")
 async def stt_transcription(audio_file: UploadFile = File(...)):
-    transcription = await transcribe_audio(audio_file)
+    prepared = await prepare_for_stt(await audio_file.read(), audio_file.content_type)
+    if not prepared.has_speech:
+        return {"transcription": ""}
+    transcription = await transcribe_audio(prepared.payload, prepared.content_type)
     return {"transcription": transcription}
 
+# Prometheus scrape endpoint for latency histograms, upstream counters and gauges
+@app.get("/metrics")
+async def metrics():
+    return Response(content=render_latest(), media_type=CONTENT_TYPE_LATEST)
+
+# Token usage per session / endpoint / call type (extraction, reply, summary)
+@app.get("/usage")
+async def get_usage(session_id: str = None):
+    """Returns aggregated LLM token usage, or the usage of a single session."""
+    return usage_tracker.summary(session_id)
+
 # Run the FastAPI app with Uvicorn
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,285 @@
+# child_agent/server/metrics.py
+"""
+Lightweight Prometheus-style metrics for the voice server.
+
+Everything here is in-process and dependency free: counters, gauges and
+histograms keep plain Python numbers and are rendered to the Prometheus text
+exposition format only when `/metrics` is scraped. Label children are created
+once and cached, so the hot path is a dict lookup plus an add (histograms add
+a `bisect`). Updates are not locked; the server runs on a single event loop.
+"""
+import bisect
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Latency buckets (seconds) sized for network calls to STT / LLM / TTS providers.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Token-count buckets for prompt size estimates.
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    """Base class: a named metric family with optional label children."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        REGISTRY.register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """Returns (and caches) the child for the given label values."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Counter(_Metric):
+    """Monotonically increasing count (errors, fallbacks, cache hits)."""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._children[()].inc(amount)
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+            for values, child in list(self._children.items())
+        ]
+
+
+class _GaugeChild:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set_function(self, function: Callable[[], float]):
+        """Evaluates `function` at scrape time instead of storing a value."""
+        self.function = function
+
+    def get(self) -> float:
+        if self.function is not None:
+            try:
+                return float(self.function())
+            except Exception:
+                return float("nan")
+        return self.value
+
+
+class Gauge(_Metric):
+    """A value that can go up and down (open sockets, in-flight calls, store size)."""
+
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self._children[()].set(value)
+
+    def inc(self, amount: float = 1.0):
+        self._children[()].inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._children[()].dec(amount)
+
+    def set_function(self, function: Callable[[], float]):
+        self._children[()].set_function(function)
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.get())}"
+            for values, child in list(self._children.items())
+        ]
+
+
+class _Timer:
+    """Context manager that observes elapsed wall time on exit."""
+
+    __slots__ = ("_child", "_started")
+
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._child.observe(time.perf_counter() - self._started)
+        return False
+
+
+class _HistogramChild:
+    __slots__ = ("upper_bounds", "counts", "sum", "count")
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self.upper_bounds = upper_bounds
+        # One slot per bucket plus the implicit +Inf bucket; stored non-cumulative.
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self) -> _Timer:
+        return _Timer(self)
+
+
+class Histogram(_Metric):
+    """Bucketed distribution of observations (latencies, token counts)."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.upper_bounds = tuple(sorted(float(b) for b in buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.upper_bounds)
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+    def time(self) -> _Timer:
+        return self._children[()].time()
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.upper_bounds + (float("inf"),), child.counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}"
+                )
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds every metric family and renders them for scraping."""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# Content type for the Prometheus text exposition format.
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# --- Metric families used across the server ---
+TURN_LATENCY = Histogram(
+    "capy_turn_latency_seconds", "End-to-end latency of a conversation turn per endpoint.", ["endpoint"]
+)
+STAGE_LATENCY = Histogram(
+    "capy_stage_latency_seconds", "Latency of individual pipeline stages (stt, llm, tts, memory_save).", ["stage"]
+)
+UPSTREAM_ERRORS = Counter(
+    "capy_upstream_errors_total", "Errors returned by or raised while calling upstream services.", ["service"]
+)
+FALLBACKS = Counter(
+    "capy_fallbacks_total", "Times a degraded fallback reply or result was used.", ["kind"]
+)
+CACHE_HITS = Counter(
+    "capy_cache_hits_total", "Cache hits per cache.", ["cache"]
+)
+OPEN_WEBSOCKETS = Gauge(
+    "capy_open_websockets", "Currently open /voice WebSocket connections."
+)
+LLM_IN_FLIGHT = Gauge(
+    "capy_llm_in_flight", "LLM calls currently awaiting a response."
+)
+MEMORY_TURNS = Gauge(
+    "capy_memory_turns", "Conversation turns held in the memory store."
+)
+MEMORY_FACTS = Gauge(
+    "capy_memory_facts", "Facts held in the memory store."
+)
+PROMPT_TOKENS = Histogram(
+    "capy_prompt_tokens_estimate", "Locally estimated prompt tokens per LLM call type.", ["call_type"],
+    buckets=TOKEN_BUCKETS,
+)
+
+
+def render_latest() -> str:
+    """Renders all registered metrics in the Prometheus text format."""
+    return REGISTRY.render()
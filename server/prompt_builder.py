@@ -1,3 +1,6 @@
+import json
+from server.metrics import CACHE_HITS
+
 # --- SYSTEM PROMPT ---
 # This defines the agent's core personality, rules, and conversational style.
 SYSTEM_PROMPT = """
@@ -13,6 +16,17 @@ Guidelines:
 7.  **Handling Uncertainty:** If you don't know the answer to a specific question, respond naturally and honestly, saying something like, "That's a fun question, I don't have the answer to that right now, but I can keep thinking about it!"
 """
 
+# --- TOKEN ESTIMATION ---
+# Rough local estimate (~4 characters per token for English text). It is only
+# used for budgeting and metrics, so it trades accuracy for being nearly free.
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    """Estimates the number of LLM tokens in `text` without a tokenizer."""
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
 # --- KNOWLEDGE BASE (Used for facts and analysis) ---
 # NOTE: This data is loaded directly from this file for fact extraction and escalation trigger analysis.
 KNOWLEDGE_BASE = [
@@ -37,4 +51,255 @@ KNOWLEDGE_BASE = [
         "Criteria": "I'm worried, I'm nervous, I'm scared, I have a panic attack, I'm afraid.",
         "Action": "Use specific diagnostic questions to explore the source of the feeling."
     }
-]
\ No newline at end of file
+]
+
+# --- PROMPT ASSEMBLER ---
+# Static sections are compiled once; facts and conversation turns are
+# serialized once and cached until the memory version changes. Every prompt is
+# built under a token budget that keeps, in priority order: system rules,
+# safety/diagnostic instructions, facts, then the most recent turns.
+
+REPLY_PROMPT_TOKEN_BUDGET = 2000
+EXTRACTION_PROMPT_TOKEN_BUDGET = 800
+SUMMARY_PROMPT_TOKEN_BUDGET = 12000
+MAX_RECENT_TURNS = 5
+# Earlier turns retrieved by relevance to the current input (see server/retrieval.py)
+MAX_RETRIEVED_TURNS = 3
+RETRIEVAL_TOKEN_BUDGET = 400
+
+_FACTS_HEADER = "--- PERSISTENT FACTS ABOUT CHILD (Use to personalize reply) ---"
+_HISTORY_HEADER = "--- CONVERSATION HISTORY (Most Recent Last) ---"
+_RELEVANT_HEADER = "--- RELEVANT EARLIER CONVERSATION (Oldest First) ---"
+_URGENT_HEADER = "--- URGENT INSTRUCTION ---"
+
+_EXTRACTION_RULES = """You are a Fact Extractor. Your job is to analyze the user's input and extract key, enduring personal facts about the child (e.g., 'pet_name: Sparky', 'favorite_subject: Science', 'favorite_animal: Capybara').
+DO NOT extract temporary feelings. ONLY extract concrete, enduring facts."""
+
+_EXTRACTION_TASK = "Task: Return a SINGLE, complete JSON object containing ONLY the facts extracted or updated. If no new facts is found, return an empty JSON object: {}."
+
+_SUMMARY_RULES = """You are a professional Mental Health Analyst. Your task is to identify patterns, not make a formal diagnosis.
+You MUST respond with a single JSON object that strictly adheres to the following JSON schema. Do not include any text outside the JSON block:"""
+
+_SUMMARY_TASK = "Based on the evidence, determine if there is a **POSSIBLE** mental health concern (e.g., Anxiety, Depression, Behavioral Issue). Generate the required JSON output."
+
+_CHUNK_SUMMARY_RULES = """You are a professional Mental Health Analyst reviewing ONE window of a longer conversation between a child and a supportive AI friend. Your task is to note patterns, not make a formal diagnosis.
+You MUST respond with a single JSON object with exactly these keys: "summary" (2-4 sentences on mood, topics and notable events in this window), "concerns" (list of possible concerns such as Anxiety or Depression; empty if none) and "evidence" (list of short quotes from the child supporting the concerns)."""
+
+_REDUCE_TASK = "The history was too long to review at once, so each window was summarized separately (oldest first). Combine the window summaries into one overall assessment. Windows marked \"summary_unavailable\" could not be summarized; do not treat them as uneventful, and note the gap in summary_for_analyst. Based on the evidence, determine if there is a **POSSIBLE** mental health concern (e.g., Anxiety, Depression, Behavioral Issue). Generate the required JSON output."
+
+_STATIC_SYSTEM_PROMPT = SYSTEM_PROMPT.strip()
+_STATIC_SYSTEM_TOKENS = estimate_tokens(_STATIC_SYSTEM_PROMPT)
+
+
+def _fact_item(key, value):
+    fragment = json.dumps({key: value})[1:-1]
+    return key, fragment, estimate_tokens(fragment) + 1
+
+
+class PromptAssembler:
+    """Builds size-bounded prompts from memory with cached serialized fragments."""
+
+    def __init__(self):
+        self._facts_version = None
+        self._facts_items = []          # [(key, json fragment, tokens)] in insertion order
+        self._turn_source = None        # first turn dict the turn cache was built from
+        self._turn_json = []            # json.dumps(turn) per turn, aligned with memory.context
+        self._turn_tokens = []
+        self._static_cache = {}
+
+    # --- cached fragments ---
+    def _facts(self, memory):
+        if self._facts_version == memory.version:
+            CACHE_HITS.labels("prompt_facts").inc()
+        else:
+            items = []
+            for key, value in memory.get_facts().items():
+                items.append(_fact_item(key, value))
+            self._facts_items = items
+            self._facts_version = memory.version
+        return self._facts_items
+
+    def _turns(self, memory):
+        context = memory.context
+        # Turns are append-only; rebuild only if the history was cleared or replaced
+        if (len(self._turn_json) > len(context)
+                or (context and self._turn_source is not context[0])):
+            self._turn_json, self._turn_tokens = [], []
+            self._turn_source = context[0] if context else None
+        for turn in context[len(self._turn_json):]:
+            fragment = json.dumps(turn)
+            self._turn_json.append(fragment)
+            self._turn_tokens.append(estimate_tokens(fragment) + 1)
+        return self._turn_json, self._turn_tokens
+
+    def static(self, key: str, build):
+        """Caches a static fragment (e.g. a JSON schema) built once per process."""
+        if key not in self._static_cache:
+            self._static_cache[key] = build()
+        return self._static_cache[key]
+
+    # --- budgeted fragments ---
+    def facts_json(self, memory, budget: int, pending_facts: dict = None) -> str:
+        """
+        Serializes facts within `budget` tokens, dropping the oldest facts first.
+        `pending_facts` (extracted but not yet stored) are treated as the newest.
+        """
+        items = self._facts(memory)
+        if pending_facts:
+            items = [item for item in items if item[0] not in pending_facts]
+            items += [_fact_item(key, value) for key, value in pending_facts.items()]
+        kept, used = [], 2
+        for _, fragment, tokens in reversed(items):
+            if used + tokens > budget:
+                break
+            kept.append(fragment)
+            used += tokens
+        kept.reverse()
+        return "{" + ", ".join(kept) + "}"
+
+    def recent_turns(self, memory, budget: int, max_turns: int = None):
+        """
+        Returns (json, turn_count) for the most recent turns (oldest first) that
+        fit in `budget` tokens. Selection walks backwards from the newest turn
+        and stops at the first turn that does not fit, so truncation is
+        deterministic.
+        """
+        fragments, tokens = self._turns(memory)
+        end = len(fragments)
+        start = 0 if max_turns is None else max(0, end - max_turns)
+        used, first = 2, end
+        for i in range(end - 1, start - 1, -1):
+            if used + tokens[i] > budget:
+                break
+            used += tokens[i]
+            first = i
+        return "[" + ", ".join(fragments[first:end]) + "]", end - first
+
+    def recent_turns_json(self, memory, budget: int, max_turns: int = None) -> str:
+        return self.recent_turns(memory, budget, max_turns)[0]
+
+    def relevant_turns_json(self, memory, query: str, budget: int, exclude_last: int) -> str:
+        """Serializes earlier turns most relevant to `query`, within `budget` tokens."""
+        fragments, _ = self._turns(memory)
+        hits = memory.index.search(
+            query, k=MAX_RETRIEVED_TURNS, token_budget=max(budget - 2, 0), exclude_last=exclude_last
+        )
+        picked = [fragments[i] for i, _ in hits if i < len(fragments)]
+        return "[" + ", ".join(picked) + "]" if picked else ""
+
+    # --- prompts ---
+    def build_reply_prompt(self, memory, user_input: str, diagnostic_instruction: str = "",
+                           budget: int = REPLY_PROMPT_TOKEN_BUDGET, pending_facts: dict = None) -> str:
+        remaining = budget - _STATIC_SYSTEM_TOKENS - estimate_tokens(user_input)
+        remaining -= estimate_tokens(diagnostic_instruction)
+        facts_str = self.facts_json(memory, max(remaining, 0), pending_facts)
+        remaining -= estimate_tokens(facts_str)
+        context_str, recent_count = self.recent_turns(memory, max(remaining, 0), max_turns=MAX_RECENT_TURNS)
+        remaining -= estimate_tokens(context_str)
+        relevant_str = self.relevant_turns_json(
+            memory, user_input, min(remaining, RETRIEVAL_TOKEN_BUDGET), exclude_last=recent_count
+        )
+        sections = [
+            _STATIC_SYSTEM_PROMPT,
+            "",
+            _FACTS_HEADER,
+            facts_str,
+            "",
+        ]
+        if relevant_str:
+            sections += [_RELEVANT_HEADER, relevant_str, ""]
+        sections += [
+            _HISTORY_HEADER,
+            context_str,
+            "",
+            _URGENT_HEADER,
+            diagnostic_instruction,
+        ]
+        return "\n".join(sections)
+
+    def build_extraction_prompt(self, memory, user_input: str,
+                                budget: int = EXTRACTION_PROMPT_TOKEN_BUDGET) -> str:
+        remaining = budget - estimate_tokens(_EXTRACTION_RULES) - estimate_tokens(_EXTRACTION_TASK)
+        remaining -= estimate_tokens(user_input)
+        facts_str = self.facts_json(memory, max(remaining, 0)) if memory.get_facts() else "None"
+        return "\n".join([
+            _EXTRACTION_RULES,
+            "",
+            f"Current known facts: {facts_str}",
+            f'User Input: "{user_input}"',
+            "",
+            _EXTRACTION_TASK,
+        ])
+
+    def build_summary_messages(self, memory, schema_json: str,
+                               budget: int = SUMMARY_PROMPT_TOKEN_BUDGET):
+        system_instruction = self.static(
+            ("summary_system", schema_json), lambda: f"{_SUMMARY_RULES}\n{schema_json}"
+        )
+        remaining = budget - estimate_tokens(system_instruction) - estimate_tokens(_SUMMARY_TASK)
+        facts_str = self.facts_json(memory, max(remaining, 0))
+        remaining -= estimate_tokens(facts_str)
+        context_str = self.recent_turns_json(memory, max(remaining, 0))
+        user_task = "\n".join([
+            "Review the following child's conversation history and personality facts.",
+            "",
+            f"Personality Facts: {facts_str}",
+            f"Conversation History: {context_str}",
+            "",
+            _SUMMARY_TASK,
+        ])
+        return [
+            {"role": "system", "content": system_instruction},
+            {"role": "user", "content": user_task},
+        ]
+
+    def turns_window_json(self, memory, start: int, end: int) -> str:
+        """Serializes turns [start, end) from the cached per-turn fragments."""
+        fragments, _ = self._turns(memory)
+        return "[" + ", ".join(fragments[start:end]) + "]"
+
+    def build_chunk_summary_messages(self, window_json: str, start: int, end: int):
+        """Map step of a chunked parent summary: summarize one history window."""
+        return [
+            {"role": "system", "content": _CHUNK_SUMMARY_RULES},
+            {"role": "user", "content": f"Conversation window (turns {start + 1}-{end}): {window_json}"},
+        ]
+
+    def build_reduce_summary_messages(self, memory, partials, schema_json: str,
+                                      budget: int = SUMMARY_PROMPT_TOKEN_BUDGET):
+        """
+        Reduce step of a chunked parent summary. `partials` are the window
+        summaries (oldest first); if they exceed the budget the oldest windows
+        are dropped first, like turns in the single-prompt summary.
+        """
+        system_instruction = self.static(
+            ("summary_system", schema_json), lambda: f"{_SUMMARY_RULES}\n{schema_json}"
+        )
+        remaining = budget - estimate_tokens(system_instruction) - estimate_tokens(_REDUCE_TASK)
+        facts_str = self.facts_json(memory, max(remaining, 0))
+        remaining -= estimate_tokens(facts_str)
+        kept = []
+        for partial in reversed(partials):
+            fragment = json.dumps(partial)
+            cost = estimate_tokens(fragment) + 1
+            if cost > remaining:
+                break
+            kept.append(fragment)
+            remaining -= cost
+        kept.reverse()
+        user_task = "\n".join([
+            "Review the following child's personality facts and conversation window summaries.",
+            "",
+            f"Personality Facts: {facts_str}",
+            f"Window Summaries: [{', '.join(kept)}]",
+            "",
+            _REDUCE_TASK,
+        ])
+        return [
+            {"role": "system", "content": system_instruction},
+            {"role": "user", "content": user_task},
+        ]
+
+
+# Initialize the shared assembler
+prompt_assembler = PromptAssembler()
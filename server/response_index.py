@@ -0,0 +1,439 @@
+# child_agent/server/response_index.py
+"""
+Local retrieval responder: canned replies for the chat agent, and the reply
+fallback when the LLM is unavailable.
+
+Every response source is loaded into one index:
+  * responses.json: a list of {"input_patterns": [...], "replies": [...]}
+  * the older {"keywords": [...], "responses": [...]} shape, wherever it appears
+  * data/responses/*.json: either of the above, or {"responses": [...]}
+    without patterns, which answers to the file's name (sadness.json -> "sadness")
+  * the compiled index under COMPILED_INDEX_DIR (compile_responses.py), which
+    holds the above plus the cleaned-up learning log
+
+An `IndexSegment` treats each pattern as a document. Its arrays:
+  term_hash        sorted 64-bit token hashes (the vocabulary), with `idf`
+  postings_*       CSR inverted index: `postings_ptr[t]:postings_ptr[t+1]`
+                   slices `postings_doc` / `postings_weight`, the documents'
+                   L2-normalised TF-IDF weights for term t
+  doc_entry        pattern -> entry
+  reply_ptr        entry -> range of `reply_offsets`, which slice the UTF-8 `text`
+  pair_hash        sorted hashes of (pattern, reply) pairs, for deduplication
+Query tokens are hashed once and found with `np.searchsorted`, and the cosine
+score against every pattern is one `np.bincount` over their postings. Patterns
+sharing no token with the query are never touched. The cosine only counts
+query tokens some pattern uses, so a pattern must also have at least
+MIN_COVERAGE of its (squared, L2-normalised) weight matched: otherwise a
+message sharing only "i" and "to" with "I feel sad" would score as well as
+one that says it.
+
+Segments are saved to a versioned binary file (header, section table, 16-byte
+aligned arrays) that is opened with `np.memmap`. Loading one costs the same
+however large it is. A compiled index is a directory of segments plus
+`manifest.json`. Appends add a segment and the best score across segments
+wins, the newest segment on a tie.
+
+`ResponseIndex` uses the compiled index when its recorded source files are
+unchanged and otherwise also indexes the JSON sources directly. It reloads
+when the sources or the manifest change, checking at most every
+RELOAD_CHECK_SECONDS.
+"""
+import glob
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import struct
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+RESPONSES_FILE = os.getenv("RESPONSES_FILE", "responses.json")
+RESPONSES_DIR = os.getenv("RESPONSES_DIR", os.path.join("data", "responses"))
+COMPILED_INDEX_DIR = os.getenv("RESPONSE_INDEX_DIR", os.path.join("data", "response_index"))
+MIN_SCORE = float(os.getenv("RESPONSE_MIN_SCORE", "0.3"))
+MIN_COVERAGE = float(os.getenv("RESPONSE_MIN_COVERAGE", "0.6"))
+RELOAD_CHECK_SECONDS = 1.0
+SCORE_TOLERANCE = 1e-6
+
+MANIFEST_FILE = "manifest.json"
+SEGMENT_MAGIC = b"CAPYRIDX"
+SEGMENT_VERSION = 1
+_SEGMENT_HEADER = struct.Struct("<8sIIQ")  # magic, version, section count, created (ms)
+_SECTION = struct.Struct("<16sQQ")  # name, offset, element count
+_ALIGN = 16
+
+SECTIONS = (
+    ("term_hash", np.uint64),
+    ("idf", np.float32),
+    ("postings_ptr", np.int64),
+    ("postings_doc", np.int32),
+    ("postings_weight", np.float32),
+    ("doc_entry", np.int32),
+    ("reply_ptr", np.int64),
+    ("reply_offsets", np.int64),
+    ("text", np.uint8),
+    ("pair_hash", np.uint64),
+)
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:'[a-z0-9]+)*")
+_QUOTES = str.maketrans({"’": "'", "‘": "'", "`": "'"})
+
+Entry = Tuple[List[str], List[str]]
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower().translate(_QUOTES))
+
+
+def stable_hash(text: str) -> int:
+    # blake2b is stable across processes, unlike the built-in str hash
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def pair_key(pattern: str, reply: str) -> int:
+    return stable_hash(" ".join(tokenize(pattern)) + "\0" + " ".join(reply.lower().split()))
+
+
+# --- Sources ---
+def _entries_from(data, topic: str) -> List[Entry]:
+    """(patterns, replies) pairs from one decoded JSON document."""
+    if isinstance(data, dict):
+        if "input_patterns" in data or "keywords" in data or "responses" in data or "replies" in data:
+            data = [data]
+        else:
+            data = data.get("entries", [])
+    entries = []
+    for item in data if isinstance(data, list) else []:
+        if not isinstance(item, dict):
+            continue
+        patterns = item.get("input_patterns") or item.get("keywords") or [topic]
+        replies = item.get("replies") or item.get("responses") or []
+        patterns = [p for p in patterns if isinstance(p, str) and p.strip()]
+        replies = [r for r in replies if isinstance(r, str) and r.strip()]
+        if patterns and replies:
+            entries.append((patterns, replies))
+    return entries
+
+
+def source_files(responses_file: str = RESPONSES_FILE, responses_dir: str = RESPONSES_DIR) -> List[str]:
+    files = [responses_file] if os.path.exists(responses_file) else []
+    return files + sorted(glob.glob(os.path.join(responses_dir, "*.json")))
+
+
+def source_signature(paths: Iterable[str]) -> Tuple[Tuple[str, int, int], ...]:
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        signature.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def load_sources(paths: Iterable[str]) -> List[Entry]:
+    entries = []
+    for path in paths:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Skipping response file {path}: {e}")
+            continue
+        entries.extend(_entries_from(data, os.path.splitext(os.path.basename(path))[0].replace("_", " ")))
+    return entries
+
+
+# --- Segments ---
+class IndexSegment:
+    """One immutable TF-IDF index over (patterns, replies) entries."""
+
+    def __init__(self, arrays: Dict[str, np.ndarray], path: Optional[str] = None):
+        for name, _ in SECTIONS:
+            setattr(self, name, arrays[name])
+        self.path = path
+
+    @classmethod
+    def build(cls, entries: Sequence[Entry]) -> "IndexSegment":
+        term_of: Dict[str, int] = {}
+        doc_tokens: List[Dict[str, int]] = []
+        doc_entry: List[int] = []
+        for entry_id, (patterns, _) in enumerate(entries):
+            for pattern in patterns:
+                counts: Dict[str, int] = {}
+                for token in tokenize(pattern):
+                    counts[token] = counts.get(token, 0) + 1
+                if counts:
+                    doc_tokens.append(counts)
+                    doc_entry.append(entry_id)
+                    term_of.update((token, 0) for token in counts if token not in term_of)
+
+        # Terms are numbered in hash order, so term_hash is sorted for searchsorted
+        hashes = {token: stable_hash(token) for token in term_of}
+        for term, token in enumerate(sorted(term_of, key=hashes.__getitem__)):
+            term_of[token] = term
+        term_hash = np.array(sorted(hashes.values()), dtype=np.uint64)
+
+        n_docs, n_terms = len(doc_tokens), len(term_of)
+        df = np.zeros(n_terms, dtype=np.int64)
+        for counts in doc_tokens:
+            for token in counts:
+                df[term_of[token]] += 1
+        idf = (np.log((1 + n_docs) / (1 + df)) + 1).astype(np.float32)
+
+        # Postings grouped by term (CSR), weights normalised per document
+        terms, docs, weights = [], [], []
+        for doc, counts in enumerate(doc_tokens):
+            row = {term_of[token]: (1 + math.log(count)) * float(idf[term_of[token]])
+                   for token, count in counts.items()}
+            norm = math.sqrt(sum(w * w for w in row.values()))
+            for term, w in row.items():
+                terms.append(term)
+                docs.append(doc)
+                weights.append(w / norm)
+        terms = np.asarray(terms, dtype=np.int64)
+        order = np.argsort(terms, kind="stable")
+        postings_ptr = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=n_terms), out=postings_ptr[1:])
+
+        # Replies as one UTF-8 blob with offsets
+        reply_ptr, reply_offsets, blob, pairs = [0], [0], bytearray(), set()
+        for patterns, replies in entries:
+            for reply in replies:
+                blob += reply.encode("utf-8")
+                reply_offsets.append(len(blob))
+                pairs.update(pair_key(pattern, reply) for pattern in patterns)
+            reply_ptr.append(len(reply_offsets) - 1)
+
+        return cls({
+            "term_hash": term_hash,
+            "idf": idf,
+            "postings_ptr": postings_ptr,
+            "postings_doc": np.asarray(docs, dtype=np.int32)[order],
+            "postings_weight": np.asarray(weights, dtype=np.float32)[order],
+            "doc_entry": np.asarray(doc_entry, dtype=np.int32),
+            "reply_ptr": np.asarray(reply_ptr, dtype=np.int64),
+            "reply_offsets": np.asarray(reply_offsets, dtype=np.int64),
+            "text": np.frombuffer(bytes(blob), dtype=np.uint8),
+            "pair_hash": np.array(sorted(pairs), dtype=np.uint64),
+        })
+
+    # --- file format ---
+    def save(self, path: str):
+        """Writes the segment atomically."""
+        table_size = _SEGMENT_HEADER.size + _SECTION.size * len(SECTIONS)
+        offset = -(-table_size // _ALIGN) * _ALIGN
+        table = []
+        for name, dtype in SECTIONS:
+            array = np.ascontiguousarray(getattr(self, name), dtype=dtype)
+            table.append((name, offset, array))
+            offset += -(-array.nbytes // _ALIGN) * _ALIGN
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(_SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, len(SECTIONS), int(time.time() * 1000)))
+            for name, section_offset, array in table:
+                f.write(_SECTION.pack(name.encode("ascii"), section_offset, len(array)))
+            for name, section_offset, array in table:
+                f.write(b"\0" * (section_offset - f.tell()))
+                f.write(array.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        self.path = path
+
+    @classmethod
+    def open(cls, path: str) -> "IndexSegment":
+        """Maps a saved segment; nothing beyond the section table is read up front."""
+        with open(path, "rb") as f:
+            header = f.read(_SEGMENT_HEADER.size)
+            if len(header) < _SEGMENT_HEADER.size:
+                raise ValueError(f"{path} is truncated")
+            magic, version, n_sections, _ = _SEGMENT_HEADER.unpack(header)
+            if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION:
+                raise ValueError(f"{path} is not a version {SEGMENT_VERSION} response index segment")
+            table = [_SECTION.unpack(f.read(_SECTION.size)) for _ in range(n_sections)]
+        locations = {name.rstrip(b"\0").decode("ascii"): (offset, count) for name, offset, count in table}
+        arrays = {}
+        for name, dtype in SECTIONS:
+            if name not in locations:
+                raise ValueError(f"{path} has no {name} section")
+            offset, count = locations[name]
+            # Plain ndarray views of the map: slicing a np.memmap subclass is much slower
+            arrays[name] = (np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,)).view(np.ndarray)
+                            if count else np.empty(0, dtype=dtype))
+        return cls(arrays, path)
+
+    # --- querying ---
+    @property
+    def n_entries(self) -> int:
+        return len(self.reply_ptr) - 1
+
+    def score(self, query_hashes: np.ndarray, query_counts: np.ndarray,
+              min_coverage: float = 0.0) -> Optional[Tuple[int, float]]:
+        """
+        (entry, cosine score) of the best pattern for the hashed query among
+        those with at least `min_coverage` of their weight matched, or None.
+        """
+        if not len(self.term_hash):
+            return None
+        positions = np.searchsorted(self.term_hash, query_hashes)
+        positions[positions == len(self.term_hash)] = 0
+        found = self.term_hash[positions] == query_hashes
+        # Tokens no pattern uses are dropped, so a long message still matches a
+        # short pattern it contains, as a plain substring lookup would
+        if not found.any():
+            return None
+        terms = positions[found]
+        query = (1 + np.log(query_counts[found])) * self.idf[terms]
+        query /= np.sqrt(np.dot(query, query))
+        spans = [(self.postings_ptr[t], self.postings_ptr[t + 1]) for t in terms]
+        if len(spans) == 1:
+            (start, end), = spans
+            docs = self.postings_doc[start:end]
+            doc_weights = self.postings_weight[start:end]
+            weights = doc_weights * query[0]
+        else:
+            docs = np.concatenate([self.postings_doc[a:b] for a, b in spans])
+            doc_weights = np.concatenate([self.postings_weight[a:b] for a, b in spans])
+            weights = doc_weights * np.repeat(query, [b - a for a, b in spans])
+        scores = np.bincount(docs, weights=weights)
+        if min_coverage > 0:
+            # Document vectors are unit length, so this is the share of each pattern matched
+            coverage = np.bincount(docs, weights=doc_weights.astype(np.float64) ** 2)
+            scores[coverage < min_coverage - 1e-6] = 0
+        best = int(scores.argmax())
+        if scores[best] <= 0:
+            return None
+        return int(self.doc_entry[best]), float(scores[best])
+
+    def replies(self, entry: int) -> List[str]:
+        first, last = self.reply_ptr[entry], self.reply_ptr[entry + 1]
+        bounds = self.reply_offsets[first: last + 1]
+        return [bytes(self.text[a:b]).decode("utf-8") for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def hash_query(text: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    counts: Dict[str, int] = {}
+    for token in tokenize(text):
+        counts[token] = counts.get(token, 0) + 1
+    if not counts:
+        return None
+    return (np.array([stable_hash(token) for token in counts], dtype=np.uint64),
+            np.array(list(counts.values()), dtype=np.float32))
+
+
+# --- Compiled index directory ---
+def read_manifest(directory: str = COMPILED_INDEX_DIR) -> Optional[Dict]:
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Ignoring compiled response index in {directory}: {e}")
+        return None
+
+
+def write_manifest(directory: str, manifest: Dict):
+    path = os.path.join(directory, MANIFEST_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def open_compiled(directory: str = COMPILED_INDEX_DIR) -> Tuple[List[IndexSegment], Optional[Dict]]:
+    manifest = read_manifest(directory)
+    if manifest is None:
+        return [], None
+    try:
+        segments = [IndexSegment.open(os.path.join(directory, segment["file"])) for segment in manifest["segments"]]
+    except (OSError, ValueError, KeyError) as e:
+        print(f"⚠️ Ignoring compiled response index in {directory}: {e}")
+        return [], None
+    return segments, manifest
+
+
+# --- Responder ---
+class ResponseIndex:
+    """Best-matching canned reply across the compiled index and the live JSON sources."""
+
+    def __init__(self, responses_file: str = RESPONSES_FILE, responses_dir: str = RESPONSES_DIR,
+                 compiled_dir: Optional[str] = COMPILED_INDEX_DIR, min_score: float = MIN_SCORE,
+                 min_coverage: float = MIN_COVERAGE):
+        self.responses_file = responses_file
+        self.responses_dir = responses_dir
+        self.compiled_dir = compiled_dir
+        self.min_score = min_score
+        self.min_coverage = min_coverage
+        self._signature: Tuple = ()
+        self._checked_at = 0.0
+        self.reload()
+
+    # --- building ---
+    def _current_signature(self) -> Tuple:
+        watched = source_files(self.responses_file, self.responses_dir)
+        if self.compiled_dir:
+            watched.append(os.path.join(self.compiled_dir, MANIFEST_FILE))
+        return source_signature(watched)
+
+    def reload(self):
+        signature = self._current_signature()
+        segments, manifest = open_compiled(self.compiled_dir) if self.compiled_dir else ([], None)
+        sources = source_signature(source_files(self.responses_file, self.responses_dir))
+        # The compiled index already covers the sources it was built from
+        if manifest is None or tuple(map(tuple, manifest.get("sources", []))) != sources:
+            segments.append(IndexSegment.build(load_sources(path for path, _, _ in sources)))
+        # Swap in at once so a concurrent reply() sees old or new, never a mix
+        self._segments = tuple(segments)
+        self._signature = signature
+        self._checked_at = time.monotonic()
+
+    def build(self, entries: Sequence[Entry]):
+        """Replaces the index with one built from `entries` (no files involved)."""
+        self._segments = (IndexSegment.build(entries),)
+
+    def maybe_reload(self) -> bool:
+        now = time.monotonic()
+        if now - self._checked_at < RELOAD_CHECK_SECONDS:
+            return False
+        self._checked_at = now
+        if self._current_signature() == self._signature:
+            return False
+        print("🔄 Response sources changed, reloading the response index")
+        self.reload()
+        return True
+
+    def __len__(self) -> int:
+        return sum(segment.n_entries for segment in self._segments)
+
+    # --- querying ---
+    def best_match(self, text: str) -> Optional[Tuple[IndexSegment, int, float]]:
+        """
+        (segment, entry, cosine score) of the best-matching pattern, or None if
+        no pattern has `min_coverage` of its weight in the query.
+        """
+        query = hash_query(text)
+        if query is None:
+            return None
+        best = None
+        for segment in self._segments:
+            match = segment.score(*query, min_coverage=self.min_coverage)
+            # Ties (within float error) go to the later, newer segment, so an appended reply is served
+            if match is not None and (best is None or match[1] >= best[2] - SCORE_TOLERANCE):
+                best = (segment, match[0], match[1])
+        return best
+
+    def reply(self, text: str, min_score: Optional[float] = None) -> Optional[str]:
+        """A reply for `text`, or None when no pattern scores at least `min_score` (default: the index's)."""
+        self.maybe_reload()
+        match = self.best_match(text)
+        if match is None or match[2] < (self.min_score if min_score is None else min_score):
+            return None
+        segment, entry, _ = match
+        return random.choice(segment.replies(entry))
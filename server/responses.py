@@ -0,0 +1,95 @@
+# child_agent/server/responses.py
+"""
+Helpers for cheap polling endpoints: a fast JSON encoder, ETag /
+If-None-Match handling and gzip/brotli compression above a size threshold.
+Encoded bodies are cached per (ETag, encoding), so repeated polls of an
+unchanged resource neither re-serialize nor re-compress.
+"""
+import gzip
+import json
+from collections import OrderedDict
+from typing import Any, Callable
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from server.metrics import CACHE_HITS
+
+try:
+    import orjson
+except ImportError:  # optional: fall back to the stdlib encoder
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional: brotli is only offered when installed
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed
+COMPRESSION_MIN_BYTES = 1024
+_BODY_CACHE_SIZE = 64
+_body_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+
+def fast_dumps(data: Any) -> bytes:
+    """Serializes `data` to UTF-8 JSON bytes with orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _choose_encoding(request: Request) -> str:
+    accepted = request.headers.get("accept-encoding", "")
+    tokens = {part.split(";")[0].strip().lower() for part in accepted.split(",")}
+    if brotli is not None and "br" in tokens:
+        return "br"
+    if "gzip" in tokens:
+        return "gzip"
+    return "identity"
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag in {tag.strip() for tag in header.split(",")}
+
+
+def conditional_json_response(request: Request, etag: str, build_body: Callable[[], bytes]) -> Response:
+    """
+    Returns 304 when the client already has `etag`; otherwise the JSON body
+    from `build_body()` (only called on a cache miss), compressed with the
+    best encoding the client accepts once it exceeds COMPRESSION_MIN_BYTES.
+    """
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if _etag_matches(request, etag):
+        CACHE_HITS.labels("http_not_modified").inc()
+        return Response(status_code=304, headers=headers)
+
+    key = (etag, _choose_encoding(request))
+    cached = _body_cache.get(key)
+    if cached is not None:
+        CACHE_HITS.labels("http_body").inc()
+        _body_cache.move_to_end(key)
+        content_encoding, body = cached
+    else:
+        content_encoding, body = _encode(build_body(), key[1])
+        _body_cache[key] = (content_encoding, body)
+        if len(_body_cache) > _BODY_CACHE_SIZE:
+            _body_cache.popitem(last=False)
+
+    if content_encoding != "identity":
+        headers["Content-Encoding"] = content_encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _encode(body: bytes, encoding: str):
+    if len(body) < COMPRESSION_MIN_BYTES:
+        return "identity", body
+    if encoding == "br":
+        return "br", brotli.compress(body, quality=5)
+    if encoding == "gzip":
+        return "gzip", gzip.compress(body, compresslevel=5)
+    return "identity", body
@@ -0,0 +1,117 @@
+# child_agent/server/retrieval.py
+"""
+Local relevance retrieval over past conversation turns.
+
+Each turn is embedded as a hashed bag of word unigrams and bigrams (the
+"hashing trick", so no vocabulary has to be kept) with sublinear term
+frequency, L2-normalized and stored as one column of a preallocated float32
+bucket-by-turn matrix. Document frequencies are kept per hash bucket, so IDF
+weighting is applied at query time and adding a turn is O(turn length).
+
+Because the matrix is bucket-major, a query only reads the rows of the few
+buckets its own terms hash to (a short query touches ~20 of them), followed
+by an `argpartition` for the top-k. That stays well under a millisecond for
+thousands of turns.
+"""
+import re
+import zlib
+from typing import List, Tuple
+
+import numpy as np
+
+from server.prompt_builder import estimate_tokens
+
+_TOKEN_RE = re.compile(r"\b\w+\b")
+
+# Weight of the agent's side of a turn relative to what the child said
+AGENT_TEXT_WEIGHT = 0.3
+
+
+def _hashed_terms(text: str, dim: int) -> List[int]:
+    words = _TOKEN_RE.findall(text.lower())
+    terms = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    # crc32 is stable across processes, unlike the built-in str hash
+    return [zlib.crc32(term.encode("utf-8")) % dim for term in terms]
+
+
+class TurnIndex:
+    """Incrementally updated hashed n-gram TF-IDF index over conversation turns."""
+
+    def __init__(self, dim: int = 512, initial_capacity: int = 256):
+        self.dim = dim
+        self.size = 0
+        # Bucket-major: self._matrix[bucket, turn]
+        self._matrix = np.zeros((dim, initial_capacity), dtype=np.float32)
+        self._tokens = np.zeros(initial_capacity, dtype=np.int32)
+        self._df = np.zeros(dim, dtype=np.float32)
+
+    def _vectorize(self, text: str, weight: float = 1.0, out: np.ndarray = None) -> np.ndarray:
+        vec = np.zeros(self.dim, dtype=np.float32) if out is None else out
+        buckets = _hashed_terms(text, self.dim)
+        if buckets:
+            counts = np.bincount(buckets, minlength=self.dim).astype(np.float32)
+            nonzero = counts > 0
+            vec[nonzero] += weight * (1.0 + np.log(counts[nonzero]))
+        return vec
+
+    def _grow(self):
+        capacity = self._matrix.shape[1] * 2
+        matrix = np.zeros((self.dim, capacity), dtype=np.float32)
+        matrix[:, :self.size] = self._matrix[:, :self.size]
+        tokens = np.zeros(capacity, dtype=np.int32)
+        tokens[:self.size] = self._tokens[:self.size]
+        self._matrix, self._tokens = matrix, tokens
+
+    def add(self, user_text: str, agent_text: str = "", tokens: int = None):
+        """Indexes one turn. `tokens` is its prompt cost (estimated if omitted)."""
+        if self.size == self._matrix.shape[1]:
+            self._grow()
+        vec = self._vectorize(user_text, 1.0)
+        if agent_text:
+            self._vectorize(agent_text, AGENT_TEXT_WEIGHT, out=vec)
+        buckets = np.flatnonzero(vec)
+        if buckets.size:
+            values = vec[buckets]
+            self._matrix[buckets, self.size] = values / np.linalg.norm(values)
+            self._df[buckets] += 1.0
+        if tokens is None:
+            tokens = estimate_tokens(user_text) + estimate_tokens(agent_text)
+        self._tokens[self.size] = tokens
+        self.size += 1
+
+    def search(self, query: str, k: int = 3, token_budget: int = None, exclude_last: int = 0,
+               min_score: float = 0.1) -> List[Tuple[int, float]]:
+        """
+        Returns up to `k` (turn_index, score) pairs for the turns most relevant
+        to `query`, ignoring the newest `exclude_last` turns (already in the
+        prompt). Turns are taken best-first while their total token cost fits
+        `token_budget`; the result is ordered chronologically.
+        """
+        n = self.size - exclude_last
+        if n <= 0 or k <= 0:
+            return []
+        q = self._vectorize(query)
+        buckets = np.flatnonzero(q)
+        if not buckets.size:
+            return []
+        weights = q[buckets] * (np.log((1.0 + self.size) / (1.0 + self._df[buckets])) + 1.0)
+        weights /= np.linalg.norm(weights)
+        # Cosine between the IDF-weighted query and each turn's TF vector
+        scores = weights @ self._matrix[buckets, :n]
+
+        top = min(k * 4, n)
+        candidates = np.argpartition(-scores, top - 1)[:top] if top < n else np.arange(n)
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+
+        picked, used = [], 0
+        for i in candidates:
+            score = float(scores[i])
+            if score < min_score or len(picked) == k:
+                break
+            cost = int(self._tokens[i])
+            if token_budget is not None and used + cost > token_budget:
+                continue
+            picked.append((int(i), score))
+            used += cost
+        picked.sort()
+        return picked
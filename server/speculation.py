@@ -0,0 +1,145 @@
+# child_agent/server/speculation.py
+"""
+Speculative reply generation from interim transcripts.
+
+While the child is still talking, streaming STT already reports most of what
+they are saying. Once an interim hypothesis is stable (unchanged across two
+updates, or closed as a final segment), a draft turn is generated from it in
+the background with `generate_agent_turn`, which has no side effects. When the
+final transcript arrives:
+
+  * similar enough to the speculated text -> the draft is committed, so the
+    LLM time already spent is taken off the turn;
+  * otherwise -> the draft is cancelled and the reply is generated normally.
+
+A similar final transcript can still say something the interim didn't ("...
+and i hate myself"), so a draft is also a miss when the final text raises an
+escalation alert the draft's text didn't, or calls for another diagnostic
+prompt (`draft_fits`).
+
+A draft is also discarded if memory changed while it was generated. Outcomes
+and the latency saved are exported as metrics; drafts run under their own
+usage endpoint so wasted speculation shows up in `/usage`.
+"""
+import asyncio
+import difflib
+import os
+import re
+import time
+from typing import Any, Dict, Optional
+
+from server.agent import draft_fits, generate_agent_turn
+from server.json_memory import memory
+from server.metrics import Counter, Histogram
+from server.usage import usage_context, track_turn
+
+SPECULATIONS = Counter("capy_speculations_total", "Speculative reply drafts by outcome.", ["outcome"])
+SPECULATION_SAVED = Histogram("capy_speculation_saved_seconds", "Reply latency saved by committed speculative drafts.")
+
+SIMILARITY_THRESHOLD = 0.85
+MIN_SPECULATION_WORDS = 3
+STABLE_UPDATES = 2
+
+_WORD_RE = re.compile(r"[\w']+")
+
+
+def speculation_enabled() -> bool:
+    return os.getenv("VOICE_SPECULATION", "1") not in ("0", "false", "no")
+
+
+def _words(text: str):
+    return _WORD_RE.findall(text.lower())
+
+
+def transcript_similarity(a: str, b: str) -> float:
+    """Word-level similarity ratio (0..1) between two transcripts."""
+    return difflib.SequenceMatcher(None, _words(a), _words(b), autojunk=False).ratio()
+
+
+class Speculation:
+    """One draft being generated from an interim transcript."""
+
+    __slots__ = ("text", "task", "started_at", "finished_at")
+
+    def __init__(self, text: str, session_id: str):
+        self.text = text
+        self.started_at = time.perf_counter()
+        self.finished_at: Optional[float] = None
+        self.task = asyncio.create_task(self._generate(session_id))
+
+    async def _generate(self, session_id: str) -> Dict[str, Any]:
+        with usage_context("voice_speculative", session_id), track_turn():
+            draft = await generate_agent_turn(self.text)
+        self.finished_at = time.perf_counter()
+        return draft
+
+    def cancel(self, outcome: str):
+        if not self.task.done():
+            self.task.cancel()
+        SPECULATIONS.labels(outcome).inc()
+
+    async def take(self, ended_at: float, final_text: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Waits for the draft and returns it if it is still valid (and fits
+        `final_text`, when given), else None. `ended_at` is when speech ended,
+        i.e. when normal generation would start.
+        """
+        try:
+            draft = await self.task
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️ Speculative draft failed: {e}")
+            SPECULATIONS.labels("failed").inc()
+            return None
+        if draft["memory_version"] != memory.version:
+            SPECULATIONS.labels("stale").inc()
+            return None
+        if final_text is not None and not draft_fits(draft, final_text):
+            SPECULATIONS.labels("miss").inc()
+            return None
+        SPECULATIONS.labels("hit").inc()
+        SPECULATION_SAVED.observe(max(min(self.finished_at, ended_at) - self.started_at, 0.0))
+        return draft
+
+
+class Speculator:
+    """Watches one stream's interim transcripts and keeps at most one draft running."""
+
+    def __init__(self, session_id: str, threshold: float = SIMILARITY_THRESHOLD):
+        self.session_id = session_id
+        self.threshold = threshold
+        self.current: Optional[Speculation] = None
+        self._last_hypothesis = ""
+        self._repeats = 0
+
+    def observe(self, hypothesis: str, is_final: bool = False):
+        """Feeds one interim (or final-segment) hypothesis."""
+        if hypothesis == self._last_hypothesis:
+            self._repeats += 1
+        else:
+            self._last_hypothesis, self._repeats = hypothesis, 1
+        stable = is_final or self._repeats >= STABLE_UPDATES
+        if not stable or len(_words(hypothesis)) < MIN_SPECULATION_WORDS:
+            return
+        if self.current is not None:
+            if transcript_similarity(self.current.text, hypothesis) >= self.threshold:
+                return
+            # The child kept talking or the hypothesis changed: start over
+            self.current.cancel("superseded")
+        self.current = Speculation(hypothesis, self.session_id)
+
+    def claim(self, final_text: str) -> Optional[Speculation]:
+        """Hands over the running draft if it matches `final_text`; cancels it otherwise."""
+        speculation, self.current = self.current, None
+        if speculation is None:
+            return None
+        if transcript_similarity(speculation.text, final_text) < self.threshold:
+            speculation.cancel("miss")
+            return None
+        return speculation
+
+    def cancel(self):
+        if self.current is not None:
+            self.current.cancel("cancelled")
+            self.current = None
@@ -1,21 +1,34 @@
 # child_agent/server/stt.py
 import aiohttp, os
+from server.metrics import STAGE_LATENCY, UPSTREAM_ERRORS
 
-async def transcribe_audio(audio_bytes: bytes) -> str:
-    """Send raw audio bytes to Deepgram API for speech-to-text."""
+async def transcribe_audio(audio_bytes: bytes, content_type: str = None) -> str:
+    """Send audio bytes to Deepgram API for speech-to-text (typed as `content_type` when known)."""
     dg_key = os.getenv("DEEPGRAM_API_KEY")
     if not dg_key:
         return "[Deepgram API key missing]"
     
+    with STAGE_LATENCY.labels("stt").time():
+        try:
+            return await _post_to_deepgram(audio_bytes, dg_key, content_type)
+        except Exception:
+            UPSTREAM_ERRORS.labels("deepgram").inc()
+            raise
+
+
+async def _post_to_deepgram(audio_bytes: bytes, dg_key: str, content_type: str = None) -> str:
     timeout_config = aiohttp.ClientTimeout(total=30)  # 30 seconds timeout
     # header = {
     #     "Authorization": f"Token {dg_key}",
     #     "Content-Type": "audio/webm",
     # }
+    headers = {"Authorization": f"Token {dg_key}"}
+    if content_type:
+        headers["Content-Type"] = content_type
     async with aiohttp.ClientSession(timeout=timeout_config) as session:
         async with session.post(
             "https://api.deepgram.com/v1/listen",
-            headers={"Authorization": f"Token {dg_key}"},
+            headers=headers,
             data=audio_bytes
             # "https://api.deepgram.com/v1/listen?model=general&language=en",
             # headers=headers,
@@ -24,6 +37,7 @@ async def transcribe_audio(audio_bytes: bytes) -> str:
             if resp.status != 200:
                 text = await resp.text()
                 print(f"❌ Deepgram API Error! Status: {resp.status}. Detail: {text[:150]}...")
+                UPSTREAM_ERRORS.labels("deepgram").inc()
                 return "[transcription error]"
             result = await resp.json()
             return result["results"]["channels"][0]["alternatives"][0].get("transcript", "")
@@ -0,0 +1,213 @@
+# child_agent/server/stt_stream.py
+"""
+Streaming speech-to-text.
+
+Audio is forwarded frame by frame over one persistent connection while the
+child is still talking, so transcription keeps pace with speech and the final
+transcript is ready moments after the last frame instead of after a full
+upload. Interim hypotheses are exposed as they arrive.
+
+Backends:
+  * DeepgramTranscriptStream: Deepgram's live `/v1/listen` WebSocket.
+  * LocalTranscriptStream: an offline stand-in for tests and development that
+    treats each frame as UTF-8 text, so clients can "speak" by sending text
+    encoded as binary frames.
+
+Pick one with STT_STREAM_BACKEND ("deepgram" or "local"). The default is
+Deepgram; the local stand-in is only used when asked for explicitly, since it
+would turn real (compressed) audio into garbage transcripts.
+"""
+import asyncio
+import json
+import os
+import time
+from typing import AsyncIterator, List, Optional
+from urllib.parse import urlencode
+
+import aiohttp
+
+from server.metrics import STAGE_LATENCY, UPSTREAM_ERRORS
+
+DEEPGRAM_LIVE_URL = "wss://api.deepgram.com/v1/listen"
+FINALIZE_TIMEOUT_SECONDS = 5.0
+
+
+class TranscriptEvent:
+    __slots__ = ("text", "is_final")
+
+    def __init__(self, text: str, is_final: bool):
+        self.text = text
+        self.is_final = is_final
+
+
+class TranscriptStream:
+    """
+    One streaming transcription session. Call `start()`, `send()` audio frames,
+    read hypotheses from `events()`, then `finish()` for the final transcript.
+    """
+
+    def __init__(self):
+        self._finals: List[str] = []
+        self._events: asyncio.Queue = asyncio.Queue()
+        self._done = asyncio.Event()
+
+    async def start(self):
+        pass
+
+    async def send(self, chunk: bytes):
+        raise NotImplementedError
+
+    async def _flush(self):
+        """Asks the backend to emit its last results and end the stream."""
+        raise NotImplementedError
+
+    async def close(self):
+        """Abandons the stream without waiting for results (e.g. on barge-in)."""
+        self._end()
+
+    async def events(self) -> AsyncIterator[TranscriptEvent]:
+        """Interim and final hypotheses, as the text transcribed so far."""
+        while True:
+            event = await self._events.get()
+            if event is None:
+                return
+            yield event
+
+    async def finish(self, timeout: float = FINALIZE_TIMEOUT_SECONDS) -> str:
+        """Flushes the stream and returns the final transcript."""
+        started = time.perf_counter()
+        try:
+            await self._flush()
+            await asyncio.wait_for(self._done.wait(), timeout)
+        except asyncio.TimeoutError:
+            print("⚠️ Streaming STT did not finalize in time; using the results so far")
+        finally:
+            await self.close()
+            STAGE_LATENCY.labels("stt_finalize").observe(time.perf_counter() - started)
+        return self.transcript
+
+    @property
+    def transcript(self) -> str:
+        return " ".join(self._finals).strip()
+
+    def _emit(self, text: str, is_final: bool):
+        if is_final and text:
+            self._finals.append(text)
+        hypothesis = self.transcript if is_final else " ".join(self._finals + [text]).strip()
+        self._events.put_nowait(TranscriptEvent(hypothesis, is_final))
+
+    def _end(self):
+        if not self._done.is_set():
+            self._done.set()
+            self._events.put_nowait(None)
+
+
+class LocalTranscriptStream(TranscriptStream):
+    """Stand-in backend: frames are UTF-8 text; every frame yields an interim hypothesis."""
+
+    def __init__(self, delay: float = 0.0):
+        super().__init__()
+        self.delay = delay
+        self._text = ""
+
+    async def send(self, chunk: bytes):
+        if self._done.is_set():
+            return
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self._text += chunk.decode("utf-8", errors="ignore")
+        self._emit(" ".join(self._text.split()), is_final=False)
+
+    async def _flush(self):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if not self._done.is_set():
+            self._emit(" ".join(self._text.split()), is_final=True)
+        self._end()
+
+
+class DeepgramTranscriptStream(TranscriptStream):
+    """Deepgram live transcription over a WebSocket, with interim results."""
+
+    def __init__(self, api_key: str, mime_type: Optional[str] = None, sample_rate: Optional[int] = None):
+        super().__init__()
+        self.api_key = api_key
+        self.mime_type = mime_type
+        self.sample_rate = sample_rate
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._ws: Optional[aiohttp.ClientWebSocketResponse] = None
+        self._receiver: Optional[asyncio.Task] = None
+
+    def _url(self) -> str:
+        params = {"interim_results": "true", "punctuate": "true", "smart_format": "true"}
+        if self.mime_type and self.mime_type.startswith("audio/l16"):
+            # Raw PCM has no container header, so Deepgram needs the format spelled out
+            params.update(encoding="linear16", sample_rate=str(self.sample_rate or 16000), channels="1")
+        return f"{DEEPGRAM_LIVE_URL}?{urlencode(params)}"
+
+    async def start(self):
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, connect=10))
+        try:
+            self._ws = await self._session.ws_connect(
+                self._url(), headers={"Authorization": f"Token {self.api_key}"}, heartbeat=5
+            )
+        except Exception:
+            UPSTREAM_ERRORS.labels("deepgram").inc()
+            await self._session.close()
+            raise
+        self._receiver = asyncio.create_task(self._receive())
+
+    async def send(self, chunk: bytes):
+        if self._ws is None or self._ws.closed:
+            return
+        try:
+            await self._ws.send_bytes(chunk)
+        except Exception as e:
+            print(f"❌ Deepgram stream send failed: {e}")
+            UPSTREAM_ERRORS.labels("deepgram").inc()
+            self._end()
+
+    async def _flush(self):
+        if self._ws is not None and not self._ws.closed:
+            await self._ws.send_str(json.dumps({"type": "CloseStream"}))
+
+    async def _receive(self):
+        try:
+            async for message in self._ws:
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                result = json.loads(message.data)
+                if result.get("type") != "Results":
+                    continue
+                alternatives = result.get("channel", {}).get("alternatives") or [{}]
+                self._emit(alternatives[0].get("transcript", ""), bool(result.get("is_final")))
+        except Exception as e:
+            print(f"❌ Deepgram stream error: {e}")
+            UPSTREAM_ERRORS.labels("deepgram").inc()
+        finally:
+            self._end()
+
+    async def close(self):
+        self._end()
+        if self._receiver is not None and not self._receiver.done():
+            self._receiver.cancel()
+        if self._ws is not None:
+            await self._ws.close()
+        if self._session is not None:
+            await self._session.close()
+
+
+async def open_transcript_stream(mime_type: Optional[str] = None, sample_rate: Optional[int] = None) -> TranscriptStream:
+    """Starts a streaming transcription with the configured backend."""
+    dg_key = os.getenv("DEEPGRAM_API_KEY")
+    backend = (os.getenv("STT_STREAM_BACKEND") or "deepgram").strip().lower()
+    if backend == "local":
+        stream = LocalTranscriptStream()
+    elif backend == "deepgram":
+        if not dg_key:
+            raise RuntimeError("Deepgram API key missing")
+        stream = DeepgramTranscriptStream(dg_key, mime_type, sample_rate)
+    else:
+        raise RuntimeError(f"unknown STT_STREAM_BACKEND {backend!r}")
+    await stream.start()
+    return stream
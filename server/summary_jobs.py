@@ -0,0 +1,248 @@
+# child_agent/server/summary_jobs.py
+"""
+Background parent-summary jobs.
+
+`POST /parent_summary` submits a job and returns its ID immediately; the LLM
+work runs in a background task and clients poll (or long-poll) the job, or
+receive a push to an optional callback URL when it finishes. Callbacks only go
+to origins listed in SUMMARY_CALLBACK_ALLOWLIST (comma-separated, e.g.
+"https://dashboard.example.org"); with none configured they are refused. Jobs are keyed by
+the memory version they summarize, so repeated dashboard refreshes reuse the
+running or finished job instead of starting a new LLM call.
+
+A scheduler precomputes a summary after enough new turns or once the
+conversation has gone idle, so parents usually find a ready result. The same
+loop runs other periodic housekeeping registered with `add_maintenance`.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from uuid import uuid4
+
+import aiohttp
+
+from server.metrics import TURN_LATENCY, CACHE_HITS, UPSTREAM_ERRORS
+from server.usage import usage_context
+from server.urls import url_origin
+
+# Scheduler defaults: precompute after this many new turns, or when memory
+# has changed and then stayed idle for this long.
+PRECOMPUTE_AFTER_TURNS = 10
+PRECOMPUTE_IDLE_SECONDS = 120
+SCHEDULER_INTERVAL_SECONDS = 15
+# Upper bound for `wait` on the long-poll endpoints
+MAX_WAIT_SECONDS = 60
+
+
+CALLBACK_ORIGINS = {origin for origin in map(url_origin, os.getenv("SUMMARY_CALLBACK_ALLOWLIST", "").split(","))
+                    if origin}
+
+
+def callback_allowed(url: str) -> bool:
+    """True if `url` is on an allowlisted origin (scheme, host and port must all match)."""
+    return url_origin(url) in CALLBACK_ORIGINS
+
+
+def clamp_wait(wait: float) -> float:
+    return min(max(wait, 0.0), MAX_WAIT_SECONDS)
+
+
+class SummaryJob:
+    """One parent-summary computation for a given memory version."""
+
+    def __init__(self, memory_version: int, turn_count: int, callback_url: Optional[str] = None,
+                 trigger: str = "request"):
+        self.job_id = uuid4().hex
+        self.memory_version = memory_version
+        self.turn_count = turn_count
+        self.callback_url = callback_url
+        self.trigger = trigger
+        self.status = "pending"
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.done = asyncio.Event()
+
+    def to_dict(self, current_version: Optional[int] = None) -> Dict[str, Any]:
+        data = {
+            "job_id": self.job_id,
+            "status": self.status,
+            "trigger": self.trigger,
+            "memory_version": self.memory_version,
+            "turn_count": self.turn_count,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+        }
+        if current_version is not None:
+            data["stale"] = current_version != self.memory_version
+        return data
+
+
+class SummaryJobManager:
+    """Runs parent summaries as deduplicated background jobs."""
+
+    def __init__(self, memory, run_summary: Callable[[], Awaitable[Dict[str, Any]]], max_jobs: int = 100):
+        self.memory = memory
+        self.run_summary = run_summary
+        self.max_jobs = max_jobs
+        self.jobs: "OrderedDict[str, SummaryJob]" = OrderedDict()
+        self._by_version: Dict[int, SummaryJob] = {}
+        self._latest_done: Optional[SummaryJob] = None
+        self._tasks = set()
+        self._scheduler_task: Optional[asyncio.Task] = None
+        # [task, every_seconds, last_run]: blocking housekeeping run from the scheduler
+        self._maintenance: List[list] = []
+
+    # --- jobs ---
+    def submit(self, callback_url: Optional[str] = None, force: bool = False,
+               trigger: str = "request") -> SummaryJob:
+        """Returns the job for the current memory version, starting one if needed."""
+        version = self.memory.version
+        existing = self._by_version.get(version)
+        if existing is not None and not force and existing.status != "failed":
+            CACHE_HITS.labels("summary_job").inc()
+            if callback_url:
+                if existing.done.is_set():
+                    self._spawn(self._notify(existing, callback_url))
+                else:
+                    self._spawn(self._notify_when_done(existing, callback_url))
+            return existing
+
+        job = SummaryJob(version, len(self.memory.context), callback_url, trigger)
+        self.jobs[job.job_id] = job
+        self._by_version[version] = job
+        self._evict()
+        self._spawn(self._run(job))
+        return job
+
+    def get(self, job_id: str) -> Optional[SummaryJob]:
+        return self.jobs.get(job_id)
+
+    def latest(self) -> Optional[SummaryJob]:
+        """The most recently finished successful job, if any."""
+        return self._latest_done
+
+    async def wait(self, job: SummaryJob, timeout: float) -> SummaryJob:
+        """Long-poll helper: waits up to `timeout` seconds for the job to finish."""
+        if timeout > 0 and not job.done.is_set():
+            try:
+                await asyncio.wait_for(job.done.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return job
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _evict(self):
+        while len(self.jobs) > self.max_jobs:
+            _, old = self.jobs.popitem(last=False)
+            if self._by_version.get(old.memory_version) is old:
+                del self._by_version[old.memory_version]
+
+    async def _run(self, job: SummaryJob):
+        job.status = "running"
+        try:
+            with TURN_LATENCY.labels("parent_summary_job").time(), usage_context("parent_summary"):
+                result = await self.run_summary()
+            job.result = result
+            # generate_parent_summary reports failures as an error-shaped summary
+            failed = any(c in ("JSON Validation Error", "API/Parsing Error")
+                         for c in result.get("potential_concerns", []))
+            job.status = "failed" if failed else "done"
+            if failed:
+                job.error = result.get("summary_for_analyst")
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            print(f"⚠️ Parent summary job {job.job_id} failed: {e}")
+        finally:
+            job.finished_at = time.time()
+            job.done.set()
+        if job.status == "done":
+            self._latest_done = job
+        if job.callback_url:
+            await self._notify(job, job.callback_url)
+
+    async def _notify_when_done(self, job: SummaryJob, callback_url: str):
+        await job.done.wait()
+        await self._notify(job, callback_url)
+
+    async def _notify(self, job: SummaryJob, callback_url: str):
+        """Pushes the finished job to `callback_url` (best effort)."""
+        if not callback_allowed(callback_url):
+            print(f"⚠️ Refusing summary callback to non-allowlisted {callback_url}")
+            return
+        try:
+            timeout_config = aiohttp.ClientTimeout(total=10)
+            async with aiohttp.ClientSession(timeout=timeout_config) as session:
+                async with session.post(callback_url, json=job.to_dict()) as resp:
+                    if resp.status >= 400:
+                        print(f"⚠️ Summary callback to {callback_url} returned {resp.status}")
+                        UPSTREAM_ERRORS.labels("summary_callback").inc()
+        except Exception as e:
+            print(f"⚠️ Summary callback to {callback_url} failed: {e}")
+            UPSTREAM_ERRORS.labels("summary_callback").inc()
+
+    # --- scheduler ---
+    def start_scheduler(self, interval: float = SCHEDULER_INTERVAL_SECONDS,
+                        after_turns: int = PRECOMPUTE_AFTER_TURNS,
+                        idle_seconds: float = PRECOMPUTE_IDLE_SECONDS):
+        if self._scheduler_task is None:
+            self._scheduler_task = asyncio.create_task(
+                self._scheduler_loop(interval, after_turns, idle_seconds)
+            )
+
+    def add_maintenance(self, task: Callable[[], Any], every: float):
+        """Runs blocking `task` in a thread from the scheduler loop about every `every` seconds."""
+        self._maintenance.append([task, every, time.monotonic()])
+
+    async def _run_maintenance(self):
+        now = time.monotonic()
+        for entry in self._maintenance:
+            task, every, last_run = entry
+            if now - last_run < every:
+                continue
+            entry[2] = now
+            try:
+                await asyncio.to_thread(task)
+            except Exception as e:
+                print(f"⚠️ Scheduled maintenance {getattr(task, '__name__', task)} failed: {e}")
+
+    async def stop(self):
+        tasks = list(self._tasks)
+        if self._scheduler_task is not None:
+            tasks.append(self._scheduler_task)
+            self._scheduler_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def should_precompute(self, after_turns: int, idle_seconds: float, idle_for: float) -> bool:
+        """True when the newest summary is stale and enough turns or idle time have passed."""
+        if self.memory.version in self._by_version or not self.memory.context:
+            return False
+        summarized_turns = self._latest_done.turn_count if self._latest_done else 0
+        new_turns = len(self.memory.context) - summarized_turns
+        return new_turns >= after_turns or idle_for >= idle_seconds
+
+    async def _scheduler_loop(self, interval: float, after_turns: int, idle_seconds: float):
+        seen_version = self.memory.version
+        changed_at = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            await self._run_maintenance()
+            if self.memory.version != seen_version:
+                seen_version = self.memory.version
+                changed_at = time.monotonic()
+            if self.should_precompute(after_turns, idle_seconds, time.monotonic() - changed_at):
+                print(f"🗓️ Precomputing parent summary for memory version {seen_version}")
+                self.submit(trigger="scheduler")
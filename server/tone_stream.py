@@ -0,0 +1,200 @@
+# child_agent/server/tone_stream.py
+"""
+Streaming tone analysis: an emotion timeline that grows while the child talks.
+
+`StreamingToneAnalyzer.feed()` takes PCM chunks as they arrive. Only the new
+frames are analysed (the few samples that don't fill a frame yet are carried
+over to the next chunk), so each update costs O(chunk). The analyzer keeps a
+rolling window of recent frame features and every `step_seconds` scores that
+window into a `TonePoint` (time, emotion, confidence, volume, pitch); running
+totals give the whole-utterance summary at any moment without keeping the
+audio.
+
+Audio-only tone scoring (`audio_tone_scores`) lives here too, so the FastAPI
+/voice session and the standalone voice uAgent label tone the same way.
+"""
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from server.audio_features import FeatureExtractor, MAX_ONSET_RATE, PCM16_SCALE, summarize_frames, pcm16_to_float32
+
+TONE_WINDOW_SECONDS = 2.0
+TONE_STEP_SECONDS = 0.5
+# Windows with less voiced audio than this are labelled "silence"
+MIN_VOICED_RATIO = 0.1
+
+EMOTIONS = ("sad", "anxious", "angry", "happy", "calm")
+
+
+def audio_tone_scores(features: Dict) -> Dict[str, float]:
+    """Emotion scores from acoustic features alone (volume, pitch variation, pace)."""
+    scores = {emotion: 0.0 for emotion in EMOTIONS}
+    volume = features.get("volume_mean", 0)
+    pitch_variance = features.get("pitch_variance", 0)
+    speech_rate = features.get("speech_rate", 0)
+
+    if volume < 1000:
+        scores["sad"] += 0.3
+    elif volume > 5000:
+        scores["angry"] += 0.3
+
+    if pitch_variance > 50:
+        scores["anxious"] += 0.3
+    elif pitch_variance < 10:
+        scores["sad"] += 0.2
+
+    if speech_rate > 0.7:
+        scores["anxious"] += 0.3
+    elif speech_rate < 0.3:
+        scores["sad"] += 0.2
+
+    # Steady pitch, moderate pace and volume
+    if 1000 <= volume <= 5000 and 10 <= pitch_variance <= 50 and 0.3 <= speech_rate <= 0.7:
+        scores["calm"] += 0.3
+    return scores
+
+
+def classify_tone(features: Dict) -> Tuple[str, float]:
+    """(emotion, confidence) for one stretch of audio."""
+    voiced_ratio = features.get("voiced_ratio", 0.0)
+    if voiced_ratio < MIN_VOICED_RATIO:
+        return "silence", round(1.0 - voiced_ratio, 3)
+    scores = audio_tone_scores(features)
+    emotion = max(scores, key=scores.get)
+    return emotion, round(min(scores[emotion], 1.0), 3)
+
+
+class TonePoint:
+    """One entry of the emotion timeline; `t` is seconds from the start of the stream."""
+
+    __slots__ = ("t", "emotion", "confidence", "volume", "pitch")
+
+    def __init__(self, t: float, emotion: str, confidence: float, volume: float, pitch: float):
+        self.t = t
+        self.emotion = emotion
+        self.confidence = confidence
+        self.volume = volume
+        self.pitch = pitch
+
+    def to_dict(self) -> Dict:
+        return {"t": self.t, "emotion": self.emotion, "confidence": self.confidence,
+                "volume": self.volume, "pitch": self.pitch}
+
+
+class StreamingToneAnalyzer:
+    """
+    Incremental tone analysis of one mono audio stream. Feed int16 PCM bytes,
+    int16 arrays or float32 arrays in [-1, 1); points come back from `feed()`
+    as soon as they are due and accumulate in `timeline`.
+    """
+
+    def __init__(self, sample_rate: int = 16000, window_seconds: float = TONE_WINDOW_SECONDS,
+                 step_seconds: float = TONE_STEP_SECONDS, max_points: Optional[int] = None):
+        self.extractor = FeatureExtractor(sample_rate)
+        self.sample_rate = sample_rate
+        hop = self.extractor.hop_length
+        self.frame_seconds = hop / sample_rate
+        self.window_frames = max(int(window_seconds * sample_rate / hop), 1)
+        self.step_frames = max(int(step_seconds * sample_rate / hop), 1)
+        self.max_points = max_points
+        self.timeline: List[TonePoint] = []
+        # Samples not yet covered by a whole frame, and the rolling feature window (rms, zcr, pitch, voicing)
+        self._tail = np.empty(0, dtype=np.float32)
+        self._window = np.empty((4, 0), dtype=np.float32)
+        self._frames_seen = 0
+        self._samples_seen = 0
+        self._next_point = self.step_frames
+        # Running totals for the whole-stream summary
+        self._sums = np.zeros(4, dtype=np.float64)  # rms, rms^2, zcr, voicing (voiced frames)
+        self._voiced = 0
+        self._pitch_sum = 0.0
+        self._pitch_sq = 0.0
+        self._onsets = 0
+        self._last_voiced = False
+
+    def _to_float32(self, chunk) -> np.ndarray:
+        if isinstance(chunk, (bytes, bytearray, memoryview)):
+            return pcm16_to_float32(bytes(chunk))
+        if chunk.dtype.kind == "i":
+            return chunk.astype(np.float32) / np.float32(PCM16_SCALE)
+        return np.asarray(chunk, dtype=np.float32)
+
+    def feed(self, chunk) -> List[TonePoint]:
+        """Analyses one chunk; returns the timeline points it completed."""
+        samples = self._to_float32(chunk)
+        self._samples_seen += len(samples)
+        signal = np.concatenate((self._tail, samples)) if len(self._tail) else samples
+        n = self.extractor.n_frames(len(signal))
+        if not n:
+            self._tail = signal.copy()
+            return []
+        new = np.empty((4, n), dtype=np.float32)
+        self.extractor.extract_into(signal, new[0], new[1], new[2], new[3])
+        self._tail = signal[n * self.extractor.hop_length:].copy()
+        self._accumulate(new)
+
+        recent = np.concatenate((self._window, new), axis=1)
+        first_new = self._frames_seen - self._window.shape[1]  # stream frame index of recent[:, 0]
+        self._frames_seen += n
+        points = []
+        while self._next_point <= self._frames_seen:
+            end = self._next_point - first_new
+            points.append(self._score(recent[:, max(end - self.window_frames, 0): end], self._next_point))
+            self._next_point += self.step_frames
+        self._window = recent[:, -self.window_frames:].copy()
+
+        self.timeline.extend(points)
+        if self.max_points is not None and len(self.timeline) > self.max_points:
+            del self.timeline[: len(self.timeline) - self.max_points]
+        return points
+
+    def _accumulate(self, frames: np.ndarray):
+        rms, zcr, pitch, voicing = frames
+        voiced = pitch > 0
+        self._sums[0] += float(rms.sum(dtype=np.float64))
+        self._sums[1] += float(np.dot(rms, rms))
+        self._sums[2] += float(zcr.sum(dtype=np.float64))
+        self._sums[3] += float(voicing[voiced].sum(dtype=np.float64))
+        voiced_pitch = pitch[voiced].astype(np.float64)
+        self._voiced += len(voiced_pitch)
+        self._pitch_sum += float(voiced_pitch.sum())
+        self._pitch_sq += float(np.dot(voiced_pitch, voiced_pitch))
+        self._onsets += int(np.count_nonzero(voiced[1:] & ~voiced[:-1])) + int(voiced[0] and not self._last_voiced)
+        self._last_voiced = bool(voiced[-1])
+
+    def _score(self, window: np.ndarray, frame_index: int) -> TonePoint:
+        features = summarize_frames(*window, duration=window.shape[1] * self.frame_seconds)
+        emotion, confidence = classify_tone(features)
+        return TonePoint(round(frame_index * self.frame_seconds, 3), emotion, confidence,
+                         round(features["volume_mean"], 1), round(features["pitch_mean"], 1))
+
+    def summary(self) -> Dict:
+        """Whole-stream features, in the same form as `FrameFeatures.summary()`."""
+        frames = self._frames_seen
+        duration = self._samples_seen / self.sample_rate
+        if not frames:
+            return summarize_frames(*np.empty((4, 0), dtype=np.float32), duration=duration)
+        mean_rms = self._sums[0] / frames
+        pitch_mean = self._pitch_sum / self._voiced if self._voiced else 0.0
+        pitch_var = self._pitch_sq / self._voiced - pitch_mean ** 2 if self._voiced > 1 else 0.0
+        return {
+            "volume_mean": float(mean_rms) * PCM16_SCALE,
+            "volume_std": float(np.sqrt(max(self._sums[1] / frames - mean_rms ** 2, 0.0))) * PCM16_SCALE,
+            "pitch_mean": pitch_mean,
+            "pitch_variance": float(np.sqrt(max(pitch_var, 0.0))),
+            "speech_rate": min(self._onsets / duration / MAX_ONSET_RATE, 1.0) if duration > 0 else 0.0,
+            "clarity": float(self._sums[3]) / self._voiced if self._voiced else 0.5,
+            "zcr_mean": float(self._sums[2]) / frames,
+            "voiced_ratio": self._voiced / frames,
+        }
+
+    def timeline_dicts(self) -> List[Dict]:
+        return [point.to_dict() for point in self.timeline]
+
+
+def analyze_clip(samples, sample_rate: int = 16000) -> Tuple[Dict, List[Dict]]:
+    """(summary, timeline) for a whole clip, e.g. a non-streamed utterance."""
+    analyzer = StreamingToneAnalyzer(sample_rate)
+    analyzer.feed(samples)
+    return analyzer.summary(), analyzer.timeline_dicts()
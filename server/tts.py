@@ -1,5 +1,6 @@
 # child_agent/server/tts.py
 import aiohttp, os
+from server.metrics import STAGE_LATENCY, UPSTREAM_ERRORS
 
 async def synthesize_speech(text: str) -> bytes:
     """Turn text into speech using ElevenLabs API."""
@@ -9,6 +10,11 @@ async def synthesize_speech(text: str) -> bytes:
         print("⚠️ Missing ElevenLabs API key, returning dummy bytes")
         return b""
     
+    with STAGE_LATENCY.labels("tts").time():
+        return await _post_to_elevenlabs(text, xi_key)
+
+
+async def _post_to_elevenlabs(text: str, xi_key: str) -> bytes:
     voice = "Rachel"  # friendly child voice
 
     async with aiohttp.ClientSession() as session:
@@ -24,8 +30,10 @@ async def synthesize_speech(text: str) -> bytes:
                 if resp.status != 200:
                     error_detail = await resp.text()
                     print("❌ ElevenLabs API Error! Status: ", resp.status, ". Detail: ", error_detail)
+                    UPSTREAM_ERRORS.labels("elevenlabs").inc()
                     return b""
                 return await resp.read()
         except Exception as e:
             print(f"🚨 TTS Connection Error: {e}")
+            UPSTREAM_ERRORS.labels("elevenlabs").inc()
             return b""
\ No newline at end of file
@@ -20,6 +20,7 @@ load_dotenv()
 
 #import your core logic
 from server.agent import get_agent_response
+from server.alerts import alert_bus
 from uagents_core.contrib.protocols.chat import ChatMessage, TextContent, ChatAcknowledgement
 
 # --- Configuration ---
@@ -41,6 +42,7 @@ chat_protocol = Protocol(name="Chat", version="1.0")
 @agent.on_event("startup")
 async def on_startup(ctx: Context):
     ctx.logger.info("Child Imitation Agent is starting up...")
+    alert_bus.start()
 
 @chat_protocol.on_message(ChatMessage, replies={ChatMessage, ChatAcknowledgement})
 async def handle_agentverse_chat(ctx: Context, sender: str, msg: ChatMessage):
@@ -0,0 +1,20 @@
+# child_agent/server/urls.py
+"""
+URL helpers shared by the outbound HTTP clients (summary callbacks, blob
+fetches), which only talk to allowlisted origins.
+"""
+from typing import Optional
+from urllib.parse import urlsplit
+
+
+def url_origin(url: str) -> Optional[str]:
+    """`scheme://host:port` of an http(s) URL with the default port filled in, or None."""
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return None
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return None
+    port = port or (443 if parts.scheme == "https" else 80)
+    return f"{parts.scheme}://{parts.hostname.lower()}:{port}"
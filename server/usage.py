@@ -0,0 +1,168 @@
+# child_agent/server/usage.py
+"""
+Token and prompt-size accounting for LLM calls.
+
+Every chat completion records the local prompt-size estimate made before the
+call and the prompt/completion token counts reported by the API. Records are
+aggregated per session, per endpoint and per call type (extraction / reply /
+summary), and the records made while handling one conversation turn are
+collected so the turn can report its own cost.
+
+The endpoint and session a call belongs to are carried in context variables,
+so the agent functions do not need extra parameters to be attributed.
+"""
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+from server.metrics import Counter
+
+LLM_TOKENS = Counter(
+    "capy_llm_tokens_total", "Tokens reported by the LLM API per call type.", ["call_type", "kind"]
+)
+
+_current_endpoint: ContextVar[str] = ContextVar("usage_endpoint", default="internal")
+_current_session: ContextVar[str] = ContextVar("usage_session", default="default")
+_current_turn: ContextVar[Optional["UsageStats"]] = ContextVar("usage_turn", default=None)
+
+
+class UsageStats:
+    """Running totals for one aggregation bucket."""
+
+    __slots__ = ("calls", "estimated_prompt_tokens", "prompt_tokens", "completion_tokens")
+
+    def __init__(self):
+        self.calls = 0
+        self.estimated_prompt_tokens = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def add(self, estimated: int, prompt: int, completion: int):
+        self.calls += 1
+        self.estimated_prompt_tokens += estimated
+        self.prompt_tokens += prompt
+        self.completion_tokens += completion
+
+    def to_dict(self) -> Dict[str, int]:
+        return {
+            "calls": self.calls,
+            "estimated_prompt_tokens": self.estimated_prompt_tokens,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.prompt_tokens + self.completion_tokens,
+        }
+
+
+class UsageTracker:
+    """Aggregates LLM token usage per session, endpoint and call type."""
+
+    def __init__(self, max_sessions: int = 1000, max_recent: int = 200):
+        self.max_sessions = max_sessions
+        self.totals = UsageStats()
+        self.by_session: "OrderedDict[str, UsageStats]" = OrderedDict()
+        self.by_endpoint: Dict[str, UsageStats] = {}
+        self.by_call_type: Dict[str, UsageStats] = {}
+        self.recent = deque(maxlen=max_recent)
+
+    def record(self, call_type: str, estimated_prompt_tokens: int, usage: Any = None) -> Dict[str, Any]:
+        """
+        Records one LLM call. `usage` is the `usage` object of the API response
+        (or None when the provider did not report one).
+        """
+        prompt = int(getattr(usage, "prompt_tokens", 0) or 0)
+        completion = int(getattr(usage, "completion_tokens", 0) or 0)
+        endpoint = _current_endpoint.get()
+        session_id = _current_session.get()
+
+        self.totals.add(estimated_prompt_tokens, prompt, completion)
+        self._bucket(self.by_endpoint, endpoint).add(estimated_prompt_tokens, prompt, completion)
+        self._bucket(self.by_call_type, call_type).add(estimated_prompt_tokens, prompt, completion)
+        self._session_bucket(session_id).add(estimated_prompt_tokens, prompt, completion)
+
+        turn = _current_turn.get()
+        if turn is not None:
+            turn.add(estimated_prompt_tokens, prompt, completion)
+
+        LLM_TOKENS.labels(call_type, "prompt").inc(prompt)
+        LLM_TOKENS.labels(call_type, "completion").inc(completion)
+
+        entry = {
+            "call_type": call_type,
+            "endpoint": endpoint,
+            "session_id": session_id,
+            "estimated_prompt_tokens": estimated_prompt_tokens,
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+        }
+        self.recent.append(entry)
+        return entry
+
+    def _bucket(self, table: Dict[str, UsageStats], key: str) -> UsageStats:
+        stats = table.get(key)
+        if stats is None:
+            stats = table[key] = UsageStats()
+        return stats
+
+    def _session_bucket(self, session_id: str) -> UsageStats:
+        stats = self.by_session.get(session_id)
+        if stats is None:
+            stats = self.by_session[session_id] = UsageStats()
+            # Keep the table bounded: drop the least recently used session.
+            if len(self.by_session) > self.max_sessions:
+                self.by_session.popitem(last=False)
+        else:
+            self.by_session.move_to_end(session_id)
+        return stats
+
+    def summary(self, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """Returns the aggregated usage, optionally restricted to one session."""
+        if session_id is not None:
+            stats = self.by_session.get(session_id, UsageStats())
+            return {
+                "session_id": session_id,
+                "usage": stats.to_dict(),
+                "recent_calls": [r for r in self.recent if r["session_id"] == session_id],
+            }
+        return {
+            "totals": self.totals.to_dict(),
+            "by_endpoint": {k: v.to_dict() for k, v in self.by_endpoint.items()},
+            "by_call_type": {k: v.to_dict() for k, v in self.by_call_type.items()},
+            "by_session": {k: v.to_dict() for k, v in self.by_session.items()},
+            "recent_calls": list(self.recent),
+        }
+
+    def reset(self):
+        self.__init__(self.max_sessions, self.recent.maxlen)
+
+
+def current_session_id() -> str:
+    """The session the current request is attributed to."""
+    return _current_session.get()
+
+
+@contextmanager
+def usage_context(endpoint: str, session_id: str = "default"):
+    """Attributes LLM calls made inside the block to `endpoint` and `session_id`."""
+    endpoint_token = _current_endpoint.set(endpoint)
+    session_token = _current_session.set(session_id)
+    try:
+        yield
+    finally:
+        _current_endpoint.reset(endpoint_token)
+        _current_session.reset(session_token)
+
+
+@contextmanager
+def track_turn():
+    """Collects the usage of every LLM call made inside the block into one UsageStats."""
+    stats = UsageStats()
+    token = _current_turn.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_turn.reset(token)
+
+
+# Initialize the shared tracker
+usage_tracker = UsageTracker()
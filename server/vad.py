@@ -0,0 +1,84 @@
+# child_agent/server/vad.py
+"""
+Server-side voice activity detection before STT.
+
+Each utterance is split into 30 ms frames; a frame counts as speech when its
+energy is clearly above the clip's noise floor, and noise-like frames (high
+zero-crossing rate) must be louder still. Leading and trailing silence is then
+trimmed (keeping a little padding), and clips with no speech at all are
+dropped before any upstream call. Bytes and STT calls saved are exported as
+metrics.
+
+server/audio_ingest.py decodes each clip once (any format) and calls
+`detect_speech` on the samples, then `record_vad_result` with the outcome.
+"""
+import os
+
+import numpy as np
+
+from server.audio_features import frame_signal, frame_energy, frame_zcr
+from server.metrics import Counter
+
+VAD_RESULTS = Counter("capy_vad_results_total", "Utterances checked by server-side VAD, by result.", ["result"])
+VAD_BYTES_SAVED = Counter("capy_vad_bytes_saved_total", "Audio bytes trimmed or dropped before STT.")
+STT_CALLS_SAVED = Counter("capy_stt_calls_saved_total", "STT requests skipped because the audio had no speech.")
+
+FRAME_MS = 30
+PADDING_MS = 200
+MIN_SPEECH_MS = 120
+# Frames quieter than this (dBFS) are never speech
+ENERGY_FLOOR_DB = -50.0
+# Speech must be this far above the noise floor (10th percentile frame energy)
+NOISE_MARGIN_DB = 10.0
+# ...but never required to be within this range of the loudest frames, so a
+# clip that is speech throughout still passes
+PEAK_RANGE_DB = 20.0
+# Above this zero-crossing rate a frame looks like hiss unless it is well above the noise floor
+MAX_SPEECH_ZCR = 0.25
+
+
+def vad_enabled() -> bool:
+    return os.getenv("VOICE_VAD", "1") not in ("0", "false", "no")
+
+
+def speech_frames(samples: np.ndarray, sample_rate: int) -> np.ndarray:
+    """Boolean speech flag per FRAME_MS frame of float32 mono `samples`."""
+    frame_length = max(int(sample_rate * FRAME_MS / 1000), 1)
+    frames = frame_signal(samples, frame_length, frame_length)
+    if not len(frames):
+        return np.zeros(0, dtype=bool)
+    energy_db = 10.0 * np.log10(frame_energy(frames) + 1e-10)
+    zcr = frame_zcr(samples, frame_length, frame_length)
+    noise_floor, peak = np.percentile(energy_db, [10, 95])
+    threshold = max(ENERGY_FLOOR_DB, min(noise_floor + NOISE_MARGIN_DB, peak - PEAK_RANGE_DB))
+    loud = energy_db > threshold
+    # Noise-like frames only count if they also stand well clear of the noise floor
+    return loud & ((zcr < MAX_SPEECH_ZCR) | (energy_db > noise_floor + 2 * NOISE_MARGIN_DB))
+
+
+def detect_speech(samples: np.ndarray, sample_rate: int):
+    """
+    Returns ((start, end), speech_ms): the sample range to keep (None if the
+    clip has no speech) and the total speech duration. Accepts int16 or
+    float32 mono samples.
+    """
+    if samples.dtype == np.int16:
+        samples = samples.astype(np.float32) / np.float32(32768.0)
+    flags = speech_frames(samples, sample_rate)
+    frame_length = max(int(sample_rate * FRAME_MS / 1000), 1)
+    speech_ms = float(flags.sum()) * FRAME_MS
+    if speech_ms < MIN_SPEECH_MS:
+        return None, speech_ms
+    voiced = np.flatnonzero(flags)
+    padding = int(sample_rate * PADDING_MS / 1000)
+    start = max(int(voiced[0]) * frame_length - padding, 0)
+    end = min((int(voiced[-1]) + 1) * frame_length + padding, len(samples))
+    return (start, end), speech_ms
+
+
+def record_vad_result(has_speech: bool, bytes_in: int, bytes_kept: int):
+    """Counts one VAD decision and the audio it kept away from STT."""
+    VAD_RESULTS.labels("speech" if has_speech else "no_speech").inc()
+    if not has_speech:
+        STT_CALLS_SAVED.inc()
+    VAD_BYTES_SAVED.inc(max(bytes_in - bytes_kept, 0))
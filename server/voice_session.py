@@ -0,0 +1,491 @@
+# child_agent/server/voice_session.py
+"""
+Full-duplex handling of one /voice WebSocket connection.
+
+A reader task keeps receiving while a worker task processes turns from a
+per-connection queue, so the socket is never left unread while the agent is
+thinking or speaking. When the child starts speaking again mid-turn
+("barge-in"), the in-flight turn is cancelled (the cancellation propagates
+into the pending Deepgram / ASI:One / ElevenLabs requests), queued speech turns
+are dropped and the client is told to stop any reply audio it is playing.
+
+Utterances can arrive whole (one binary frame) or streamed: between
+`stream_start` and `stream_end` binary frames are forwarded to a streaming STT
+backend as they arrive, interim transcripts are pushed back to the client, and
+the final transcript becomes the turn as soon as speech ends. Stable interim
+transcripts also start a speculative reply draft (see server/speculation.py)
+that is committed if the final transcript matches it.
+
+Tone is tracked as an emotion timeline (see server/tone_stream.py). Raw PCM
+streams (`audio/l16`) are analysed chunk by chunk while the child talks;
+compressed streams and whole utterances are analysed once decoded, alongside
+STT. The connection keeps a bounded timeline across all its turns.
+
+Client -> server frames:
+  * binary: one recorded utterance, or one chunk of a streamed utterance
+  * text: a plain message, or JSON `{"text": "..."}`
+  * JSON control: `{"type": "speech_start"}` (barge-in as soon as the child
+    starts talking, before the utterance itself arrives),
+    `{"type": "stream_start", "mime_type": "audio/webm"}` (or `"audio/l16"` with
+    `"sample_rate"`), `{"type": "stream_end"}`
+
+Server -> client control frames are JSON text:
+  * `{"type": "stop_audio", "turn_id": n}`
+  * `{"type": "transcript", "text": "...", "is_final": false}` (interim hypotheses)
+  * `{"type": "transcript_final", "text": "...", "turn_id": n}`
+  * `{"type": "tone", "points": [{"t", "emotion", "confidence", "volume", "pitch"}, ...]}`
+    (live, while a PCM stream is still arriving; `t` is seconds since the connection opened)
+  * `{"type": "tone_summary", "turn_id": n, "emotion": "...", "confidence": x,
+    "features": {...}, "timeline": [...]}` (once per utterance)
+  * `{"type": "utterance_too_long", "limit_bytes": n}` (the utterance passed
+    VOICE_MAX_UTTERANCE_BYTES: a streamed one is ended there and the audio up to
+    the limit is still answered, later chunks up to `stream_end` are dropped;
+    a whole one is dropped)
+"""
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from server.stt import transcribe_audio
+from server.audio_ingest import prepare_for_stt, ingest_audio
+from server.tone_stream import StreamingToneAnalyzer, analyze_clip, classify_tone
+from server.stt_stream import TranscriptStream, open_transcript_stream
+from server.speculation import Speculation, Speculator, speculation_enabled
+from server.tts import synthesize_speech
+from server.agent import get_agent_response, commit_agent_turn
+from server.metrics import Counter, TURN_LATENCY, FALLBACKS
+from server.usage import usage_context
+
+VOICE_BARGE_INS = Counter("capy_voice_barge_ins_total", "Voice turns cancelled because the child started speaking again.")
+VOICE_TURNS_DROPPED = Counter("capy_voice_turns_dropped_total", "Queued voice turns discarded before processing.", ["reason"])
+VOICE_UTTERANCES_TOO_LONG = Counter("capy_voice_utterances_too_long_total", "Utterances cut off at VOICE_MAX_UTTERANCE_BYTES.")
+
+TURN_QUEUE_SIZE = 8
+TONE_TIMELINE_POINTS = 600
+STT_ERROR_RESULTS = ("[Deepgram API key missing]", "[transcription error]")
+# Caps the audio held for one utterance (about 5 minutes of 16 kHz L16)
+VOICE_MAX_UTTERANCE_BYTES = int(os.getenv("VOICE_MAX_UTTERANCE_BYTES", str(10 * 1024 * 1024)))
+
+
+class VoiceTurn:
+    """One utterance (audio bytes or streamed transcript) or typed message waiting to be answered."""
+
+    __slots__ = ("turn_id", "audio", "text", "is_speech", "received_at", "speculation",
+                 "tone", "tone_audio", "tone_offset")
+
+    def __init__(self, turn_id: int, audio: Optional[bytes] = None, text: str = "",
+                 is_speech: Optional[bool] = None, received_at: Optional[float] = None,
+                 speculation: Optional[Speculation] = None, tone: Optional[StreamingToneAnalyzer] = None,
+                 tone_audio: Optional[bytes] = None, tone_offset: float = 0.0):
+        self.turn_id = turn_id
+        self.audio = audio
+        self.text = text
+        self.speculation = speculation
+        # Tone source for streamed turns: the live analyzer (PCM streams), or the
+        # compressed stream audio to analyse once decoded
+        self.tone = tone
+        self.tone_audio = tone_audio
+        # Connection time (seconds) at which the utterance started
+        self.tone_offset = tone_offset
+        self.is_speech = audio is not None if is_speech is None else is_speech
+        # End of speech for streamed turns, so latency covers only what the child waits for
+        self.received_at = received_at if received_at is not None else time.perf_counter()
+
+
+class VoiceSession:
+    """Reader / worker pair for one WebSocket, with barge-in cancellation."""
+
+    def __init__(self, ws: WebSocket, session_id: str, queue_size: int = TURN_QUEUE_SIZE):
+        self.ws = ws
+        self.session_id = session_id
+        self.turns: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._next_turn_id = 1
+        self._current: Optional[asyncio.Task] = None
+        self._current_turn: Optional[VoiceTurn] = None
+        # Reply audio may still be playing on the client after the turn ended
+        self._audio_sent_for: Optional[int] = None
+        self._send_lock = asyncio.Lock()
+        # Streaming mode: the open STT stream (or a batch buffer if it could not be opened)
+        self._stream: Optional[TranscriptStream] = None
+        self._stream_buffer: Optional[bytearray] = None
+        self._relay: Optional[asyncio.Task] = None
+        self._speculator: Optional[Speculator] = None
+        # Streams past stream_end that are still producing their final transcript
+        self._finalizers = set()
+        # Emotion timeline across the connection; `t` is seconds since it opened
+        self.tone_timeline = deque(maxlen=TONE_TIMELINE_POINTS)
+        self._opened_at = time.perf_counter()
+        self._tone: Optional[StreamingToneAnalyzer] = None
+        self._tone_audio: Optional[bytearray] = None
+        self._tone_offset = 0.0
+        # Bytes received for the current streamed utterance; None when it was cut off
+        self._utterance_bytes: Optional[int] = 0
+
+    async def run(self):
+        """Serves the connection until the client disconnects."""
+        worker = asyncio.create_task(self._worker())
+        try:
+            await self._reader()
+        finally:
+            worker.cancel()
+            if self._current is not None:
+                self._current.cancel()
+            await self._abandon_streams()
+            await asyncio.gather(worker, *([self._current] if self._current else []), return_exceptions=True)
+
+    # --- reader ---
+    async def _reader(self):
+        while True:
+            message = await self.ws.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+
+            if message.get("bytes") is not None:
+                audio_bytes = message["bytes"]
+                if not audio_bytes:
+                    continue
+                if self._utterance_bytes is None:
+                    continue  # the rest of an utterance that was cut off
+                if self._stream is not None or self._stream_buffer is not None:
+                    self._utterance_bytes += len(audio_bytes)
+                    if self._utterance_bytes > VOICE_MAX_UTTERANCE_BYTES:
+                        await self._cut_off_utterance()
+                        continue
+                    await self._feed_tone(audio_bytes)
+                if self._stream is not None:
+                    await self._stream.send(audio_bytes)
+                elif self._stream_buffer is not None:
+                    self._stream_buffer.extend(audio_bytes)
+                elif len(audio_bytes) > VOICE_MAX_UTTERANCE_BYTES:
+                    print(f"⚠️ Dropped a {len(audio_bytes)}-byte utterance (limit {VOICE_MAX_UTTERANCE_BYTES})")
+                    VOICE_UTTERANCES_TOO_LONG.inc()
+                    await self.send_control("utterance_too_long", limit_bytes=VOICE_MAX_UTTERANCE_BYTES)
+                else:
+                    print(f"🎙️ Received {len(audio_bytes)} bytes of audio.")
+                    await self.barge_in()
+                    self._enqueue(VoiceTurn(self._new_turn_id(), audio=audio_bytes))
+            elif message.get("text") is not None:
+                payload = _parse_text_frame(message["text"])
+                message_type = payload.get("type")
+                if message_type == "speech_start":
+                    await self.barge_in()
+                elif message_type == "stream_start":
+                    await self.start_stream(payload.get("mime_type"), payload.get("sample_rate"))
+                elif message_type == "stream_end":
+                    if self._utterance_bytes is None:
+                        self._utterance_bytes = 0
+                    else:
+                        self.end_stream()
+                elif payload.get("text"):
+                    self._enqueue(VoiceTurn(self._new_turn_id(), text=payload["text"]))
+
+    def _elapsed(self) -> float:
+        return time.perf_counter() - self._opened_at
+
+    def _new_turn_id(self) -> int:
+        turn_id = self._next_turn_id
+        self._next_turn_id += 1
+        return turn_id
+
+    def _enqueue(self, turn: VoiceTurn):
+        try:
+            self.turns.put_nowait(turn)
+        except asyncio.QueueFull:
+            VOICE_TURNS_DROPPED.labels("queue_full").inc()
+            print(f"⚠️ Voice turn queue full, dropping turn {turn.turn_id}")
+
+    async def barge_in(self):
+        """
+        Cancels the in-flight turn, queued speech and any streamed utterance
+        still being finalized, and tells the client to stop playing reply
+        audio. Queued typed messages are kept.
+        """
+        for task in list(self._finalizers):
+            task.cancel()
+
+        interrupted = None
+        if self._current is not None and not self._current.done():
+            interrupted = self._current_turn.turn_id
+            self._current.cancel()
+            VOICE_BARGE_INS.inc()
+            print(f"✋ Barge-in: cancelled turn {interrupted}")
+
+        kept = []
+        while not self.turns.empty():
+            turn = self.turns.get_nowait()
+            if turn.is_speech:
+                VOICE_TURNS_DROPPED.labels("barge_in").inc()
+                if turn.speculation is not None:
+                    turn.speculation.cancel("cancelled")
+            else:
+                kept.append(turn)
+        for turn in kept:
+            self.turns.put_nowait(turn)
+
+        stale_audio = self._audio_sent_for
+        self._audio_sent_for = None
+        if interrupted is not None or stale_audio is not None:
+            await self.send_control("stop_audio", turn_id=interrupted or stale_audio)
+
+    # --- streaming STT ---
+    async def start_stream(self, mime_type: Optional[str] = None, sample_rate: Optional[int] = None):
+        await self.barge_in()
+        await self._abandon_streams()
+        self._utterance_bytes = 0
+        self._tone_offset = self._elapsed()
+        if _is_pcm(mime_type):
+            self._tone = StreamingToneAnalyzer(int(sample_rate or 16000))
+        else:
+            # Compressed chunks can't be analysed one by one; keep them for the end
+            self._tone_audio = bytearray()
+        try:
+            self._stream = await open_transcript_stream(mime_type, sample_rate)
+        except Exception as e:
+            # Keep the utterance and transcribe it in one piece at stream_end
+            print(f"⚠️ Streaming STT unavailable ({e}); buffering audio for batch transcription")
+            FALLBACKS.labels("stt_batch").inc()
+            self._stream_buffer = bytearray()
+            # The buffered clip is decoded whole at stream_end, which covers tone too
+            self._tone_audio = None
+            return
+        self._speculator = Speculator(self.session_id) if speculation_enabled() else None
+        self._relay = asyncio.create_task(self._relay_transcripts(self._stream, self._speculator))
+
+    def end_stream(self):
+        ended_at = time.perf_counter()
+        stream, self._stream = self._stream, None
+        relay, self._relay = self._relay, None
+        speculator, self._speculator = self._speculator, None
+        buffer, self._stream_buffer = self._stream_buffer, None
+        tone, self._tone = self._tone, None
+        tone_audio, self._tone_audio = self._tone_audio, None
+        tone_source = {"tone": tone, "tone_offset": self._tone_offset}
+        if stream is not None:
+            if tone_audio:
+                tone_source["tone_audio"] = bytes(tone_audio)
+            task = asyncio.create_task(self._finalize_stream(stream, relay, speculator, ended_at, tone_source))
+            self._finalizers.add(task)
+            task.add_done_callback(self._finalizers.discard)
+        elif buffer:
+            print(f"🎙️ Received {len(buffer)} bytes of streamed audio.")
+            # The whole clip is decoded for STT anyway, which also covers tone
+            self._enqueue(VoiceTurn(self._new_turn_id(), audio=bytes(buffer), received_at=ended_at, **tone_source))
+
+    async def _cut_off_utterance(self):
+        """Ends the streamed utterance at the size limit; the client's stream_end closes it out."""
+        print(f"⚠️ Streamed utterance passed {VOICE_MAX_UTTERANCE_BYTES} bytes; ending it early")
+        VOICE_UTTERANCES_TOO_LONG.inc()
+        self.end_stream()
+        self._utterance_bytes = None
+        await self.send_control("utterance_too_long", limit_bytes=VOICE_MAX_UTTERANCE_BYTES)
+
+    async def _relay_transcripts(self, stream: TranscriptStream, speculator: Optional[Speculator]):
+        async for event in stream.events():
+            if speculator is not None:
+                speculator.observe(event.text, event.is_final)
+            await self.send_control("transcript", text=event.text, is_final=event.is_final)
+
+    async def _finalize_stream(self, stream: TranscriptStream, relay: asyncio.Task,
+                               speculator: Optional[Speculator], ended_at: float, tone_source: Dict[str, Any]):
+        speculation = None
+        try:
+            user_text = await stream.finish()
+            # Let the last hypotheses reach the client before the final transcript
+            await relay
+            print(f"👂 Streamed transcript: {user_text}")
+            if not user_text:
+                return
+            if speculator is not None:
+                speculation = speculator.claim(user_text)
+            turn = VoiceTurn(self._new_turn_id(), text=user_text, is_speech=True, received_at=ended_at,
+                             speculation=speculation, **tone_source)
+            await self.send_control("transcript_final", text=user_text, turn_id=turn.turn_id)
+            self._enqueue(turn)
+            speculation = None  # handed over to the turn
+        finally:
+            relay.cancel()
+            await stream.close()
+            if speculation is not None:
+                speculation.cancel("cancelled")
+            if speculator is not None:
+                speculator.cancel()
+
+    async def _abandon_streams(self):
+        stream, self._stream = self._stream, None
+        relay, self._relay = self._relay, None
+        if self._speculator is not None:
+            self._speculator.cancel()
+            self._speculator = None
+        self._stream_buffer = None
+        self._tone = None
+        self._tone_audio = None
+        for task in [relay, *self._finalizers]:
+            if task is not None:
+                task.cancel()
+        if stream is not None:
+            await stream.close()
+
+    # --- tone ---
+    async def _feed_tone(self, chunk: bytes):
+        if self._tone_audio is not None:
+            self._tone_audio.extend(chunk)
+        if self._tone is None:
+            return
+        points = [point.to_dict() for point in self._tone.feed(chunk)]
+        if points:
+            points = self._record_tone(points, self._tone_offset)
+            await self.send_control("tone", points=points)
+
+    def _record_tone(self, points, offset: float):
+        """Shifts utterance-relative points onto the connection timeline and keeps them."""
+        for point in points:
+            point["t"] = round(point["t"] + offset, 3)
+        self.tone_timeline.extend(points)
+        return points
+
+    async def _analyze_tone(self, turn: VoiceTurn, decoded=None):
+        """(summary, timeline) for a turn whose tone wasn't tracked live; None if it has no usable audio."""
+        if decoded is None and turn.tone_audio:
+            decoded = await ingest_audio(turn.tone_audio)
+        if decoded is None:
+            return None
+        summary, timeline = await asyncio.to_thread(analyze_clip, decoded.samples(), decoded.sample_rate)
+        return summary, self._record_tone(timeline, turn.tone_offset)
+
+    async def _report_tone(self, turn: VoiceTurn, tone_task: Optional[asyncio.Task]):
+        try:
+            await self._send_tone_summary(turn, tone_task)
+        except Exception as e:
+            print(f"⚠️ Tone analysis failed for turn {turn.turn_id}: {e}")
+
+    async def _send_tone_summary(self, turn: VoiceTurn, tone_task: Optional[asyncio.Task]):
+        if turn.tone is not None:
+            summary = turn.tone.summary()
+            timeline = [point.to_dict() for point in turn.tone.timeline]
+            for point in timeline:
+                point["t"] = round(point["t"] + turn.tone_offset, 3)
+        elif tone_task is not None:
+            result = await tone_task
+            if result is None:
+                return
+            summary, timeline = result
+        else:
+            return
+        emotion, confidence = classify_tone(summary)
+        print(f"🎭 Tone for turn {turn.turn_id}: {emotion} ({confidence}) over {len(timeline)} points")
+        await self.send_control("tone_summary", turn_id=turn.turn_id, emotion=emotion, confidence=confidence,
+                                features=summary, timeline=timeline)
+
+    # --- worker ---
+    async def _worker(self):
+        while True:
+            turn = await self.turns.get()
+            self._current_turn = turn
+            self._current = asyncio.create_task(self._process(turn))
+            try:
+                # asyncio.wait does not re-raise the turn's cancellation here
+                await asyncio.wait({self._current})
+            finally:
+                if not self._current.done():
+                    self._current.cancel()
+            if not self._current.cancelled() and self._current.exception() is not None:
+                print(f"⚠️ Voice turn {turn.turn_id} failed: {self._current.exception()}")
+
+    async def _process(self, turn: VoiceTurn):
+        tone_task = report = None
+        try:
+            user_text = turn.text
+            if turn.audio is not None:
+                # Decode once, drop clips without speech, upload the most compact encoding
+                prepared = await prepare_for_stt(turn.audio)
+                if not prepared.has_speech:
+                    print(f"🤫 No speech in {len(turn.audio)} bytes of audio; skipping STT")
+                    return
+                if turn.tone is None and prepared.decoded is not None:
+                    # Tone analysis runs alongside STT
+                    tone_task = asyncio.create_task(self._analyze_tone(turn, prepared.decoded))
+                user_text = await transcribe_audio(prepared.payload, prepared.content_type)
+                print(f"👂 Transcription Result: {user_text}")
+            elif turn.tone is None and turn.tone_audio:
+                tone_task = asyncio.create_task(self._analyze_tone(turn))
+
+            if user_text and user_text not in STT_ERROR_RESULTS:
+                # The tone summary goes out whenever it is ready; the reply doesn't wait for it
+                report = asyncio.create_task(self._report_tone(turn, tone_task))
+            await self._reply(turn, user_text)
+            if report is not None:
+                await report
+        finally:
+            for task in (tone_task, report):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    async def _reply(self, turn: VoiceTurn, user_text: str):
+        if not user_text or user_text in STT_ERROR_RESULTS:
+            if "[transcription error]" in user_text:
+                FALLBACKS.labels("stt_retry_prompt").inc()
+                await self.send_text("I'm sorry, I had trouble hearing you. Can you try again?")
+            return
+
+        print(f"👦 User: {user_text}")
+        draft = None
+        if turn.speculation is not None:
+            try:
+                # None if the final text escalates or diagnoses differently from the interim
+                draft = await turn.speculation.take(turn.received_at, user_text)
+            except asyncio.CancelledError:
+                turn.speculation.cancel("cancelled")
+                raise
+        with usage_context("voice", self.session_id):
+            if draft is not None:
+                print("⚡ Using speculative reply")
+                response_dict = commit_agent_turn(draft, user_text)
+            else:
+                response_dict = await get_agent_response(user_text)
+        reply_text = response_dict["reply"]
+        # (get_agent_response already saved the turn to memory)
+        print(f"🤖 Agent: {reply_text}")
+        print(f"🚨 Analysis: {response_dict.get('analysis', 'N/A')}")
+
+        audio_reply = await synthesize_speech(reply_text)
+        if audio_reply:
+            await self.send_bytes(audio_reply)
+            self._audio_sent_for = turn.turn_id
+        else:
+            # agent TTS (ElevenLabs) not working
+            FALLBACKS.labels("tts_text_reply").inc()
+            await self.send_text("I can't talk right now, but here is my text reply: " + reply_text)
+        TURN_LATENCY.labels("voice").observe(time.perf_counter() - turn.received_at)
+
+    # --- sending (reader and worker share the socket) ---
+    async def send_bytes(self, data: bytes):
+        async with self._send_lock:
+            await self.ws.send_bytes(data)
+
+    async def send_text(self, text: str):
+        async with self._send_lock:
+            await self.ws.send_text(text)
+
+    async def send_control(self, message_type: str, **data: Any):
+        await self.send_text(json.dumps({"type": message_type, **data}))
+
+
+def _is_pcm(mime_type: Optional[str]) -> bool:
+    return bool(mime_type) and mime_type.split(";")[0].strip().lower() in ("audio/l16", "audio/pcm")
+
+
+def _parse_text_frame(text: str) -> Dict[str, Any]:
+    """Text frames are either JSON objects or plain user text."""
+    if text.lstrip().startswith("{"):
+        try:
+            payload = json.loads(text)
+            if isinstance(payload, dict):
+                return payload
+        except json.JSONDecodeError:
+            pass
+    return {"text": text}
@@ -0,0 +1,367 @@
+# session_store.py
+"""
+Durable session storage for the mental health agent (test_learn.py).
+
+`SessionStore` stands in for the `ConversationManager.sessions` dict. Sessions
+are kept on disk in two files under SESSION_STORE_DIR:
+
+  sessions.snap   snapshot: a header, then one zlib-compressed pickle per
+                  session, then an index (session ids, offsets, lengths) and a
+                  fixed-size footer pointing at it
+  sessions.log    deltas since that snapshot: length/CRC-framed records, each a
+                  session id plus its compressed pickle
+
+Opening a store maps the snapshot and reads only the footer and index, then
+scans the log's record headers; no session is decoded until it is first
+asked for. So restart-to-ready time depends on the number of sessions, not on
+how much history they hold (bench_learn.py measures it).
+
+Sessions handed out are resident in memory and treated as dirty: they may be
+mutated in place. `checkpoint()` (run periodically by the agent) appends dirty
+sessions to the log and evicts sessions idle for `idle_seconds`. Once the log
+grows past `log_max_bytes`, `snapshot()` writes a new snapshot, copying the
+bytes of untouched sessions straight across, and the log starts over. A torn
+record at the end of the log (a crash mid-append) is dropped on open.
+
+An agent runs checkpoints in a worker thread: it calls `pickle_dirty()` on the
+event loop, where sessions are mutated, and hands the result to `checkpoint()`
+in the thread. A lock keeps the store's indexes consistent between the two;
+compression, fsync and snapshot writing happen outside it.
+"""
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, Optional, Set, Tuple
+
+SESSION_STORE_DIR = os.getenv("SESSION_STORE_DIR", os.path.join("data", "sessions"))
+SESSION_IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS", "900"))
+SESSION_CHECKPOINT_SECONDS = float(os.getenv("SESSION_CHECKPOINT_SECONDS", "60"))
+SESSION_LOG_MAX_BYTES = int(os.getenv("SESSION_LOG_MAX_BYTES", str(16 * 1024 * 1024)))
+SESSION_MAX_RESIDENT = int(os.getenv("SESSION_MAX_RESIDENT", "10000"))
+
+SNAPSHOT_FILE = "sessions.snap"
+LOG_FILE = "sessions.log"
+SNAPSHOT_MAGIC = b"CAPYSNAP"
+SNAPSHOT_VERSION = 1
+ZLIB_LEVEL = 6
+
+_HEADER = struct.Struct("<8sI")
+# index_offset, ids_length, count, index_crc, created (ms), magic
+_FOOTER = struct.Struct("<QQIIQ8s")
+# payload_length, crc32(id + payload), id_length
+_RECORD = struct.Struct("<IIH")
+
+Location = Tuple[int, int]
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def encode_session(session: Dict) -> bytes:
+    return zlib.compress(pickle.dumps(session, protocol=pickle.HIGHEST_PROTOCOL), ZLIB_LEVEL)
+
+
+def encode_pickled(pickled: bytes) -> bytes:
+    return zlib.compress(pickled, ZLIB_LEVEL)
+
+
+def decode_session(blob) -> Dict:
+    return pickle.loads(zlib.decompress(blob))
+
+
+# --- Snapshot file ---
+def write_snapshot(path: str, blobs: Iterator[Tuple[str, bytes]]) -> Dict[str, Location]:
+    """Writes (session_id, blob) pairs atomically; returns the new index."""
+    ids = []
+    offsets = array("Q")
+    lengths = array("I")
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION))
+        offset = _HEADER.size
+        for session_id, blob in blobs:
+            f.write(blob)
+            ids.append(session_id)
+            offsets.append(offset)
+            lengths.append(len(blob))
+            offset += len(blob)
+        id_block = "\0".join(ids).encode("utf-8")
+        index = id_block + offsets.tobytes() + lengths.tobytes()
+        f.write(index)
+        f.write(_FOOTER.pack(offset, len(id_block), len(ids), zlib.crc32(index),
+                             int(time.time() * 1000), SNAPSHOT_MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return dict(zip(ids, zip(offsets, lengths)))
+
+
+def read_snapshot_index(view: mmap.mmap) -> Dict[str, Location]:
+    if len(view) < _HEADER.size + _FOOTER.size:
+        raise SnapshotError("snapshot is truncated")
+    magic, version = _HEADER.unpack_from(view, 0)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise SnapshotError(f"not a version {SNAPSHOT_VERSION} session snapshot")
+    index_offset, ids_length, count, index_crc, _, magic = _FOOTER.unpack_from(view, len(view) - _FOOTER.size)
+    if magic != SNAPSHOT_MAGIC:
+        raise SnapshotError("snapshot footer is missing")
+    index = view[index_offset: len(view) - _FOOTER.size]  # a copy, so no buffer pins the map
+    if zlib.crc32(index) != index_crc:
+        raise SnapshotError("snapshot index is corrupt")
+    if count == 0:
+        return {}
+    ids = bytes(index[:ids_length]).decode("utf-8").split("\0")
+    offsets = array("Q")
+    offsets.frombytes(index[ids_length: ids_length + 8 * count])
+    lengths = array("I")
+    lengths.frombytes(index[ids_length + 8 * count: ids_length + 12 * count])
+    return dict(zip(ids, zip(offsets, lengths)))
+
+
+# --- Store ---
+class SessionStore:
+    """Dict-like map of session_id -> session dict, persisted as snapshot + delta log."""
+
+    def __init__(self, directory: str = SESSION_STORE_DIR, idle_seconds: float = SESSION_IDLE_SECONDS,
+                 log_max_bytes: int = SESSION_LOG_MAX_BYTES, max_resident: int = SESSION_MAX_RESIDENT,
+                 factory: Optional[Callable[[], Dict]] = None):
+        self.directory = directory
+        self.idle_seconds = idle_seconds
+        self.log_max_bytes = log_max_bytes
+        self.max_resident = max_resident
+        self.factory = factory
+        os.makedirs(directory, exist_ok=True)
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        self.log_path = os.path.join(directory, LOG_FILE)
+
+        self._resident: "OrderedDict[str, Dict]" = OrderedDict()
+        self._last_access: Dict[str, float] = {}
+        self._dirty: Set[str] = set()
+        # Pickled by pickle_dirty() but not yet in the log: kept resident until then
+        self._unflushed: Set[str] = set()
+        self._snapshot_file = None
+        self._snapshot_map: Optional[mmap.mmap] = None
+        self._snapshot_index: Dict[str, Location] = {}
+        self._log_index: Dict[str, Location] = {}
+        # Guards the indexes, resident set and log position against a checkpoint thread
+        self._lock = threading.RLock()
+        self._open_snapshot()
+        self._log = open(self.log_path, "a+b")
+        self._replay_log()
+
+    # --- open / restore ---
+    def _open_snapshot(self):
+        self._close_snapshot()
+        if not os.path.exists(self.snapshot_path) or os.path.getsize(self.snapshot_path) == 0:
+            return
+        self._snapshot_file = open(self.snapshot_path, "rb")
+        self._snapshot_map = mmap.mmap(self._snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._snapshot_index = read_snapshot_index(self._snapshot_map)
+        except SnapshotError as e:
+            print(f"⚠️ Ignoring session snapshot {self.snapshot_path}: {e}")
+            self._close_snapshot()
+
+    def _close_snapshot(self):
+        self._snapshot_index = {}
+        if self._snapshot_map is not None:
+            self._snapshot_map.close()
+            self._snapshot_map = None
+        if self._snapshot_file is not None:
+            self._snapshot_file.close()
+            self._snapshot_file = None
+
+    def _replay_log(self):
+        """Indexes the log's records (later ones win), truncating a torn tail."""
+        self._log.seek(0)
+        offset = 0
+        while True:
+            header = self._log.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                break
+            payload_length, crc, id_length = _RECORD.unpack(header)
+            body = self._log.read(id_length + payload_length)
+            if len(body) < id_length + payload_length or zlib.crc32(body) != crc:
+                break
+            session_id = body[:id_length].decode("utf-8")
+            self._log_index[session_id] = (offset + _RECORD.size + id_length, payload_length)
+            offset += _RECORD.size + id_length + payload_length
+        if offset < os.path.getsize(self.log_path):
+            print(f"⚠️ Dropping torn session log tail at byte {offset}")
+            self._log.truncate(offset)
+        self._log.seek(0, os.SEEK_END)
+
+    # --- mapping interface ---
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._resident or session_id in self._log_index or session_id in self._snapshot_index
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._snapshot_index.keys() | self._log_index.keys() | self._resident.keys())
+
+    def __getitem__(self, session_id: str) -> Dict:
+        session = self.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        return session
+
+    def __setitem__(self, session_id: str, session: Dict):
+        with self._lock:
+            self._resident[session_id] = session
+            self._touch(session_id)
+
+    def get(self, session_id: str, create: bool = False) -> Optional[Dict]:
+        with self._lock:
+            session = self._resident.get(session_id)
+            if session is None:
+                blob = self._stored_blob(session_id)
+                if blob is not None:
+                    session = decode_session(blob)
+                elif create and self.factory is not None:
+                    session = self.factory()
+                else:
+                    return None
+                self._resident[session_id] = session
+            self._touch(session_id)
+            return session
+
+    def _touch(self, session_id: str):
+        self._resident.move_to_end(session_id)
+        self._last_access[session_id] = time.monotonic()
+        self._dirty.add(session_id)
+        if len(self._resident) > self.max_resident:
+            oldest = next(iter(self._resident))
+            if oldest not in self._unflushed:
+                self._evict(oldest)
+
+    def _stored_blob(self, session_id: str):
+        location = self._log_index.get(session_id)
+        if location is not None:
+            offset, length = location
+            return os.pread(self._log.fileno(), length, offset)
+        location = self._snapshot_index.get(session_id)
+        if location is not None:
+            offset, length = location
+            return self._snapshot_map[offset: offset + length]
+        return None
+
+    # --- persistence ---
+    def _append(self, session_id: str, blob: bytes):
+        key = session_id.encode("utf-8")
+        offset = self._log.tell()
+        self._log.write(_RECORD.pack(len(blob), zlib.crc32(key + blob), len(key)) + key + blob)
+        self._log_index[session_id] = (offset + _RECORD.size + len(key), len(blob))
+
+    def _evict(self, session_id: str):
+        session = self._resident.pop(session_id)
+        self._last_access.pop(session_id, None)
+        if session_id in self._dirty:
+            self._dirty.discard(session_id)
+            self._append(session_id, encode_session(session))
+            self._log.flush()
+
+    def pickle_dirty(self) -> Dict[str, bytes]:
+        """
+        Pickles the dirty resident sessions and marks them clean. Call it where
+        sessions are mutated; the result can be flushed from another thread.
+        """
+        with self._lock:
+            pickled = {session_id: pickle.dumps(self._resident[session_id], protocol=pickle.HIGHEST_PROTOCOL)
+                       for session_id in self._dirty}
+            self._unflushed.update(self._dirty)
+            self._dirty.clear()
+        return pickled
+
+    def flush(self, pickled: Optional[Dict[str, bytes]] = None):
+        """Appends dirty sessions (or the output of `pickle_dirty`) to the log and syncs it."""
+        if pickled is None:
+            pickled = self.pickle_dirty()
+        try:
+            blobs = [(session_id, encode_pickled(raw)) for session_id, raw in pickled.items()]
+            with self._lock:
+                for session_id, blob in blobs:
+                    self._append(session_id, blob)
+                self._log.flush()
+        except Exception:
+            with self._lock:
+                self._dirty.update(pickled)
+            raise
+        finally:
+            with self._lock:
+                self._unflushed.difference_update(pickled)
+        os.fsync(self._log.fileno())
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            idle = [session_id for session_id in self._resident
+                    if now - self._last_access.get(session_id, now) > self.idle_seconds]
+            for session_id in idle:
+                self._evict(session_id)
+        return len(idle)
+
+    def checkpoint(self, pickled: Optional[Dict[str, bytes]] = None) -> Dict[str, int]:
+        """Periodic maintenance: persist dirty sessions, evict idle ones, compact a long log."""
+        if pickled is None:
+            pickled = self.pickle_dirty()
+        self.flush(pickled)
+        evicted = self.evict_idle()
+        compacted = 0
+        with self._lock:
+            log_size = self._log.tell()
+        if log_size > self.log_max_bytes:
+            compacted = self.snapshot(flush=False)
+        return {"written": len(pickled), "evicted": evicted, "snapshot": compacted}
+
+    def snapshot(self, flush: bool = True) -> int:
+        """
+        Writes a new snapshot of every stored session and empties the log.
+        Returns the session count. With `flush=False` (from a checkpoint that
+        just flushed) sessions dirtied since stay dirty for the next checkpoint.
+        """
+        if flush:
+            self.flush()
+        with self._lock:
+            ids = list(self._snapshot_index.keys() | self._log_index.keys())
+            log_start = self._log.tell()
+
+        def blobs():
+            for session_id in ids:
+                with self._lock:
+                    blob = self._stored_blob(session_id)
+                    blob = bytes(blob) if blob is not None else None
+                if blob is not None:
+                    yield session_id, blob
+
+        # Records appended while the snapshot is written are carried over to the new log
+        index = write_snapshot(self.snapshot_path, blobs())
+        with self._lock:
+            log_end = self._log.tell()
+            tail = os.pread(self._log.fileno(), log_end - log_start, log_start) if log_end > log_start else b""
+            self._open_snapshot()
+            self._log.truncate(0)
+            self._log.seek(0)
+            self._log.write(tail)
+            self._log.flush()
+            self._log_index = {session_id: (offset - log_start, length)
+                               for session_id, (offset, length) in self._log_index.items() if offset >= log_start}
+        os.fsync(self._log.fileno())
+        return len(index)
+
+    def close(self, snapshot: bool = True):
+        """Persists everything (as a fresh snapshot, or just to the log) and releases the files."""
+        if snapshot:
+            self.snapshot()
+        else:
+            self.flush()
+        with self._lock:
+            self._log.close()
+            self._close_snapshot()
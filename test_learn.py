@@ -7,6 +7,9 @@ import re
 from datetime import datetime, timedelta
 import asyncio
 
+from escalation_rules import EscalationEngine
+from session_store import SessionStore, SESSION_CHECKPOINT_SECONDS
+
 # Data Models
 class ChildMessage(Model):
     message: str
@@ -78,7 +81,7 @@ class MentalHealthKnowledgeBase:
         
         # Escalation triggers
         self.escalation_triggers = [
-            {"name": "chronic_concern", "criteria": "withdrawn OR irritable AND duration > 2 weeks", "action": "Recommend professional consultation"},
+            {"name": "chronic_concern", "criteria": "withdrawn OR irritable AND duration > 2 weeks", "action": "Recommend professional consultation", "level": "high"},
             {"name": "acute_crisis", "criteria": "suicide OR self-harm", "action": "IMMEDIATE safety protocol"},
             {"name": "academic_decline", "criteria": "school difficulties persist", "action": "Consult school counselor"}
         ]
@@ -93,19 +96,36 @@ class MentalHealthKnowledgeBase:
 
 class ConversationManager:
     def __init__(self):
-        self.sessions = {}
         self.knowledge_base = MentalHealthKnowledgeBase()
+        # Criteria are compiled once; a bad rule fails here rather than mid-conversation
+        self.escalation = EscalationEngine(
+            self.knowledge_base.symptom_keywords,
+            self.knowledge_base.escalation_triggers
+        )
+        # Persisted as snapshot + delta log; opened on agent startup (open_sessions)
+        self.sessions: Optional[SessionStore] = None
+
+    def open_sessions(self):
+        if self.sessions is None:
+            self.sessions = SessionStore(factory=self._new_session)
+    
+    def _new_session(self) -> Dict:
+        return {
+            'history': [],
+            'start_time': datetime.now(),
+            'topics_discussed': set(),
+            'concerns_detected': [],
+            'risk_level': 'low',
+            'escalation': self.escalation.new_state()
+        }
     
     def get_session(self, session_id: str):
-        if session_id not in self.sessions:
-            self.sessions[session_id] = {
-                'history': [],
-                'start_time': datetime.now(),
-                'topics_discussed': set(),
-                'concerns_detected': [],
-                'risk_level': 'low'
-            }
-        return self.sessions[session_id]
+        return self.sessions.get(session_id, create=True)
+    
+    def record_concerns(self, session: Dict, message: str, concerns: List[str]):
+        """Feed a message into the session's escalation counters and refresh its risk level"""
+        state = self.escalation.observe(session['escalation'], message.lower(), concerns)
+        session['risk_level'] = state.risk_level
     
     def analyze_message(self, message: str, age: Optional[int] = None) -> Tuple[str, List[str], bool]:
         """Analyze message and generate appropriate response"""
@@ -220,6 +240,22 @@ conversation_manager = ConversationManager()
 async def startup(ctx: Context):
     ctx.logger.info(f"Mental Health Agent started: {mental_health_agent.name}")
     ctx.logger.info(f"Agent address: {mental_health_agent.address}")
+    await asyncio.to_thread(conversation_manager.open_sessions)
+
+@mental_health_agent.on_interval(period=SESSION_CHECKPOINT_SECONDS)
+async def checkpoint_sessions(ctx: Context):
+    sessions = conversation_manager.sessions
+    if sessions is None:
+        return
+    # Pickle on the loop, where handlers mutate sessions; compress, fsync and snapshot in a thread
+    stats = await asyncio.to_thread(sessions.checkpoint, sessions.pickle_dirty())
+    if stats['evicted'] or stats['snapshot']:
+        ctx.logger.info(f"Sessions checkpointed: {stats}")
+
+@mental_health_agent.on_event("shutdown")
+async def shutdown(ctx: Context):
+    if conversation_manager.sessions is not None:
+        await asyncio.to_thread(conversation_manager.sessions.close)
 
 @mental_health_agent.on_message(model=ChildMessage)
 async def handle_child_message(ctx: Context, sender: str, msg: ChildMessage):
@@ -241,6 +277,7 @@ async def handle_child_message(ctx: Context, sender: str, msg: ChildMessage):
         'timestamp': datetime.now().isoformat()
     })
     session['concerns_detected'].extend(concerns)
+    conversation_manager.record_concerns(session, msg.message, concerns)
     
     # Send response
     await ctx.send(sender, AgentResponse(
@@ -257,24 +294,8 @@ async def handle_analysis_query(ctx: Context, sender: str, query: ConversationAn
     if query.session_id in conversation_manager.sessions:
         session = conversation_manager.sessions[query.session_id]
         
-        # Determine risk level
-        risk_level = "low"
-        if any('critical' in concern for concern in session['concerns_detected']):
-            risk_level = "critical"
-        elif session['concerns_detected']:
-            risk_level = "moderate"
-        
-        recommendations = []
-        if risk_level == "critical":
-            recommendations = ["IMMEDIATE: Contact emergency services or crisis helpline"]
-        elif risk_level == "moderate":
-            recommendations = [
-                "Consult with school counselor or pediatrician",
-                "Monitor changes in behavior and mood",
-                "Maintain open communication with child"
-            ]
-        else:
-            recommendations = ["Continue supportive conversations", "Monitor overall well-being"]
+        # Risk level and recommendations are kept up to date as messages arrive
+        risk_level, recommendations = conversation_manager.escalation.assess(session['escalation'])
         
         await ctx.send(sender, ConversationAnalysis(
             session_id=query.session_id,
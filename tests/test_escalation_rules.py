@@ -0,0 +1,104 @@
+# tests/test_escalation_rules.py
+import pytest
+
+from escalation_rules import (EPISODE_GAP_DAYS, PERSIST_MIN_DAYS, PERSIST_WINDOW_DAYS, SECONDS_PER_DAY,
+                              EscalationEngine, RuleSyntaxError)
+
+# The knowledge base's triggers (test_learn.py)
+TRIGGERS = [
+    {"name": "chronic_concern", "criteria": "withdrawn OR irritable AND duration > 2 weeks",
+     "action": "Recommend professional consultation", "level": "high"},
+    {"name": "acute_crisis", "criteria": "suicide OR self-harm", "action": "IMMEDIATE safety protocol"},
+    {"name": "academic_decline", "criteria": "school difficulties persist", "action": "Consult school counselor"},
+]
+START = 20000 * SECONDS_PER_DAY
+
+
+def at(day):
+    return START + day * SECONDS_PER_DAY + 3600
+
+
+@pytest.fixture
+def engine():
+    return EscalationEngine({}, TRIGGERS)
+
+
+def say(engine, state, day, message):
+    return engine.observe(state, message, [], now=at(day)).fired
+
+
+def test_chronic_concern_needs_more_than_two_weeks_in_one_episode(engine):
+    state = engine.new_state()
+    for day in (0, 7, 14):
+        assert "chronic_concern" not in say(engine, state, day, "i feel irritable")
+    # Each signal keeps its own episode
+    assert "chronic_concern" not in say(engine, state, 15, "i just want to stay in my room")
+    assert "chronic_concern" in say(engine, state, 15, "so irritable today")
+    assert engine.assess(state, now=at(15))[0] == "high"
+    assert any("professional consultation" in line for line in state.recommendations)
+
+
+def test_chronic_concern_gap_starts_a_new_episode(engine):
+    state = engine.new_state()
+    say(engine, state, 0, "i am so irritable")
+    # More than EPISODE_GAP_DAYS without a mention: the 16 days are not one episode
+    say(engine, state, EPISODE_GAP_DAYS + 1, "i am so irritable")
+    assert "chronic_concern" not in say(engine, state, 16, "i am so irritable")
+
+
+def test_chronic_concern_lapses_after_episode_gap(engine):
+    state = engine.new_state()
+    for day in (0, 5, 10, 15):
+        say(engine, state, day, "withdrawn")
+    assert engine.assess(state, now=at(15 + EPISODE_GAP_DAYS))[0] == "high"
+    assert engine.assess(state, now=at(15 + EPISODE_GAP_DAYS + 1))[0] == "low"
+    assert state.fired == ()
+
+
+def test_academic_decline_needs_distinct_days(engine):
+    state = engine.new_state()
+    for _ in range(PERSIST_MIN_DAYS + 2):
+        assert "academic_decline" not in say(engine, state, 0, "so much homework")
+    for day in range(1, PERSIST_MIN_DAYS - 1):
+        assert "academic_decline" not in say(engine, state, day, "i got bad grades")
+    assert "academic_decline" in say(engine, state, PERSIST_MIN_DAYS - 1, "i have detention again")
+    # Days drop out of the window as it moves on
+    assert engine.assess(state, now=at(PERSIST_WINDOW_DAYS + 1))[0] == "low"
+
+
+def test_acute_crisis_is_critical(engine):
+    state = engine.new_state()
+    assert say(engine, state, 0, "sometimes i want to die") == ("acute_crisis",)
+    level, recommendations = engine.assess(state, now=at(0))
+    assert level == "critical"
+    assert recommendations[0].startswith("IMMEDIATE safety protocol")
+
+
+def test_or_binds_tighter_than_and():
+    engine = EscalationEngine({}, [{"name": "both", "criteria": "withdrawn OR irritable AND suicide"}])
+    state = engine.new_state()
+    # (withdrawn OR irritable) AND suicide, not withdrawn OR (irritable AND suicide)
+    assert say(engine, state, 0, "withdrawn") == ()
+    assert say(engine, state, 0, "i want to die") == ("both",)
+
+    grouped = EscalationEngine({}, [{"name": "either", "criteria": "withdrawn OR (irritable AND suicide)"}])
+    assert say(grouped, grouped.new_state(), 0, "withdrawn") == ("either",)
+
+
+@pytest.mark.parametrize("criteria", [
+    "duration > 2 weeks",
+    "withdrawn OR duration > 2 weeks",
+    "withdrawn AND duration < 2 weeks",
+    "withdrawn AND duration > 2 fortnights",
+    "(withdrawn OR irritable",
+    "withdrawn AND",
+    "unicorns OR withdrawn",
+])
+def test_bad_criteria_fail_at_construction(criteria):
+    with pytest.raises(RuleSyntaxError):
+        EscalationEngine({}, [{"name": "bad", "criteria": criteria}])
+
+
+def test_unknown_level_fails_at_construction():
+    with pytest.raises(RuleSyntaxError):
+        EscalationEngine({}, [{"name": "bad", "criteria": "withdrawn", "level": "urgent"}])
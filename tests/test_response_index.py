@@ -0,0 +1,41 @@
+# tests/test_response_index.py
+import json
+
+import pytest
+
+from server.response_index import ResponseIndex
+
+RESPONSES = [
+    {"input_patterns": ["I feel sad", "I am sad", "feeling down"], "replies": ["Why do you feel sad?"]},
+    {"input_patterns": ["I am happy", "I feel great"], "replies": ["Yay! What made you happy?"]},
+    {"input_patterns": ["I am scared", "I am worried"], "replies": ["What is worrying you?"]},
+    {"input_patterns": ["hello", "hi"], "replies": ["Hi there!"]},
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+    responses_file = tmp_path / "responses.json"
+    responses_file.write_text(json.dumps(RESPONSES), encoding="utf-8")
+    return ResponseIndex(str(responses_file), str(tmp_path / "responses"), compiled_dir=None)
+
+
+@pytest.mark.parametrize("text", [
+    "i went to the store today",
+    "I want to kill myself",
+    "I am",
+    "the",
+])
+def test_stopword_only_overlap_does_not_match(index, text):
+    assert index.best_match(text) is None
+    assert index.reply(text) is None
+
+
+@pytest.mark.parametrize("text, reply", [
+    ("I feel sad", "Why do you feel sad?"),
+    ("i feel really sad today because my dog died", "Why do you feel sad?"),
+    ("I am scared of the dark", "What is worrying you?"),
+    ("hello", "Hi there!"),
+])
+def test_message_containing_a_pattern_matches(index, text, reply):
+    assert index.reply(text) == reply
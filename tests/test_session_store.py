@@ -0,0 +1,87 @@
+# tests/test_session_store.py
+import os
+
+import session_store
+from session_store import LOG_FILE, SessionStore
+
+
+def new_session():
+    return {"history": [], "risk_level": "low"}
+
+
+def open_store(directory, **kwargs):
+    return SessionStore(str(directory), factory=new_session, **kwargs)
+
+
+def test_sessions_survive_checkpoint_and_reopen(tmp_path):
+    store = open_store(tmp_path)
+    store.get("alice", create=True)["history"].append("i feel sad")
+    store["bob"] = {"history": ["hello"], "risk_level": "moderate"}
+    result = store.checkpoint()
+    assert result["written"] == 2
+    store.close(snapshot=False)
+
+    reopened = open_store(tmp_path)
+    assert len(reopened) == 2
+    assert reopened.get("alice")["history"] == ["i feel sad"]
+    assert reopened.get("bob") == {"history": ["hello"], "risk_level": "moderate"}
+    assert reopened.get("carol") is None
+
+    # And again through a snapshot instead of the log
+    reopened.get("alice")["history"].append("school was hard")
+    reopened.close()
+    assert os.path.getsize(tmp_path / LOG_FILE) == 0
+    assert open_store(tmp_path).get("alice")["history"] == ["i feel sad", "school was hard"]
+
+
+def test_torn_last_log_record_is_dropped_on_reopen(tmp_path):
+    store = open_store(tmp_path)
+    store["kept"] = {"history": ["first"]}
+    store.flush()
+    intact = os.path.getsize(tmp_path / LOG_FILE)
+    store["torn"] = {"history": ["second"]}
+    store.flush()
+    store.close(snapshot=False)
+    # A crash in the middle of the second append
+    with open(tmp_path / LOG_FILE, "r+b") as f:
+        f.truncate(os.path.getsize(tmp_path / LOG_FILE) - 3)
+
+    reopened = open_store(tmp_path)
+    assert reopened.get("kept") == {"history": ["first"]}
+    assert "torn" not in reopened
+    assert os.path.getsize(tmp_path / LOG_FILE) == intact
+
+    # New records land after the good ones, not after the torn bytes
+    reopened["later"] = {"history": ["third"]}
+    reopened.close(snapshot=False)
+    again = open_store(tmp_path)
+    assert again.get("kept") == {"history": ["first"]}
+    assert again.get("later") == {"history": ["third"]}
+
+
+def test_snapshot_keeps_records_appended_while_it_is_written(tmp_path, monkeypatch):
+    store = open_store(tmp_path)
+    store["old"] = {"history": ["v1"]}
+    store["other"] = {"history": ["untouched"]}
+    store.flush()
+
+    write_snapshot = session_store.write_snapshot
+
+    def write_while_appending(path, blobs):
+        # The agent keeps checkpointing while the snapshot is being written
+        store.get("old")["history"].append("v2")
+        store["new"] = {"history": ["during snapshot"]}
+        store.flush()
+        return write_snapshot(path, blobs)
+
+    monkeypatch.setattr(session_store, "write_snapshot", write_while_appending)
+    assert store.snapshot(flush=False) == 2
+    monkeypatch.undo()
+    assert os.path.getsize(tmp_path / LOG_FILE) > 0
+    assert store.get("new") == {"history": ["during snapshot"]}
+    store.close(snapshot=False)
+
+    reopened = open_store(tmp_path)
+    assert reopened.get("old") == {"history": ["v1", "v2"]}
+    assert reopened.get("other") == {"history": ["untouched"]}
+    assert reopened.get("new") == {"history": ["during snapshot"]}
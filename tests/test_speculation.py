@@ -0,0 +1,41 @@
+# tests/test_speculation.py
+import asyncio
+
+from server import speculation
+from server.agent import analyze_for_escalation
+from server.json_memory import memory
+from server.speculation import SIMILARITY_THRESHOLD, Speculation, transcript_similarity
+
+INTERIM = ("so today at school we had art class and then we went outside to the "
+           "playground and played tag with the other kids until lunch time was over")
+FINAL = INTERIM + " i hate myself"
+
+
+def _take(monkeypatch, interim: str, final: str):
+    async def fake_generate_agent_turn(user_input):
+        return {
+            "user_input": user_input,
+            "reply": "That sounds like a fun day!",
+            "analysis": analyze_for_escalation(user_input),
+            "new_facts": [],
+            "memory_version": memory.version,
+        }
+
+    monkeypatch.setattr(speculation, "generate_agent_turn", fake_generate_agent_turn)
+
+    async def run():
+        return await Speculation(interim, "test").take(0.0, final)
+
+    return asyncio.run(run())
+
+
+def test_escalating_final_transcript_discards_similar_draft(monkeypatch):
+    assert transcript_similarity(INTERIM, FINAL) >= SIMILARITY_THRESHOLD
+    assert not analyze_for_escalation(INTERIM)["alerts"]
+    assert analyze_for_escalation(FINAL)["alerts"]
+    assert _take(monkeypatch, INTERIM, FINAL) is None
+
+
+def test_matching_final_transcript_keeps_draft(monkeypatch):
+    draft = _take(monkeypatch, INTERIM, INTERIM + " today")
+    assert draft is not None and draft["user_input"] == INTERIM
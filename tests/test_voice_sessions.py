@@ -0,0 +1,73 @@
+# tests/test_voice_sessions.py
+import time
+import tracemalloc
+
+from voice_sessions import VoiceSessionStore
+
+TONE_POINTS = [{"t": i * 0.5, "emotion": "calm", "confidence": 0.3} for i in range(8)]
+TEXT = "i had a really long day at school and my friends did not want to play with me"
+
+# About 2 KiB per resident session with the turn above; generous headroom
+MAX_SESSIONS = 1000
+MEMORY_BOUND = 4 * 1024 * 1024
+
+
+def test_memory_stays_bounded_across_10k_sessions():
+    store = VoiceSessionStore(max_sessions=MAX_SESSIONS)
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        for i in range(10_000):
+            store.record_turn(f"session-{i}", TEXT, "sad", 0.6, ["depression"], TONE_POINTS)
+            if i + 1 == MAX_SESSIONS:
+                when_full, _ = tracemalloc.get_traced_memory()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert len(store) == MAX_SESSIONS
+    assert peak - baseline < MEMORY_BOUND
+    assert retained - baseline < MEMORY_BOUND
+    # Once the store is full, further sessions replace old ones instead of adding memory
+    assert retained - baseline <= (when_full - baseline) * 1.15
+
+
+def test_sessions_expire_after_ttl():
+    store = VoiceSessionStore(ttl_seconds=60)
+    store.record_turn("old", TEXT, "sad", 0.6, [])
+    assert store.sweep(now=time.time() + 30) == (0, 0)
+    assert "old" in store
+
+    assert store.sweep(now=time.time() + 120) == (1, 0)
+    assert "old" not in store
+    assert store.get("old", create=False) is None
+
+
+def test_spilled_sessions_reload_with_their_history(tmp_path):
+    store = VoiceSessionStore(max_sessions=2, spill_dir=str(tmp_path), idle_seconds=600)
+    store.record_turn("first", "i am worried about my test", "anxious", 0.7, ["anxiety"],
+                      [{"t": 0.25, "emotion": "anxious", "confidence": 0.8}])
+    store.record_turn("second", TEXT, "sad", 0.6, [])
+    store.record_turn("third", TEXT, "sad", 0.6, [])
+    # The least recently used session went to disk, not away
+    assert len(store) == 2 and "first" in store
+    assert len(list(tmp_path.iterdir())) == 1
+
+    session = store.get("first", create=False)
+    assert session is not None
+    assert [turn.to_dict()["text"] for turn in session.turns] == ["i am worried about my test"]
+    assert session.turns[0].concerns == ("anxiety",)
+    assert session.emotional_patterns == ["anxious"]
+    assert session.timeline.emotions() == ["anxious"]
+
+
+def test_idle_sessions_spill_on_sweep_and_expired_spills_are_removed(tmp_path):
+    store = VoiceSessionStore(spill_dir=str(tmp_path), idle_seconds=60, ttl_seconds=3600)
+    store.record_turn("idle", TEXT, "calm", 0.5, [])
+    assert store.sweep(now=time.time() + 120) == (0, 1)
+    assert len(store) == 0 and "idle" in store
+
+    assert store.sweep(now=time.time() + 7200) == (1, 0)
+    assert "idle" not in store
+    assert not list(tmp_path.iterdir())
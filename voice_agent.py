@@ -1,30 +1,64 @@
 # voice_mental_health_agent.py
 from uagents import Agent, Context, Model
-from uagents.setup import fund_agent_if_low
 from typing import Dict, List, Optional, Tuple
-import json
-import re
-from datetime import datetime
 import asyncio
 import base64
-import audioop
-import numpy as np
-from scipy import stats
-import speech_recognition as sr
-from gtts import gTTS
-import pygame
 import io
-import threading
+import os
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from server.audio_ingest import decode_audio
+from server.tone_stream import audio_tone_scores
+from voice_tone import ToneFeatures, analyze_tone_track
+from voice_sessions import VoiceSessionStore
+from voice_concerns import detect_concerns, check_safety_concerns
+from server.blob_store import BlobClient, inline_audio
+
+# Headless (servers, CI): never touch a microphone or speakers, skip wallet funding.
+# speech_recognition, gTTS and pygame are imported on first use either way.
+VOICE_HEADLESS = os.getenv("VOICE_HEADLESS", "0").strip().lower() not in ("", "0", "false", "no", "off")
+
+# Large clips travel out of band through a voice server's /blobs endpoint
+VOICE_BLOB_URL = os.getenv("VOICE_BLOB_URL")
+blob_client = BlobClient(VOICE_BLOB_URL)
+
+# --- Worker pools ---
+# Blocking network calls (recognize_google, gTTS) and decoding run on a bounded
+# thread pool; NumPy tone analysis runs on a process pool so it neither blocks
+# the agent's event loop nor contends for the GIL. Its tasks live in
+# voice_tone.py, so workers don't import this module. Where available the
+# workers come from a forkserver preloaded with voice_tone rather than a fork
+# of this (threaded) process.
+VOICE_IO_WORKERS = int(os.getenv("VOICE_IO_WORKERS", "8"))
+VOICE_CPU_WORKERS = int(os.getenv("VOICE_CPU_WORKERS", str(max((os.cpu_count() or 2) - 1, 1))))
+io_pool = ThreadPoolExecutor(max_workers=VOICE_IO_WORKERS, thread_name_prefix="voice-io")
+_cpu_pool = None
+
+
+def cpu_pool() -> ProcessPoolExecutor:
+    """Process pool for audio analysis, started on first use."""
+    global _cpu_pool
+    if _cpu_pool is None:
+        context = None
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(["voice_tone"])
+        _cpu_pool = ProcessPoolExecutor(max_workers=VOICE_CPU_WORKERS, mp_context=context)
+    return _cpu_pool
 
 # Data Models
 class VoiceMessage(Model):
-    audio_data: str  # base64 encoded audio
+    audio_data: str = ""  # base64 encoded audio (small clips, or when no blob server is configured)
+    audio_hash: Optional[str] = None  # sha256 of the audio fetched from audio_url
+    audio_url: Optional[str] = None
     session_id: str
     age: Optional[int] = None
     timestamp: str
 
 class VoiceResponse(Model):
-    audio_response: str  # base64 encoded audio response
+    audio_response: str = ""  # base64 encoded audio response (inline fallback)
+    audio_response_hash: Optional[str] = None
+    audio_response_url: Optional[str] = None
     text_response: str
     tone_analysis: Dict
     concerns_detected: List[str] = []
@@ -36,6 +70,7 @@ class ToneAnalysis(Model):
     confidence: float
     features: Dict
     risk_indicator: bool
+    timeline: List[Dict] = []  # emotion track within the utterance: {t, emotion, confidence, volume, pitch}
 
 # Initialize the agent
 voice_mental_health_agent = Agent(
@@ -45,18 +80,38 @@ voice_mental_health_agent = Agent(
     seed="voice_mental_health_agent_seed_456"
 )
 
-fund_agent_if_low(voice_mental_health_agent.wallet.address())
-
 class VoiceProcessor:
-    def __init__(self):
-        self.recognizer = sr.Recognizer()
-        self.microphone = sr.Microphone()
-        # Calibrate microphone for ambient noise
-        with self.microphone as source:
-            self.recognizer.adjust_for_ambient_noise(source)
+    def __init__(self, headless: bool = VOICE_HEADLESS):
+        # Recognizer, microphone and mixer are created on first use, so importing
+        # this module needs neither audio devices nor the audio libraries
+        self.headless = headless
+        self._recognizer = None
+        self._microphone = None
+        self._mixer_ready = False
+
+    @property
+    def recognizer(self):
+        if self._recognizer is None:
+            import speech_recognition as sr
+            self._recognizer = sr.Recognizer()
+        return self._recognizer
+
+    @property
+    def microphone(self):
+        """Opened and calibrated for ambient noise on first use"""
+        if self.headless:
+            raise RuntimeError("no microphone in headless mode (VOICE_HEADLESS)")
+        if self._microphone is None:
+            import speech_recognition as sr
+            microphone = sr.Microphone()
+            with microphone as source:
+                self.recognizer.adjust_for_ambient_noise(source)
+            self._microphone = microphone
+        return self._microphone
         
     def record_audio(self, duration: int = 5) -> Optional[bytes]:
         """Record audio from microphone"""
+        import speech_recognition as sr
         try:
             print("🎤 Listening...")
             with self.microphone as source:
@@ -71,6 +126,7 @@ class VoiceProcessor:
     
     def audio_to_text(self, audio_data: bytes) -> Tuple[Optional[str], float]:
         """Convert audio to text with confidence score"""
+        import speech_recognition as sr
         try:
             audio = sr.AudioData(audio_data, 16000, 2)  # 16kHz, 16-bit
             text = self.recognizer.recognize_google(audio)
@@ -85,6 +141,7 @@ class VoiceProcessor:
     def text_to_speech(self, text: str) -> bytes:
         """Convert text to speech audio"""
         try:
+            from gtts import gTTS
             tts = gTTS(text=text, lang='en', slow=False)
             audio_buffer = io.BytesIO()
             tts.write_to_fp(audio_buffer)
@@ -96,9 +153,14 @@ class VoiceProcessor:
     
     def play_audio(self, audio_data: bytes):
         """Play audio through speakers"""
+        if self.headless:
+            return
         try:
+            import pygame
             audio_buffer = io.BytesIO(audio_data)
-            pygame.mixer.init()
+            if not self._mixer_ready:
+                pygame.mixer.init()
+                self._mixer_ready = True
             pygame.mixer.music.load(audio_buffer)
             pygame.mixer.music.play()
             while pygame.mixer.music.get_busy():
@@ -106,8 +168,9 @@ class VoiceProcessor:
         except Exception as e:
             print(f"Audio playback error: {e}")
 
-class ToneAnalyzer:
+class ToneAnalyzer(ToneFeatures):
     def __init__(self):
+        super().__init__()
         self.emotional_indicators = {
             'sad': ['low pitch', 'slow speech', 'monotone', 'quiet'],
             'anxious': ['high pitch', 'fast speech', 'trembling', 'stuttering'],
@@ -116,83 +179,11 @@ class ToneAnalyzer:
             'calm': ['steady pitch', 'moderate pace', 'smooth', 'consistent volume']
         }
     
-    def analyze_audio_features(self, audio_data: bytes) -> Dict:
-        """Analyze audio features for emotional tone"""
-        try:
-            # Convert to numpy array for analysis
-            audio_array = np.frombuffer(audio_data, dtype=np.int16)
-            
-            # Basic audio features
-            features = {
-                'volume_mean': np.mean(np.abs(audio_array)),
-                'volume_std': np.std(audio_array),
-                'pitch_variance': self._calculate_pitch_variance(audio_array),
-                'speech_rate': self._estimate_speech_rate(audio_array),
-                'clarity': self._calculate_clarity(audio_array)
-            }
-            
-            return features
-        except Exception as e:
-            print(f"Audio analysis error: {e}")
-            return {}
-    
-    def _calculate_pitch_variance(self, audio_data: np.array) -> float:
-        """Calculate pitch variance as emotional indicator"""
-        try:
-            # Simple pitch estimation using zero-crossing rate
-            zero_crossings = np.where(np.diff(np.signbit(audio_data)))[0]
-            if len(zero_crossings) > 1:
-                return np.std(np.diff(zero_crossings))
-            return 0.0
-        except:
-            return 0.0
-    
-    def _estimate_speech_rate(self, audio_data: np.array) -> float:
-        """Estimate speech rate from audio energy"""
-        try:
-            # Calculate energy variations
-            energy = audio_data.astype(float) ** 2
-            energy_std = np.std(energy)
-            return min(energy_std / 1000, 1.0)  # Normalize
-        except:
-            return 0.5
-    
-    def _calculate_clarity(self, audio_data: np.array) -> float:
-        """Calculate speech clarity"""
-        try:
-            # Simple clarity measure using signal-to-noise ratio approximation
-            rms = np.sqrt(np.mean(audio_data**2))
-            if rms > 0:
-                return min(rms / 10000, 1.0)
-            return 0.5
-        except:
-            return 0.5
-    
-    def detect_emotional_tone(self, audio_features: Dict, text: str) -> ToneAnalysis:
+    def detect_emotional_tone(self, audio_features: Dict, text: str,
+                              timeline: Optional[List[Dict]] = None) -> ToneAnalysis:
         """Detect emotional tone from audio features and text"""
-        emotional_scores = {
-            'sad': 0.0,
-            'anxious': 0.0, 
-            'angry': 0.0,
-            'happy': 0.0,
-            'calm': 0.0
-        }
-        
-        # Analyze based on audio features
-        if audio_features.get('volume_mean', 0) < 1000:
-            emotional_scores['sad'] += 0.3
-        elif audio_features.get('volume_mean', 0) > 5000:
-            emotional_scores['angry'] += 0.3
-        
-        if audio_features.get('pitch_variance', 0) > 50:
-            emotional_scores['anxious'] += 0.3
-        elif audio_features.get('pitch_variance', 0) < 10:
-            emotional_scores['sad'] += 0.2
-        
-        if audio_features.get('speech_rate', 0) > 0.7:
-            emotional_scores['anxious'] += 0.3
-        elif audio_features.get('speech_rate', 0) < 0.3:
-            emotional_scores['sad'] += 0.2
+        # Acoustic cues, scored the same way as the /voice server's tone timeline
+        emotional_scores = audio_tone_scores(audio_features)
         
         # Text-based emotional analysis
         text_lower = text.lower()
@@ -228,14 +219,21 @@ class ToneAnalyzer:
             emotional_tone=dominant_emotion,
             confidence=confidence,
             features=audio_features,
-            risk_indicator=risk_indicator
+            risk_indicator=risk_indicator,
+            timeline=timeline or []
         )
 
 class VoiceMentalHealthEngine:
     def __init__(self):
         self.voice_processor = VoiceProcessor()
         self.tone_analyzer = ToneAnalyzer()
-        self.conversation_sessions = {}
+        self.conversation_sessions = VoiceSessionStore(
+            max_sessions=int(os.getenv("VOICE_SESSION_MAX", "1000")),
+            ttl_seconds=float(os.getenv("VOICE_SESSION_TTL_SECONDS", "3600")),
+            spill_dir=os.getenv("VOICE_SESSION_SPILL_DIR") or None,
+            idle_seconds=float(os.getenv("VOICE_SESSION_IDLE_SECONDS", "600")),
+        )
+        self._fallback_audio = None
         
         # Response templates with emotional awareness
         self.emotional_responses = {
@@ -266,24 +264,57 @@ class VoiceMentalHealthEngine:
             ]
         }
     
+    async def process_voice_message_async(self, audio_data: bytes, session_id: str, age: Optional[int]) -> VoiceResponse:
+        """
+        Non-blocking version of process_voice_message: STT and tone analysis run
+        concurrently on the worker pools, so many sessions can be served at once.
+        """
+        loop = asyncio.get_running_loop()
+        decoded = await loop.run_in_executor(io_pool, decode_audio, audio_data)
+        pcm = decoded.pcm if decoded is not None else audio_data
+
+        stt = loop.run_in_executor(io_pool, self.voice_processor.audio_to_text, pcm)
+        track = loop.run_in_executor(cpu_pool(), analyze_tone_track, pcm)
+        (text, confidence), (audio_features, timeline) = await asyncio.gather(stt, track)
+
+        if not text:
+            return await loop.run_in_executor(io_pool, self._generate_fallback_response)
+
+        tone_analysis = self.tone_analyzer.detect_emotional_tone(audio_features, text, timeline)
+        text_response = self._generate_emotional_response(text, tone_analysis, age)
+        audio_response = await loop.run_in_executor(io_pool, self.voice_processor.text_to_speech, text_response)
+        audio_fields = await blob_client.pack(audio_response)
+        return self._build_response(text, tone_analysis, text_response, audio_response, session_id, audio_fields)
+
     def process_voice_message(self, audio_data: bytes, session_id: str, age: Optional[int]) -> VoiceResponse:
-        """Process voice message and generate response"""
+        """Process voice message and generate response (blocking)"""
+        # Decode once to mono 16 kHz PCM (the format audio_to_text expects);
+        # undecodable clips are used as-is
+        decoded = decode_audio(audio_data)
+        pcm = decoded.pcm if decoded is not None else audio_data
+
         # Convert speech to text
-        text, confidence = self.voice_processor.audio_to_text(audio_data)
+        text, confidence = self.voice_processor.audio_to_text(pcm)
         
         if not text:
             return self._generate_fallback_response()
         
         # Analyze tone from audio
-        audio_features = self.tone_analyzer.analyze_audio_features(audio_data)
-        tone_analysis = self.tone_analyzer.detect_emotional_tone(audio_features, text)
+        audio_features, timeline = self.tone_analyzer.analyze_track(
+            decoded.samples() if decoded is not None else audio_data
+        )
+        tone_analysis = self.tone_analyzer.detect_emotional_tone(audio_features, text, timeline)
         
         # Generate appropriate text response
         text_response = self._generate_emotional_response(text, tone_analysis, age)
         
         # Convert response to speech
         audio_response = self.voice_processor.text_to_speech(text_response)
-        
+        return self._build_response(text, tone_analysis, text_response, audio_response, session_id)
+
+    def _build_response(self, text: str, tone_analysis: ToneAnalysis, text_response: str,
+                        audio_response: Optional[bytes], session_id: str,
+                        audio_fields: Optional[Dict] = None) -> VoiceResponse:
         # Detect concerns from text
         concerns = self._detect_concerns(text)
         safety_alert = self._check_safety_concerns(text)
@@ -291,13 +322,18 @@ class VoiceMentalHealthEngine:
         # Update session
         self._update_session(session_id, text, tone_analysis, concerns)
         
+        if audio_fields is None:
+            audio_fields = {'data': inline_audio(audio_response), 'hash': None, 'url': None}
         return VoiceResponse(
-            audio_response=base64.b64encode(audio_response).decode() if audio_response else "",
+            audio_response=audio_fields['data'],
+            audio_response_hash=audio_fields['hash'],
+            audio_response_url=audio_fields['url'],
             text_response=text_response,
             tone_analysis={
                 'emotional_tone': tone_analysis.emotional_tone,
                 'confidence': tone_analysis.confidence,
-                'risk_indicator': tone_analysis.risk_indicator
+                'risk_indicator': tone_analysis.risk_indicator,
+                'timeline': tone_analysis.timeline
             },
             concerns_detected=concerns,
             safety_alert=safety_alert,
@@ -338,31 +374,19 @@ class VoiceMentalHealthEngine:
     
     def _detect_concerns(self, text: str) -> List[str]:
         """Detect mental health concerns from text"""
-        concerns = []
-        text_lower = text.lower()
-        
-        concern_patterns = {
-            'depression': ['sad', 'hopeless', 'tired', 'no energy', 'cant sleep'],
-            'anxiety': ['worried', 'nervous', 'scared', 'panic', 'anxious'],
-            'self_harm': ['hurt myself', 'cut myself', 'want to die'],
-            'bullying': ['tease me', 'bullied', 'no friends', 'everyone hates']
-        }
-        
-        for concern, keywords in concern_patterns.items():
-            if any(keyword in text_lower for keyword in keywords):
-                concerns.append(concern)
-        
-        return concerns
+        return detect_concerns(text)
     
     def _check_safety_concerns(self, text: str) -> bool:
         """Check for immediate safety concerns"""
-        safety_keywords = ['kill myself', 'suicide', 'hurt myself', 'want to die']
-        return any(keyword in text.lower() for keyword in safety_keywords)
+        return check_safety_concerns(text)
     
     def _generate_fallback_response(self) -> VoiceResponse:
         """Generate response when speech isn't understood"""
         fallback_text = "I didn't quite catch that. Could you please try saying it again?"
-        fallback_audio = self.voice_processor.text_to_speech(fallback_text)
+        # The fallback never changes, so it is synthesized once
+        if self._fallback_audio is None:
+            self._fallback_audio = self.voice_processor.text_to_speech(fallback_text)
+        fallback_audio = self._fallback_audio
         
         return VoiceResponse(
             audio_response=base64.b64encode(fallback_audio).decode() if fallback_audio else "",
@@ -375,22 +399,10 @@ class VoiceMentalHealthEngine:
     
     def _update_session(self, session_id: str, text: str, tone_analysis: ToneAnalysis, concerns: List[str]):
         """Update conversation session"""
-        if session_id not in self.conversation_sessions:
-            self.conversation_sessions[session_id] = {
-                'history': [],
-                'emotional_patterns': [],
-                'start_time': datetime.now()
-            }
-        
-        session = self.conversation_sessions[session_id]
-        session['history'].append({
-            'text': text,
-            'tone': tone_analysis.emotional_tone,
-            'confidence': tone_analysis.confidence,
-            'timestamp': datetime.now(),
-            'concerns': concerns
-        })
-        session['emotional_patterns'].append(tone_analysis.emotional_tone)
+        self.conversation_sessions.record_turn(
+            session_id, text, tone_analysis.emotional_tone, tone_analysis.confidence,
+            concerns, tone_analysis.timeline
+        )
 
 # Initialize the engine
 voice_engine = VoiceMentalHealthEngine()
@@ -399,16 +411,33 @@ voice_engine = VoiceMentalHealthEngine()
 async def startup(ctx: Context):
     ctx.logger.info(f"Voice Mental Health Agent started: {voice_mental_health_agent.name}")
     ctx.logger.info(f"Agent address: {voice_mental_health_agent.address}")
+    if VOICE_HEADLESS:
+        return
+    # Funding is a network round trip: run it in the background instead of at import
+    from uagents.setup import fund_agent_if_low
+    funding = asyncio.get_running_loop().run_in_executor(
+        io_pool, fund_agent_if_low, voice_mental_health_agent.wallet.address()
+    )
+
+    def report_funding(future):
+        if not future.cancelled() and future.exception() is not None:
+            ctx.logger.warning(f"Agent funding check failed: {future.exception()}")
+
+    funding.add_done_callback(report_funding)
 
 @voice_mental_health_agent.on_message(model=VoiceMessage)
 async def handle_voice_message(ctx: Context, sender: str, msg: VoiceMessage):
     ctx.logger.info(f"Received voice message from {sender}")
     
-    # Decode audio data
-    audio_data = base64.b64decode(msg.audio_data)
+    # Audio arrives inline (base64) or by reference to a blob
+    try:
+        audio_data = await blob_client.unpack(msg.audio_data, msg.audio_hash, msg.audio_url)
+    except Exception as e:
+        ctx.logger.warning(f"Could not fetch voice message audio: {e}")
+        audio_data = b""
     
-    # Process voice message
-    response = voice_engine.process_voice_message(audio_data, msg.session_id, msg.age)
+    # Process voice message off the event loop
+    response = await voice_engine.process_voice_message_async(audio_data, msg.session_id, msg.age)
     
     # Send response back
     await ctx.send(sender, response)
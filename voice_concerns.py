@@ -0,0 +1,28 @@
+# voice_concerns.py
+"""
+Keyword concern and safety detection on transcripts, shared by the voice agent
+and offline batch analysis (no agent or audio dependencies).
+"""
+from typing import Dict, List
+
+CONCERN_PATTERNS: Dict[str, List[str]] = {
+    'depression': ['sad', 'hopeless', 'tired', 'no energy', 'cant sleep'],
+    'anxiety': ['worried', 'nervous', 'scared', 'panic', 'anxious'],
+    'self_harm': ['hurt myself', 'cut myself', 'want to die'],
+    'bullying': ['tease me', 'bullied', 'no friends', 'everyone hates']
+}
+
+SAFETY_KEYWORDS = ['kill myself', 'suicide', 'hurt myself', 'want to die']
+
+
+def detect_concerns(text: str) -> List[str]:
+    """Detect mental health concerns from text"""
+    text_lower = text.lower()
+    return [concern for concern, keywords in CONCERN_PATTERNS.items()
+            if any(keyword in text_lower for keyword in keywords)]
+
+
+def check_safety_concerns(text: str) -> bool:
+    """Check for immediate safety concerns"""
+    text_lower = text.lower()
+    return any(keyword in text_lower for keyword in SAFETY_KEYWORDS)
@@ -0,0 +1,259 @@
+# voice_sessions.py
+"""
+Bounded, compact session store for the voice agent.
+
+Each session keeps:
+  * the last MAX_TURNS turns as `__slots__` records (epoch timestamp, text
+    capped at MAX_TEXT_CHARS, tone code, confidence, concerns tuple);
+  * two emotion timelines backed by `array` columns: one point per turn (what
+    used to be `emotional_patterns`) and the per-utterance tone track. Emotions
+    are stored as one-byte codes, confidences and times as float32; times are
+    seconds since the session started.
+
+The store is an LRU (`OrderedDict`) capped at `max_sessions`; sessions not seen
+for `ttl_seconds` are expired. With a `spill_dir`, sessions idle for
+`idle_seconds` (and LRU victims) are pickled to disk instead of dropped and
+are loaded back transparently on their next turn.
+"""
+import hashlib
+import os
+import pickle
+import sys
+import time
+from array import array
+from collections import OrderedDict, deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+EMOTIONS = ("unknown", "sad", "anxious", "angry", "happy", "calm", "silence")
+EMOTION_CODES = {emotion: code for code, emotion in enumerate(EMOTIONS)}
+
+MAX_TURNS = 50
+MAX_TEXT_CHARS = 500
+MAX_TIMELINE_POINTS = 2000
+SWEEP_INTERVAL_SECONDS = 30.0
+
+_NO_CONCERNS: Tuple[str, ...] = ()
+
+
+def emotion_code(emotion: str) -> int:
+    return EMOTION_CODES.get(emotion, 0)
+
+
+class TurnRecord:
+    """One voice turn, without the audio."""
+
+    __slots__ = ("timestamp", "text", "tone", "confidence", "concerns")
+
+    def __init__(self, timestamp: float, text: str, tone: int, confidence: float, concerns: Tuple[str, ...]):
+        self.timestamp = timestamp
+        self.text = text
+        self.tone = tone
+        self.confidence = confidence
+        self.concerns = concerns
+
+    @property
+    def emotion(self) -> str:
+        return EMOTIONS[self.tone]
+
+    def to_dict(self) -> Dict:
+        return {"timestamp": self.timestamp, "text": self.text, "tone": self.emotion,
+                "confidence": self.confidence, "concerns": list(self.concerns)}
+
+    def __getstate__(self):
+        return (self.timestamp, self.text, self.tone, self.confidence, self.concerns)
+
+    def __setstate__(self, state):
+        self.timestamp, self.text, self.tone, self.confidence, self.concerns = state
+
+
+class EmotionTimeline:
+    """Column-oriented (time, emotion, confidence) track; keeps the newest `max_points`."""
+
+    __slots__ = ("times", "codes", "confidences", "max_points")
+
+    def __init__(self, max_points: int = MAX_TIMELINE_POINTS):
+        self.times = array("f")
+        self.codes = array("B")
+        self.confidences = array("f")
+        self.max_points = max_points
+
+    def __len__(self):
+        return len(self.codes)
+
+    def append(self, t: float, emotion: str, confidence: float):
+        self.times.append(t)
+        self.codes.append(emotion_code(emotion))
+        self.confidences.append(confidence)
+        if len(self.codes) > self.max_points:
+            # Drop the oldest quarter at once so trimming stays amortized O(1)
+            drop = len(self.codes) - self.max_points + self.max_points // 4
+            del self.times[:drop], self.codes[:drop], self.confidences[:drop]
+
+    def emotions(self) -> List[str]:
+        return [EMOTIONS[code] for code in self.codes]
+
+    def counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for code in self.codes:
+            counts[EMOTIONS[code]] = counts.get(EMOTIONS[code], 0) + 1
+        return counts
+
+    def to_dicts(self) -> List[Dict]:
+        return [{"t": round(t, 3), "emotion": EMOTIONS[code], "confidence": round(confidence, 3)}
+                for t, code, confidence in zip(self.times, self.codes, self.confidences)]
+
+    def __getstate__(self):
+        return (self.times.tobytes(), self.codes.tobytes(), self.confidences.tobytes(), self.max_points)
+
+    def __setstate__(self, state):
+        times, codes, confidences, self.max_points = state
+        self.times, self.codes, self.confidences = array("f"), array("B"), array("f")
+        self.times.frombytes(times)
+        self.codes.frombytes(codes)
+        self.confidences.frombytes(confidences)
+
+
+class VoiceSessionState:
+    __slots__ = ("session_id", "started_at", "last_seen", "turns", "patterns", "timeline")
+
+    def __init__(self, session_id: str, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        self.session_id = session_id
+        self.started_at = now
+        self.last_seen = now
+        self.turns = deque(maxlen=MAX_TURNS)
+        self.patterns = EmotionTimeline()
+        self.timeline = EmotionTimeline()
+
+    @property
+    def emotional_patterns(self) -> List[str]:
+        return self.patterns.emotions()
+
+    def add_turn(self, text: str, emotion: str, confidence: float, concerns: Iterable[str],
+                 tone_points: Iterable[Dict] = (), now: Optional[float] = None):
+        now = time.time() if now is None else now
+        self.last_seen = now
+        offset = now - self.started_at
+        concerns = tuple(sys.intern(c) for c in concerns) or _NO_CONCERNS
+        self.turns.append(TurnRecord(now, text[:MAX_TEXT_CHARS], emotion_code(emotion), confidence, concerns))
+        self.patterns.append(offset, emotion, confidence)
+        for point in tone_points:
+            self.timeline.append(offset + point["t"], point["emotion"], point["confidence"])
+
+    def __getstate__(self):
+        return (self.session_id, self.started_at, self.last_seen, list(self.turns), self.patterns, self.timeline)
+
+    def __setstate__(self, state):
+        self.session_id, self.started_at, self.last_seen, turns, self.patterns, self.timeline = state
+        self.turns = deque(turns, maxlen=MAX_TURNS)
+
+
+class VoiceSessionStore:
+    """LRU + TTL bounded map of session_id -> VoiceSessionState, optionally spilling to disk."""
+
+    def __init__(self, max_sessions: int = 1000, ttl_seconds: float = 3600.0,
+                 spill_dir: Optional[str] = None, idle_seconds: float = 600.0):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.spill_dir = spill_dir
+        self.idle_seconds = idle_seconds
+        self._sessions: "OrderedDict[str, VoiceSessionState]" = OrderedDict()
+        self._spilled = set()
+        self._last_sweep = time.monotonic()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions or session_id in self._spilled
+
+    # --- access ---
+    def get(self, session_id: str, create: bool = True) -> Optional[VoiceSessionState]:
+        session = self._sessions.get(session_id)
+        if session is not None:
+            self._sessions.move_to_end(session_id)
+            return session
+        if session_id in self._spilled:
+            session = self._load(session_id)
+        if session is not None and time.time() - session.last_seen > self.ttl_seconds:
+            session = None
+        if session is None:
+            if not create:
+                return None
+            session = VoiceSessionState(session_id)
+        self._sessions[session_id] = session
+        self._evict()
+        return session
+
+    def record_turn(self, session_id: str, text: str, emotion: str, confidence: float,
+                    concerns: Iterable[str], tone_points: Iterable[Dict] = ()) -> VoiceSessionState:
+        session = self.get(session_id)
+        session.add_turn(text, emotion, confidence, concerns, tone_points)
+        self._maybe_sweep()
+        return session
+
+    # --- bounding ---
+    def _evict(self):
+        while len(self._sessions) > self.max_sessions:
+            _, victim = self._sessions.popitem(last=False)
+            self._spill(victim)
+
+    def _maybe_sweep(self):
+        if time.monotonic() - self._last_sweep >= SWEEP_INTERVAL_SECONDS:
+            self.sweep()
+
+    def sweep(self, now: Optional[float] = None) -> Tuple[int, int]:
+        """Expires sessions past their TTL and spills idle ones. Returns (expired, spilled)."""
+        now = time.time() if now is None else now
+        self._last_sweep = time.monotonic()
+        expired = spilled = 0
+        for session_id in list(self._sessions):
+            session = self._sessions[session_id]
+            idle = now - session.last_seen
+            if idle > self.ttl_seconds:
+                del self._sessions[session_id]
+                expired += 1
+            elif self.spill_dir and idle > self.idle_seconds:
+                del self._sessions[session_id]
+                self._spill(session)
+                spilled += 1
+        for session_id in list(self._spilled):
+            path = self._path(session_id)
+            try:
+                if now - os.path.getmtime(path) > self.ttl_seconds:
+                    os.remove(path)
+                    self._spilled.discard(session_id)
+                    expired += 1
+            except OSError:
+                self._spilled.discard(session_id)
+        return expired, spilled
+
+    # --- spill to disk ---
+    def _path(self, session_id: str) -> str:
+        return os.path.join(self.spill_dir, hashlib.sha1(session_id.encode("utf-8")).hexdigest() + ".pkl")
+
+    def _spill(self, session: VoiceSessionState):
+        if not self.spill_dir:
+            return
+        path = self._path(session.session_id)
+        try:
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump(session, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + ".tmp", path)
+            self._spilled.add(session.session_id)
+        except OSError as e:
+            print(f"⚠️ Could not spill voice session {session.session_id}: {e}")
+
+    def _load(self, session_id: str) -> Optional[VoiceSessionState]:
+        self._spilled.discard(session_id)
+        path = self._path(session_id)
+        try:
+            with open(path, "rb") as f:
+                session = pickle.load(f)
+            os.remove(path)
+            return session
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            print(f"⚠️ Could not load spilled voice session {session_id}: {e}")
+            return None
@@ -0,0 +1,78 @@
+# voice_tone.py
+"""
+Acoustic tone analysis for the voice agent, and the entry points its process
+pool runs. Kept apart from voice_agent.py so that a worker process only
+imports this module and NumPy, never the agent, engine or session store.
+"""
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from server.audio_features import FeatureExtractor, FrameFeatures
+from server.tone_stream import StreamingToneAnalyzer
+
+
+class ToneFeatures:
+    """Per-frame and summary tone features of 16 kHz 16-bit PCM clips."""
+
+    def __init__(self):
+        self.extractor = FeatureExtractor(sample_rate=16000)
+
+    def _samples(self, audio_data) -> np.ndarray:
+        # int16 samples or raw PCM bytes (a view, not a copy)
+        if isinstance(audio_data, np.ndarray):
+            return audio_data
+        return np.frombuffer(audio_data, dtype=np.int16, count=len(audio_data) // 2)
+
+    def analyze_frames(self, audio_data) -> FrameFeatures:
+        """Per-frame RMS, ZCR and pitch tracks for a clip"""
+        return self.extractor.extract(self._samples(audio_data))
+
+    def analyze_audio_features(self, audio_data) -> Dict:
+        """Analyze audio features for emotional tone (int16 samples or raw PCM bytes)"""
+        try:
+            return self.analyze_frames(audio_data).summary()
+        except Exception as e:
+            print(f"Audio analysis error: {e}")
+            return {}
+
+    def analyze_track(self, audio_data) -> Tuple[Dict, List[Dict]]:
+        """Summary features plus the emotion timeline of a clip"""
+        try:
+            analyzer = StreamingToneAnalyzer(sample_rate=16000)
+            analyzer.feed(self._samples(audio_data))
+            return analyzer.summary(), analyzer.timeline_dicts()
+        except Exception as e:
+            print(f"Audio analysis error: {e}")
+            return {}, []
+
+    def analyze_batch(self, clips: List) -> List[Dict]:
+        """Summary features for many clips in one pass"""
+        return [frames.summary() for frames in self.extractor.extract_batch([self._samples(c) for c in clips])]
+
+
+# --- Process-pool entry points ---
+_worker_features = None
+
+
+def _features() -> ToneFeatures:
+    # One extractor (and its feature buffers) per worker process
+    global _worker_features
+    if _worker_features is None:
+        _worker_features = ToneFeatures()
+    return _worker_features
+
+
+def analyze_tone_features(pcm: bytes) -> Dict:
+    """Process-pool entry point: tone features of mono 16 kHz 16-bit PCM."""
+    return _features().analyze_audio_features(pcm)
+
+
+def analyze_tone_track(pcm: bytes) -> Tuple[Dict, List[Dict]]:
+    """Process-pool entry point: tone features and emotion timeline of a PCM clip."""
+    return _features().analyze_track(pcm)
+
+
+def analyze_tone_features_batch(clips: List[bytes]) -> List[Dict]:
+    """Process-pool entry point: tone features of many PCM clips in one task."""
+    return _features().analyze_batch(clips)